@@ -1,12 +1,34 @@
-from flask import Flask, request, render_template, jsonify
-from elasticsearch import Elasticsearch
-import requests
-from bs4 import BeautifulSoup
+from flask import Flask, request, render_template, jsonify, url_for
+import json
 import os
 from dotenv import load_dotenv
 import logging
-from datetime import datetime
-from urllib.parse import urljoin
+import time
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+from backends import create_backend
+from batch_ingest import bulk_ingest, parse_url_list, summarize
+from es_client import ElasticsearchManager
+from extraction import extractor
+from fingerprints import check_document
+import http_cache
+from http_cache import IndexETags, cache_headers, etag_matches
+from indexing import build_document, document_id, normalize_url
+from ingest_queue import IngestQueue, QueueFullError
+import metrics
+from metrics import WRITES_SKIPPED, stage
+from pagination import InvalidCursorError, decode_cursor, encode_cursor, page_size_arg
+from crawl_state import crawl_state
+from recrawl import RECRAWL, RecrawlScheduler
+from scraper import scrape_url
+from search_cache import create_search_cache
+from search_queries import (LIST_CURSOR_SHAPE, SEARCH_COLLAPSE_DUPLICATES, collapse_duplicates, compact_search_hits,
+                            format_listing, format_search_hits, next_search_cursor, reciprocal_rank_fusion,
+                            search_page_args)
+from semantic_index import EmbeddingQueue, create_semantic_index
+from suggest_index import SUGGEST_LIMIT, SUGGEST_MAX_LIMIT, SuggestIndex
+from tenancy import user_from_headers
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,270 +37,392 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Fork the extraction workers (EXTRACTION_WORKERS) before this process starts threads of its own
+extractor.start()
+
 app = Flask(__name__)
-es = None
 
-# Get Elasticsearch credentials from environment variables
-ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
-ELASTIC_CERT_PATH = os.getenv('ELASTIC_CERT_PATH')
-ELASTIC_HOST = os.getenv('ELASTIC_HOST', 'localhost')
-ELASTIC_PORT = os.getenv('ELASTIC_PORT', '9200')
-ELASTIC_USE_SSL = os.getenv('ELASTIC_USE_SSL', 'true').lower() == 'true'
+# Per-route latency histograms, in-flight gauge and GET /metrics
+metrics.init_app(app)
+# gzip/br for JSON responses above RESPONSE_COMPRESSION_MIN_BYTES
+http_cache.init_app(app)
 
-def create_elasticsearch_client():
-    """Create Elasticsearch client with appropriate configuration"""
-    try:
-        config = {
-            'hosts': [f"{'https' if ELASTIC_USE_SSL else 'http'}://{ELASTIC_HOST}:{ELASTIC_PORT}"],
-            'basic_auth': ("elastic", ELASTIC_PASSWORD)
-        }
-        
-        if ELASTIC_USE_SSL:
-            config.update({
-                'ca_certs': ELASTIC_CERT_PATH,
-                'verify_certs': True
-            })
-        else:
-            config.update({
-                'verify_certs': False
-            })
-            
-        client = Elasticsearch(**config)
-        if client.ping():
-            print("Successfully connected to Elasticsearch!")
-            return client
-        else:
-            print("Failed to ping Elasticsearch")
-            return None
-    except Exception as e:
-        print(f"Failed to connect to Elasticsearch: {str(e)}")
-        return None
+# Ingestion settings: "sync" scrapes inside the request, "queue" hands the URL to background workers
+INGEST_MODE = os.getenv('INGEST_MODE', 'sync').lower()
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '4'))
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '1000'))
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', '3'))
+INGEST_RETRY_BACKOFF = float(os.getenv('INGEST_RETRY_BACKOFF', '2.0'))
+BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', '5000'))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '32'))
 
-# Initialize Elasticsearch client
-es = create_elasticsearch_client()
+# Search settings: "lexical" uses the backend only, "hybrid" fuses it with the vector store
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'lexical').lower()
+SEMANTIC_SEARCH_TIMEOUT = float(os.getenv('SEMANTIC_SEARCH_TIMEOUT', '2.0'))
 
-if es:
-    try:
-        if not es.indices.exists(index="webpages"):
-            es.indices.create(index="webpages", body={
-                "settings": {
-                    "analysis": {
-                        "analyzer": {
-                            "custom_analyzer": {
-                                "type": "custom",
-                                "tokenizer": "standard",
-                                "filter": ["lowercase", "custom_edge_ngram"]
-                            }
-                        },
-                        "filter": {
-                            "custom_edge_ngram": {
-                                "type": "edge_ngram",
-                                "min_gram": 2,
-                                "max_gram": 10
-                            }
-                        }
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "url": {"type": "keyword"},
-                        "content": {
-                            "type": "text",
-                            "analyzer": "custom_analyzer",
-                            "search_analyzer": "standard"
-                        },
-                        "title": {
-                            "type": "text",
-                            "analyzer": "custom_analyzer",
-                            "search_analyzer": "standard",
-                            "fields": {
-                                "keyword": {
-                                    "type": "keyword"
-                                }
-                            }
-                        },
-                        "favicon": {"type": "keyword"},
-                        "timestamp": {"type": "date"}
-                    }
-                }
-            })
-            print("Created 'webpages' index with edge ngram analyzer")
-    except Exception as e:
-        print(f"Error creating index: {str(e)}")
-        es = None
+# Connected lazily on first use; reconnects with backoff behind a circuit breaker
+es_manager = ElasticsearchManager()
 
-def scrape_url(url):
-    try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        # Get title
-        title = soup.title.string if soup.title else "No title"
-        
-        # Find favicon
-        favicon = None
-        favicon_link = soup.find('link', rel=lambda r: r and ('icon' in r.lower() or 'shortcut' in r.lower()))
-        if favicon_link and favicon_link.get('href'):
-            favicon = urljoin(url, favicon_link['href'])
-        else:
-            # Try default favicon location
-            default_favicon = urljoin(url, '/favicon.ico')
-            try:
-                favicon_response = requests.head(default_favicon)
-                if favicon_response.status_code == 200:
-                    favicon = default_favicon
-            except:
-                pass
-
-        text = soup.get_text(separator=' ', strip=True)
-        return {
-            "title": title,
-            "content": text,
-            "favicon": favicon
-        }
-    except Exception as e:
-        return None
+# Elasticsearch, or the embedded index when SEARCH_BACKEND=embedded
+backend = create_backend(es_manager)
+
+def backend_unavailable():
+    """503 response used while the backend is down or the circuit breaker is open"""
+    return jsonify({"error": f"{backend.name} is not available"}), 503, {"Retry-After": str(backend.retry_after())}
+
+# Cache of serialized /search responses, invalidated whenever the index changes
+search_cache = create_search_cache()
+
+# Title/URL prefix trie behind /suggest, loaded from the backend on first use
+suggest_index = SuggestIndex(backend, search_cache)
+
+def index_changed():
+    """Invalidate cached search results after a write to the webpages index"""
+    if search_cache:
+        suggest_index.advance(search_cache.invalidate())
+
+# ETags of /urls and /search, derived from the search cache generation so a 304 needs no backend query
+index_etags = IndexETags(search_cache)
+
+def not_modified():
+    """The ETag of this request, and a 304 response if the client already has that version"""
+    etag = index_etags.etag(request.path, request.args.items(multi=True), current_user())
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return etag, ('', 304, cache_headers(etag))
+    return etag, None
+
+# Chunk embeddings in chroma_db for hybrid search; None when the vector store is unavailable.
+# The embedder loads on the first hybrid search or embedded page, in the background
+semantic_index = create_semantic_index(lazy=True)
+embedding_queue = EmbeddingQueue(semantic_index, on_change=index_changed) if semantic_index else None
+# Runs the vector query while the request thread waits on the lexical one
+semantic_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="semantic-search")
+
+def current_user():
+    """Owner of the library this request works on (None: the shared library)"""
+    return user_from_headers(request.headers)
+
+def page_stored(document):
+    """Update the in-process indexes that follow the backend after a page is stored"""
+    # They hold the shared library only; per-user libraries are served by the backend alone
+    if document.get("user_id"):
+        return
+    suggest_index.add(document["url"], document["title"], document["favicon"], document["timestamp"])
+    if embedding_queue:
+        embedding_queue.add(document["url"], document["title"], document["favicon"], document["content"])
+
+def page_fetched(url, scraped_data, user_id=None):
+    """Remember the validators of a page whose stored copy is current, for conditional re-crawls"""
+    crawl_state.track(url, scraped_data.get("etag"), scraped_data.get("last_modified"), user_id)
+
+# Re-fetches stored pages in the background when RECRAWL=true
+recrawler = RecrawlScheduler(backend, crawl_state, on_indexed=page_stored, on_change=index_changed)
+if RECRAWL:
+    recrawler.start()
 
 @app.route('/')
 def home():
     return render_template('index.html')
 
+class IngestError(Exception):
+    """Raised when a URL cannot be scraped or stored"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+def ingest_url(url, user_id=None):
+    """Scrape a URL and store its content in a library of the webpages index"""
+    if not backend.available():
+        raise IngestError(f"{backend.name} is not available", 503)
+
+    scraped_data = scrape_url(url)
+    if not scraped_data:
+        raise IngestError("Failed to scrape URL", 400)
+
+    document = build_document(url, scraped_data, user_id)
+    # Keyed by the owner and normalized URL, so re-adding a page overwrites it in place
+    doc_id = document_id(url, user_id)
+    try:
+        with stage('fingerprint_check'):
+            status = check_document(backend, doc_id, document)
+        if status == "index":
+            backend.index_document(doc_id, document)
+    except Exception as e:
+        backend.report_error(e)
+        app.logger.error(f"Indexing error: {str(e)}")
+        raise IngestError("Failed to store URL content")
+
+    result = {"url": url, "title": scraped_data["title"], "status": "indexed" if status == "index" else status,
+              "duplicate_of": document.get("duplicate_of")}
+    if status != "duplicate":
+        page_fetched(url, scraped_data, user_id)
+    if status != "index":
+        # Nothing was written, so caches and the in-process indexes are still current
+        WRITES_SKIPPED.labels(status).inc()
+        app.logger.info(f"Skipped writing {url}: {status}")
+        return result
+    page_stored(document)
+    index_changed()
+    return result
+
+ingest_queue = IngestQueue(
+    ingest_url,
+    workers=INGEST_WORKERS,
+    max_size=INGEST_QUEUE_SIZE,
+    max_attempts=INGEST_MAX_ATTEMPTS,
+    backoff_base=INGEST_RETRY_BACKOFF
+)
+
 @app.route('/add_url', methods=['POST'])
 def add_url():
-    if not es:
-        return jsonify({"error": "Elasticsearch is not available"}), 503
+    if not backend.available():
+        return backend_unavailable()
 
     url = request.form.get('url')
     if not url:
         return jsonify({"error": "No URL provided"}), 400
 
-    scraped_data = scrape_url(url)
-    if not scraped_data:
-        return jsonify({"error": "Failed to scrape URL"}), 400
+    user_id = current_user()
+    mode = request.form.get('mode', INGEST_MODE).lower()
+    if mode == 'queue':
+        try:
+            job = ingest_queue.submit(url, user_id=user_id)
+        except QueueFullError as e:
+            return jsonify({"error": str(e)}), 503
+        return jsonify({
+            "message": "URL queued for ingestion",
+            "job_id": job["id"],
+            "status_url": url_for('job_status', job_id=job["id"])
+        }), 202
 
     try:
-        es.index(index="webpages", body={
-            "url": url,
-            "title": scraped_data["title"],
-            "content": scraped_data["content"],
-            "favicon": scraped_data["favicon"],
-            "timestamp": datetime.utcnow().isoformat()  # Add timestamp
-        })
-        return jsonify({"message": "URL added successfully"})
+        result = ingest_url(url, user_id)
+        if result["status"] == "duplicate":
+            return jsonify({"message": "URL not stored, its content duplicates another page",
+                            "status": result["status"], "duplicate_of": result["duplicate_of"]})
+        return jsonify({"message": "URL added successfully", "status": result["status"],
+                        "duplicate_of": result["duplicate_of"]})
+    except IngestError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+@app.route('/add_urls', methods=['POST'])
+def add_urls():
+    if not backend.available():
+        return backend_unavailable()
+
+    # Accept {"urls": [...]} as JSON, or a raw NDJSON / one-URL-per-line body
+    payload = request.get_json(silent=True)
+    try:
+        if isinstance(payload, dict):
+            urls = parse_url_list(payload.get('urls') or [])
+        else:
+            urls = parse_url_list(request.get_data(as_text=True))
+    except ValueError:
+        return jsonify({"error": "Malformed URL list"}), 400
+
+    if not urls:
+        return jsonify({"error": "No URLs provided"}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({"error": f"Too many URLs, the limit is {BATCH_MAX_URLS} per request"}), 400
+
+    concurrency = min(request.args.get('concurrency', 8, type=int), BATCH_MAX_CONCURRENCY)
+    chunk_size = request.args.get('chunk_size', 500, type=int)
+    user_id = current_user()
+
+    try:
+        with stage('bulk_ingest'):
+            results = bulk_ingest(backend, urls, concurrency=max(concurrency, 1), chunk_size=max(chunk_size, 1),
+                                  on_indexed=page_stored, on_fetched=functools.partial(page_fetched, user_id=user_id),
+                                  user_id=user_id)
     except Exception as e:
-        app.logger.error(f"Elasticsearch indexing error: {str(e)}")
-        return jsonify({"error": "Failed to store URL content"}), 500
+        backend.report_error(e)
+        logger.error(f"Bulk ingestion error: {str(e)}")
+        return jsonify({"error": f"Failed to store URLs: {str(e)}"}), 500
+
+    summary = summarize(results)
+    if summary["indexed"]:
+        index_changed()
+    return jsonify({**summary, "results": results})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingest_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+def semantic_search(query):
+    """Nearest pages from the vector store that the shared library still has, timed as the semantic_search stage"""
+    with stage('semantic_search'):
+        pages = semantic_index.search(query)
+    # The store can hold vectors of pages the index does not (e.g. ones shipped in chroma_db),
+    # which could be neither opened nor deleted from the results
+    stored = backend.existing_ids([document_id(page["url"]) for page in pages])
+    return [page for page in pages if document_id(page["url"]) in stored]
+
+def hybrid_search_hits(query, lexical_hits, semantic_future, size):
+    """Fuse lexical results with the vector query's by reciprocal rank fusion, keeping at most ``size``"""
+    try:
+        semantic_hits = semantic_future.result(timeout=SEMANTIC_SEARCH_TIMEOUT)
+    except Exception as e:
+        # Degrade to the lexical ranking rather than failing the search
+        app.logger.error(f"Semantic search error for '{query}': {str(e)}")
+        semantic_hits = []
+
+    items = {hit["url"]: hit for hit in semantic_hits}
+    items.update((hit["url"], hit) for hit in lexical_hits)
+    fused = reciprocal_rank_fusion([[hit["url"] for hit in lexical_hits], [hit["url"] for hit in semantic_hits]])
+    return [{
+        "url": url,
+        "title": items[url]["title"],
+        "favicon": items[url].get("favicon"),
+        "score": score,
+        "highlight": items[url].get("highlight", {}),
+        "snippet": items[url].get("snippet")
+    } for url, score in fused[:min(size, max(len(lexical_hits), len(semantic_hits)))]]
 
 @app.route('/search', methods=['GET'])
 def search():
-    if not es:
-        return jsonify({"error": "Elasticsearch is not available"}), 503
-
+    # Passing size, from or cursor switches to paged responses: {"results": [...], "next_cursor": ...}
+    paged = any(name in request.args for name in ('size', 'from', 'cursor'))
     query = request.args.get('q')
     if not query:
-        return jsonify([])
+        return jsonify({"results": [], "next_cursor": None} if paged else [])
 
+    mode = request.args.get('mode', SEARCH_MODE).lower()
+    if mode not in ('lexical', 'hybrid'):
+        return jsonify({"error": "mode must be 'lexical' or 'hybrid'"}), 400
+    # format=compact leaves out the highlight dict the snippet is taken from
+    response_format = request.args.get('format', 'full').lower()
+    if response_format not in ('full', 'compact'):
+        return jsonify({"error": "format must be 'full' or 'compact'"}), 400
     try:
-        results = es.search(index="webpages", body={
-            "query": {
-                "bool": {
-                    "should": [
-                        {
-                            "match": {
-                                "title": {
-                                    "query": query,
-                                    "boost": 2.0,
-                                    "fuzziness": "AUTO",
-                                    "prefix_length": 2
-                                }
-                            }
-                        },
-                        {
-                            "match": {
-                                "content": {
-                                    "query": query,
-                                    "fuzziness": "AUTO",
-                                    "prefix_length": 2
-                                }
-                            }
-                        },
-                        {
-                            "multi_match": {
-                                "query": query,
-                                "fields": ["title", "content"],
-                                "type": "phrase_prefix"
-                            }
-                        }
-                    ],
-                    "minimum_should_match": 1
-                }
-            },
-            "highlight": {
-                "fields": {
-                    "content": {
-                        "fragment_size": 150,
-                        "number_of_fragments": 1,
-                        "pre_tags": ["<mark>"],
-                        "post_tags": ["</mark>"]
-                    },
-                    "title": {
-                        "fragment_size": 150,
-                        "number_of_fragments": 1,
-                        "pre_tags": ["<mark>"],
-                        "post_tags": ["</mark>"]
-                    }
-                }
-            }
-        })
+        size, offset, tier, search_after = search_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    user_id = current_user()
+    # The vector store holds the shared library only
+    if mode == 'hybrid' and (not semantic_index or user_id):
+        mode = 'lexical'
+    # Fused rankings have no position to continue from
+    if mode == 'hybrid' and (offset or search_after):
+        return jsonify({"error": "Only lexical results can be paged with from or cursor"}), 400
+    # collapse=false lists every near-duplicate page instead of one per cluster
+    collapse = request.args.get('collapse', str(SEARCH_COLLAPSE_DUPLICATES)).lower() == 'true'
 
-        return jsonify([{
-            "url": hit["_source"]["url"],
-            "title": hit["_source"]["title"],
-            "favicon": hit["_source"].get("favicon"),
-            "score": hit["_score"],
-            "highlight": hit.get("highlight", {}),
-            "snippet": hit["highlight"]["content"][0] if "content" in hit.get("highlight", {}) else None
-        } for hit in results["hits"]["hits"]])
+    etag, response = not_modified()
+    if response:
+        return response
+
+    # The key embeds the index generation, so any add or delete makes older entries unreachable
+    cache_key = None
+    generation = search_cache.generation() if search_cache else None
+    # Right after a write, the search may not see it yet, so its results must not be kept under the new generation
+    cacheable = generation is not None and search_cache.settled(generation)
+    if generation is not None:
+        cache_key = search_cache.key(generation, query, mode=mode, collapse=collapse, user=user_id, size=size,
+                                     offset=offset, cursor=request.args.get('cursor'), format=response_format,
+                                     paged=paged)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            cached = json.loads(cached)
+            return app.response_class(cached["body"], mimetype='application/json', headers={
+                "X-Cache": "HIT", "X-Search-Tier": cached["tier"], "X-Search-Mode": mode, **cache_headers(etag)
+            })
+
+    # Cached results can still be served while the backend is down
+    if not backend.available():
+        return backend_unavailable()
+
+    # Started first so the vector query overlaps the lexical one; copy_context keeps its stage timing on this request
+    semantic_future = None
+    if mode == 'hybrid':
+        semantic_future = semantic_executor.submit(contextvars.copy_context().run, semantic_search, query)
+
+    try:
+        started = time.perf_counter()
+        tier, results = backend.search(query, user_id, size, offset, tier, search_after)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Search for '{query}' answered by the {tier} tier in {elapsed_ms:.1f}ms (took {results.get('took')}ms)")
+
+        page = results["hits"]["hits"]
+        hits = collapse_duplicates(page) if collapse else page
+        hits = format_search_hits(hits)
+        if semantic_future:
+            hits = hybrid_search_hits(query, hits, semantic_future, size)
+        if response_format == 'compact':
+            hits = compact_search_hits(hits)
+        with stage('serialize'):
+            if paged:
+                next_cursor = None if semantic_future else next_search_cursor(tier, page, size)
+                hits = {"results": hits, "next_cursor": next_cursor}
+            body = app.json.dumps(hits, separators=(',', ':'))
+        if cache_key and cacheable:
+            search_cache.set(cache_key, json.dumps({"tier": tier, "body": body}))
+        return app.response_class(body, mimetype='application/json', headers={
+            "X-Cache": "MISS", "X-Search-Tier": tier, "X-Search-Mode": mode, **cache_headers(etag)
+        })
     except Exception as e:
-        app.logger.error(f"Elasticsearch search error: {str(e)}")
+        backend.report_error(e)
+        app.logger.error(f"Search error: {str(e)}")
         return jsonify({"error": "Search failed"}), 500
 
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    """Typeahead over page titles and URLs, answered from memory without querying the backend"""
+    # The trie holds the shared library only
+    if current_user():
+        return jsonify([])
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', SUGGEST_LIMIT, type=int), 1), SUGGEST_MAX_LIMIT)
+    with stage('suggest'):
+        suggestions = suggest_index.suggest(query, limit)
+    return jsonify(suggestions)
+
 @app.route('/urls', methods=['GET'])
 def list_urls():
-    if not es:
-        logger.error("Elasticsearch client is not initialized")
-        return jsonify({"error": "Elasticsearch is not available"}), 503
+    # Answered before the backend is checked: an unchanged listing needs no query
+    etag, response = not_modified()
+    if response:
+        return response
+
+    if not backend.available():
+        logger.error(f"{backend.name} is not available")
+        return backend_unavailable()
+
+    # Passing page_size or cursor switches to paged responses: {"urls": [...], "next_cursor": ...}
+    paged = 'page_size' in request.args or 'cursor' in request.args
+    page_size = page_size_arg(request.args) if paged else 100
+
+    search_after = None
+    if request.args.get('cursor'):
+        try:
+            search_after = decode_cursor(request.args['cursor'], LIST_CURSOR_SHAPE)
+        except InvalidCursorError as e:
+            return jsonify({"error": str(e)}), 400
 
     try:
-        results = es.search(index="webpages", body={
-            "query": {"match_all": {}},
-            "sort": [{"timestamp": {"order": "desc"}}],  # Sort by timestamp
-            "size": 100  # Limit to latest 100 URLs
-        })
-        
-        urls = [{
-            "url": hit["_source"]["url"],
-            "title": hit["_source"]["title"],
-            "favicon": hit["_source"].get("favicon"),
-            "timestamp": hit["_source"]["timestamp"]
-        } for hit in results["hits"]["hits"]]
+        hits = backend.list_page(page_size, search_after, current_user())
+        urls = format_listing(hits)
         
         logger.info(f"Successfully fetched {len(urls)} URLs")
-        return jsonify(urls)
+        if not paged:
+            return jsonify(urls), cache_headers(etag)
+
+        next_cursor = encode_cursor(hits[-1]["sort"]) if len(hits) == page_size else None
+        return jsonify({"urls": urls, "next_cursor": next_cursor}), cache_headers(etag)
         
     except Exception as e:
+        backend.report_error(e)
         error_msg = str(e)
         logger.error(f"Error fetching URLs: {error_msg}")
         return jsonify({"error": f"Failed to fetch URLs: {error_msg}"}), 500
 
 @app.route('/url/<path:url>', methods=['DELETE'])
 def delete_url(url):
-    if not es:
-        return jsonify({"error": "Elasticsearch is not available"}), 503
+    if not backend.available():
+        return backend_unavailable()
 
     try:
         # Clean the URL (remove potential double encoding)
@@ -286,43 +430,35 @@ def delete_url(url):
         
         # Log the URL for debugging
         logger.info(f"Attempting to delete URL: {clean_url}")
+        try:
+            normalize_url(clean_url)
+        except ValueError as e:
+            # e.g. a port out of range, which urlsplit only reports when asked for it
+            return jsonify({"error": f"Invalid URL: {str(e)}"}), 400
 
-        # Search for the exact URL
-        result = es.search(index="webpages", body={
-            "size": 1,
-            "query": {
-                "bool": {
-                    "must": [
-                        {
-                            "term": {
-                                "url": clean_url
-                            }
-                        }
-                    ]
-                }
-            }
-        })
-
-        # Check if URL was found
-        if result["hits"]["total"]["value"] == 0:
+        user_id = current_user()
+        if not backend.delete(clean_url, user_id):
             logger.warning(f"URL not found: {clean_url}")
             return jsonify({"error": "URL not found"}), 404
-
-        # Delete the document
-        doc_id = result["hits"]["hits"][0]["_id"]
-        es.delete(index="webpages", id=doc_id)
         
+        crawl_state.forget(clean_url, user_id)
+        if not user_id:
+            suggest_index.delete(clean_url)
+        index_changed()
+        if embedding_queue and not user_id:
+            embedding_queue.delete(clean_url)
         logger.info(f"Successfully deleted URL: {clean_url}")
         return jsonify({"message": "URL deleted successfully"})
     except Exception as e:
+        backend.report_error(e)
         logger.error(f"Error deleting URL: {str(e)}")
         return jsonify({"error": f"Failed to delete URL: {str(e)}"}), 500
 
 if __name__ == '__main__':
-    if not es:
+    if not backend.available():
         print("""
-Note: Application will run in limited mode without Elasticsearch.
-- URL submission will be disabled
-- Search functionality will be disabled
+Note: Elasticsearch is not reachable yet.
+- URL submission and search will answer 503 until it is
+- The application reconnects automatically once it recovers
 """)
     app.run(host="0.0.0.0", port="8888", debug=True)
\ No newline at end of file
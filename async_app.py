@@ -0,0 +1,494 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin
+
+from dotenv import load_dotenv
+from elasticsearch import NotFoundError
+from jinja2 import Environment, FileSystemLoader
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+
+from async_fetcher import create_async_client, fetch_async, head_ok_async
+from backends import ElasticsearchBackend
+from es_client import AsyncElasticsearchManager, ElasticsearchManager
+from extraction import extractor
+from favicon_cache import favicon_cache, origin_of
+from html_archive import html_archive
+from fetcher import FetchError
+from fingerprints import FINGERPRINT_SOURCE, assign_cluster, candidates_from_hits, is_unchanged, near_duplicate_body
+from http_cache import (RESPONSE_COMPRESSION_MIN_BYTES, IndexETags, cache_headers, compress, compressible, etag_matches,
+                        negotiate_encoding)
+from indexing import build_document, document_id, normalize_url, stored_document
+from metrics import (SCRAPE_FAILURES, WRITES_SKIPPED, current_timings, finish_request, record_stage, render_metrics, server_timing,
+                     stage, start_request, wants_timing)
+from pagination import InvalidCursorError, decode_cursor, encode_cursor, page_size_arg
+from crawl_state import crawl_state
+from scraper import extract_page, validators
+from search_cache import create_search_cache
+from search_dispatcher import AsyncSingleflight
+from search_queries import (LIST_CURSOR_SHAPE, SEARCH_COLLAPSE_DUPLICATES, async_tiered_search, collapse_duplicates,
+                            compact_search_hits, format_listing, format_search_hits, list_body, next_search_cursor,
+                            search_page_args)
+from suggest_index import SUGGEST_LIMIT, SUGGEST_MAX_LIMIT, SuggestIndex
+from tenancy import owner_filter, user_from_headers
+
+# Load environment variables from .env file
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fork the extraction workers (EXTRACTION_WORKERS) before the event loop starts threads
+extractor.start()
+
+ASYNC_SCRAPE_CONCURRENCY = int(os.getenv('ASYNC_SCRAPE_CONCURRENCY', '256'))
+ASYNC_ES_CONNECTIONS = int(os.getenv('ASYNC_ES_CONNECTIONS', '64'))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Keep Flask's url_for('static', filename=...) working in the shared template
+template_env = Environment(loader=FileSystemLoader(os.path.join(BASE_DIR, 'templates')), autoescape=True)
+template_env.globals['url_for'] = lambda endpoint, filename: f"/static/{filename}"
+templates = Jinja2Templates(env=template_env)
+
+es_manager = AsyncElasticsearchManager(connections_per_node=ASYNC_ES_CONNECTIONS)
+http = None
+scrape_slots = None
+search_cache = create_search_cache()
+search_flights = AsyncSingleflight()
+index_etags = IndexETags(search_cache)
+# The same title/URL prefix trie as app.py's /suggest; it is loaded and reloaded on a background
+# thread, through a blocking client of its own, so the event loop never waits on the listing
+suggest_index = SuggestIndex(ElasticsearchBackend(ElasticsearchManager()), search_cache)
+
+
+def error(message, status_code):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def es_unavailable():
+    """503 response used while Elasticsearch is down or the circuit breaker is open"""
+    return JSONResponse({"error": "Elasticsearch is not available"}, status_code=503,
+                        headers={"Retry-After": str(es_manager.retry_after())})
+
+
+def not_modified(request):
+    """The ETag of a request, and a 304 response if the client already has that version"""
+    etag = index_etags.etag(request.url.path, request.query_params.multi_items(), user_from_headers(request.headers))
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return etag, Response(status_code=304, headers=cache_headers(etag))
+    return etag, None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global http, scrape_slots
+    http = create_async_client()
+    scrape_slots = asyncio.Semaphore(ASYNC_SCRAPE_CONCURRENCY)
+    # Elasticsearch is connected lazily, so startup never waits on the cluster
+    try:
+        yield
+    finally:
+        await http.aclose()
+        await es_manager.close()
+
+
+async def default_favicon_async(url):
+    """Async version of scraper.default_favicon_for, sharing the same origin cache"""
+    origin = origin_of(url)
+    hit, favicon = await asyncio.to_thread(favicon_cache.lookup, origin)
+    if hit:
+        return favicon
+
+    default_favicon = urljoin(url, '/favicon.ico')
+    found = await head_ok_async(http, default_favicon)
+    if found is None:
+        # Only a real answer is cached, as in default_favicon_for
+        return None
+    favicon = default_favicon if found else None
+    await asyncio.to_thread(favicon_cache.store, origin, favicon)
+    return favicon
+
+
+async def scrape_url_async(url):
+    try:
+        # Bound outbound fetches so a burst of adds cannot open unlimited sockets
+        async with scrape_slots:
+            with stage('fetch'):
+                page = await fetch_async(http, url)
+        with stage('parse'):
+            scraped_data = await asyncio.to_thread(extract_page, url, page.content, page.encoding)
+        if not scraped_data["favicon"]:
+            with stage('favicon'):
+                scraped_data["favicon"] = await default_favicon_async(url)
+        scraped_data.update(validators(page.headers))
+        if html_archive:
+            with stage('archive'):
+                await asyncio.to_thread(html_archive.store, url, page.content, page.encoding, scraped_data["favicon"])
+        return scraped_data
+    except FetchError as e:
+        SCRAPE_FAILURES.labels(e.cause).inc()
+        logger.warning(f"Skipping {url} ({e.cause}): {str(e)}")
+        return None
+    except Exception as e:
+        SCRAPE_FAILURES.labels('parse').inc()
+        logger.error(f"Error scraping {url}: {str(e)}")
+        return None
+
+
+async def check_document_async(es, doc_id, document):
+    """fingerprints.check_document against the async client"""
+    user_id = document.get("user_id")
+    try:
+        stored = await es.get(index="webpages", id=doc_id, routing=user_id, _source_includes=FINGERPRINT_SOURCE)
+        if is_unchanged(document, stored["_source"]):
+            return "unchanged"
+    except NotFoundError:
+        pass
+    candidates = []
+    if document["simhash_bands"]:
+        results = await es.search(index="webpages", routing=user_id,
+                                  body=near_duplicate_body(doc_id, document["simhash_bands"], user_id))
+        candidates = candidates_from_hits(results["hits"]["hits"])
+    return assign_cluster(doc_id, document, candidates)
+
+
+def index_changed():
+    """Invalidate cached search results after a write to the webpages index"""
+    if search_cache:
+        suggest_index.advance(search_cache.invalidate())
+
+
+async def home(request):
+    return templates.TemplateResponse(request, 'index.html')
+
+
+async def add_url(request):
+    es = await es_manager.get()
+    if not es:
+        return es_unavailable()
+
+    form = await request.form()
+    url = form.get('url')
+    if not url:
+        return error("No URL provided", 400)
+
+    scraped_data = await scrape_url_async(url)
+    if not scraped_data:
+        return error("Failed to scrape URL", 400)
+
+    user_id = user_from_headers(request.headers)
+    document = build_document(url, scraped_data, user_id)
+    doc_id = document_id(url, user_id)
+    try:
+        with stage('fingerprint_check'):
+            status = await check_document_async(es, doc_id, document)
+        if status == "index":
+            with stage('es_index'):
+                await es.index(index="webpages", id=doc_id, routing=user_id, body=stored_document(document))
+    except Exception as e:
+        es_manager.report_error(e)
+        logger.error(f"Elasticsearch indexing error: {str(e)}")
+        return error("Failed to store URL content", 500)
+
+    if status != "duplicate":
+        await asyncio.to_thread(crawl_state.track, url, scraped_data["etag"], scraped_data["last_modified"], user_id)
+    if status != "index":
+        WRITES_SKIPPED.labels(status).inc()
+        logger.info(f"Skipped writing {url}: {status}")
+    else:
+        # The trie holds the shared library only, as in app.py
+        if not user_id:
+            suggest_index.add(document["url"], document["title"], document["favicon"], document["timestamp"])
+        index_changed()
+    if status == "duplicate":
+        return JSONResponse({"message": "URL not stored, its content duplicates another page",
+                             "status": status, "duplicate_of": document["duplicate_of"]})
+    return JSONResponse({"message": "URL added successfully", "status": "indexed" if status == "index" else status,
+                         "duplicate_of": document.get("duplicate_of")})
+
+
+async def search(request):
+    params = request.query_params
+    paged = any(name in params for name in ('size', 'from', 'cursor'))
+    query = params.get('q')
+    if not query:
+        return JSONResponse({"results": [], "next_cursor": None} if paged else [])
+    response_format = params.get('format', 'full').lower()
+    if response_format not in ('full', 'compact'):
+        return error("format must be 'full' or 'compact'", 400)
+    try:
+        size, offset, tier, search_after = search_page_args(params)
+    except ValueError as e:
+        return error(str(e), 400)
+    collapse = params.get('collapse', str(SEARCH_COLLAPSE_DUPLICATES)).lower() == 'true'
+    user_id = user_from_headers(request.headers)
+
+    etag, response = not_modified(request)
+    if response:
+        return response
+
+    cache_key = None
+    generation = search_cache.generation() if search_cache else None
+    # Right after a write, the search may not see it yet, so its results must not be kept under the new generation
+    cacheable = generation is not None and search_cache.settled(generation)
+    if generation is not None:
+        cache_key = search_cache.key(generation, query, collapse=collapse, user=user_id, size=size, offset=offset,
+                                     cursor=params.get('cursor'), format=response_format, paged=paged)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            cached = json.loads(cached)
+            return Response(cached["body"], media_type='application/json',
+                            headers={"X-Cache": "HIT", "X-Search-Tier": cached["tier"], **cache_headers(etag)})
+
+    # Cached results can still be served while Elasticsearch is down
+    es = await es_manager.get()
+    if not es:
+        return es_unavailable()
+
+    async def run_search(body):
+        key = json.dumps([user_id, body], sort_keys=True, separators=(',', ':'))
+        return await search_flights.do(key, lambda: es.search(index="webpages", routing=user_id, body=body))
+
+    try:
+        started = time.perf_counter()
+        with stage('es_search'):
+            tier, results = await async_tiered_search(run_search, query, user_id=user_id, size=size, offset=offset,
+                                                      tier=tier, search_after=search_after)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        record_stage('es_took', results.get('took', 0) / 1000)
+        logger.info(f"Search for '{query}' answered by the {tier} tier in {elapsed_ms:.1f}ms (took {results.get('took')}ms)")
+
+        page = results["hits"]["hits"]
+        hits = format_search_hits(collapse_duplicates(page) if collapse else page)
+        if response_format == 'compact':
+            hits = compact_search_hits(hits)
+        with stage('serialize'):
+            if paged:
+                hits = {"results": hits, "next_cursor": next_search_cursor(tier, page, size)}
+            body = json.dumps(hits, separators=(',', ':'))
+        if cache_key and cacheable:
+            search_cache.set(cache_key, json.dumps({"tier": tier, "body": body}))
+        return Response(body, media_type='application/json',
+                        headers={"X-Cache": "MISS", "X-Search-Tier": tier, **cache_headers(etag)})
+    except Exception as e:
+        es_manager.report_error(e)
+        logger.error(f"Elasticsearch search error: {str(e)}")
+        return error("Search failed", 500)
+
+
+async def suggest(request):
+    """Typeahead over page titles and URLs, answered from memory as in app.py"""
+    # The trie holds the shared library only
+    if user_from_headers(request.headers):
+        return JSONResponse([])
+    params = request.query_params
+    try:
+        limit = int(params.get('limit', SUGGEST_LIMIT))
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    limit = min(max(limit, 1), SUGGEST_MAX_LIMIT)
+    with stage('suggest'):
+        suggestions = suggest_index.suggest(params.get('q', ''), limit)
+    return JSONResponse(suggestions)
+
+
+async def list_urls(request):
+    # Answered before Elasticsearch is checked: an unchanged listing needs no query
+    etag, response = not_modified(request)
+    if response:
+        return response
+
+    es = await es_manager.get()
+    if not es:
+        logger.error("Elasticsearch is not available")
+        return es_unavailable()
+
+    params = request.query_params
+    paged = 'page_size' in params or 'cursor' in params
+    page_size = page_size_arg(params) if paged else 100
+
+    search_after = None
+    if params.get('cursor'):
+        try:
+            search_after = decode_cursor(params['cursor'], LIST_CURSOR_SHAPE)
+        except InvalidCursorError as e:
+            return error(str(e), 400)
+
+    try:
+        with stage('es_search'):
+            user_id = user_from_headers(request.headers)
+            results = await es.search(index="webpages", routing=user_id,
+                                      body=list_body(page_size, search_after, user_id))
+        record_stage('es_took', results.get('took', 0) / 1000)
+        hits = results["hits"]["hits"]
+        urls = format_listing(hits)
+        if not paged:
+            return JSONResponse(urls, headers=cache_headers(etag))
+
+        next_cursor = encode_cursor(hits[-1]["sort"]) if len(hits) == page_size else None
+        return JSONResponse({"urls": urls, "next_cursor": next_cursor}, headers=cache_headers(etag))
+    except Exception as e:
+        es_manager.report_error(e)
+        error_msg = str(e)
+        logger.error(f"Error fetching URLs: {error_msg}")
+        return error(f"Failed to fetch URLs: {error_msg}", 500)
+
+
+async def delete_url(request):
+    es = await es_manager.get()
+    if not es:
+        return es_unavailable()
+
+    clean_url = request.path_params['url'].strip()
+    user_id = user_from_headers(request.headers)
+    logger.info(f"Attempting to delete URL: {clean_url}")
+    try:
+        normalize_url(clean_url)
+    except ValueError as e:
+        # e.g. a port out of range, which urlsplit only reports when asked for it
+        return error(f"Invalid URL: {str(e)}", 400)
+
+    try:
+        try:
+            with stage('es_delete'):
+                await es.delete(index="webpages", id=document_id(clean_url, user_id), routing=user_id)
+        except NotFoundError:
+            # Same fallback as app.py for documents indexed before deterministic ids
+            result = await es.delete_by_query(index="webpages", routing=user_id, body={
+                "query": {"bool": {"filter": [{"term": {"url": clean_url}}, owner_filter(user_id)]}}
+            })
+            if result["deleted"] == 0:
+                logger.warning(f"URL not found: {clean_url}")
+                return error("URL not found", 404)
+
+        await asyncio.to_thread(crawl_state.forget, clean_url, user_id)
+        if not user_id:
+            suggest_index.delete(clean_url)
+        index_changed()
+        logger.info(f"Successfully deleted URL: {clean_url}")
+        return JSONResponse({"message": "URL deleted successfully"})
+    except Exception as e:
+        es_manager.report_error(e)
+        logger.error(f"Error deleting URL: {str(e)}")
+        return error(f"Failed to delete URL: {str(e)}", 500)
+
+
+async def metrics_endpoint(request):
+    body, content_type = render_metrics()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, in-flight requests and Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        token = start_request()
+        status = {'code': 500}
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                headers = {key.decode('latin-1').title(): value.decode('latin-1') for key, value in scope['headers']}
+                if wants_timing(headers):
+                    elapsed, timings = time.perf_counter() - token[0], current_timings()
+                    message.setdefault('headers', [])
+                    message['headers'] = list(message['headers']) + [
+                        (b'server-timing', server_timing(elapsed, timings).encode('latin-1'))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route = ROUTE_PATHS.get(scope.get('endpoint'), 'unmatched')
+            finish_request(token, route, scope['method'], status['code'])
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing JSON responses for clients that accept it, as http_cache.init_app does for Flask"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = next((value.decode('latin-1') for key, value in scope['headers']
+                                if key == b'accept-encoding'), None)
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(raw=list(message.get('headers', [])))
+                # Other types, or every type with RESPONSE_COMPRESSION=false, pass straight through
+                if 'content-encoding' in headers or not compressible(headers.get('content-type'),
+                                                                     RESPONSE_COMPRESSION_MIN_BYTES):
+                    await send(message)
+                else:
+                    # Held back until the whole body is known
+                    start = message
+                return
+            if start is None or message['type'] != 'http.response.body':
+                await send(message)
+                return
+            chunks.append(message.get('body', b''))
+            if message.get('more_body'):
+                return
+
+            body = b''.join(chunks)
+            headers = MutableHeaders(raw=list(start.get('headers', [])))
+            if compressible(headers.get('content-type'), len(body)):
+                vary = [value.strip().lower() for value in headers.get('vary', '').split(',')]
+                if 'accept-encoding' not in vary:
+                    headers.add_vary_header('Accept-Encoding')
+                encoding = negotiate_encoding(accept_encoding)
+                if encoding:
+                    body = compress(body, encoding)
+                    headers['content-encoding'] = encoding
+                    headers['content-length'] = str(len(body))
+            await send({**start, 'headers': headers.raw})
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+routes = [
+    Route('/', home),
+    Route('/add_url', add_url, methods=['POST']),
+    Route('/search', search, methods=['GET']),
+    Route('/suggest', suggest, methods=['GET']),
+    Route('/urls', list_urls, methods=['GET']),
+    Route('/url/{url:path}', delete_url, methods=['DELETE']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Mount('/static', app=StaticFiles(directory=os.path.join(BASE_DIR, 'static')), name='static')
+]
+
+# Label latency metrics with the route template rather than the raw path
+ROUTE_PATHS = {route.endpoint: route.path for route in routes if isinstance(route, Route)}
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(MetricsMiddleware), Middleware(CompressionMiddleware)],
+    lifespan=lifespan
+)
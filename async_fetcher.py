@@ -0,0 +1,73 @@
+import asyncio
+
+import httpx
+
+from fetcher import (CHUNK_SIZE, FETCH_CONNECT_TIMEOUT, FETCH_MAX_BYTES, FETCH_POOL_SIZE, FETCH_READ_TIMEOUT,
+                     FETCH_TOTAL_TIMEOUT, FETCH_USER_AGENT, HTML_CONTENT_TYPES, FetchError, FetchResult)
+
+
+def create_async_client(max_connections=1000):
+    """Shared httpx client for the ASGI app: keep-alive pool, timeouts and transparent decompression"""
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=httpx.Timeout(FETCH_READ_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=FETCH_POOL_SIZE * 4),
+        headers={
+            'User-Agent': FETCH_USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.1'
+        }
+    )
+
+
+def _media_type(content_type):
+    return content_type.split(';', 1)[0].strip().lower()
+
+
+async def fetch_async(client, url, headers=None, max_bytes=FETCH_MAX_BYTES, allowed_types=HTML_CONTENT_TYPES):
+    """Non-blocking counterpart of fetcher.fetch with the same limits and errors"""
+    try:
+        # Cancelled at the deadline wherever it waits, so a server trickling bytes cannot hold the download open
+        return await asyncio.wait_for(_fetch_async(client, url, headers, max_bytes, allowed_types), FETCH_TOTAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise FetchError(f"Timed out downloading {url}", 'timeout')
+
+
+async def _fetch_async(client, url, headers, max_bytes, allowed_types):
+    try:
+        async with client.stream('GET', url, headers=headers) as response:
+            if response.status_code >= 400:
+                raise FetchError(f"{url} returned HTTP {response.status_code}", 'http_status')
+
+            content_type = response.headers.get('Content-Type')
+            if allowed_types and content_type and _media_type(content_type) not in allowed_types:
+                raise FetchError(f"{url} is {_media_type(content_type)}, not HTML", 'content_type')
+
+            declared_length = response.headers.get('Content-Length')
+            if declared_length and declared_length.isdigit() and int(declared_length) > max_bytes:
+                raise FetchError(f"{url} is {declared_length} bytes, over the {max_bytes} byte limit", 'too_large')
+
+            chunks = []
+            received = 0
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise FetchError(f"{url} exceeded the {max_bytes} byte limit", 'too_large')
+                chunks.append(chunk)
+
+            encoding = response.charset_encoding if content_type and 'charset=' in content_type.lower() else None
+            return FetchResult(url, str(response.url), response.status_code, response.headers, b''.join(chunks), encoding)
+    except httpx.TimeoutException as e:
+        raise FetchError(f"Timed out fetching {url}: {e}", 'timeout')
+    except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+        raise FetchError(f"Invalid URL {url}: {e}", 'invalid_url')
+    except httpx.HTTPError as e:
+        raise FetchError(f"Failed to fetch {url}: {e}", 'connection')
+
+
+async def head_ok_async(client, url):
+    """Return True if a HEAD request to ``url`` answers 200, False for any other answer and None if it got none"""
+    try:
+        response = await client.head(url)
+        return response.status_code == 200
+    except httpx.HTTPError:
+        return None
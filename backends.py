@@ -0,0 +1,214 @@
+import logging
+import os
+
+from dotenv import load_dotenv
+from elasticsearch import NotFoundError, helpers
+
+from embedded_index import EMBEDDED_INDEX_PATH, EmbeddedIndex
+from fingerprints import FINGERPRINT_SOURCE, candidates_from_hits, near_duplicate_body
+from indexing import CONTENT_LAYOUT, document_id, stored_document
+from metrics import record_stage, stage
+from search_dispatcher import SearchDispatcher
+from search_queries import SEARCH_PAGE_SIZE, list_body, tiered_search
+from tenancy import owner_filter
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Where pages are stored and searched: "elasticsearch" or "embedded"
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'elasticsearch').lower()
+
+
+class BackendUnavailableError(Exception):
+    """Raised when the backend cannot serve a request right now"""
+
+
+class ElasticsearchBackend:
+    """Pages stored in the webpages Elasticsearch index.
+
+    Errors are raised to the caller, who passes them to report_error() so
+    connection failures reach the circuit breaker of the manager. With the
+    "passages" layout, content is written and searched as nested passages.
+
+    A user's pages are routed by their user_id, so all of them live on one
+    shard: reads of one library send the same routing and a user_id filter,
+    and touch that shard only. Shared pages keep the default routing.
+    """
+
+    name = "Elasticsearch"
+
+    def __init__(self, manager, index="webpages", layout=CONTENT_LAYOUT):
+        self.manager = manager
+        self.index = index
+        self.layout = layout
+        # Coalesces identical concurrent searches and batches distinct ones into _msearch
+        self.dispatcher = SearchDispatcher(manager.get, index=index)
+
+    def available(self):
+        return self.manager.get() is not None
+
+    def retry_after(self):
+        return self.manager.retry_after()
+
+    def report_error(self, error):
+        self.manager.report_error(error)
+
+    def _client(self):
+        es = self.manager.get()
+        if not es:
+            raise BackendUnavailableError("Elasticsearch is not available")
+        return es
+
+    def index_document(self, doc_id, document):
+        es = self._client()
+        with stage('es_index'):
+            es.index(index=self.index, id=doc_id, body=stored_document(document, self.layout),
+                     routing=document.get("user_id"))
+
+    def bulk_index(self, documents, chunk_size=500):
+        """Write (doc_id, document) pairs with the bulk API, yielding (ok, error) for each in order"""
+        actions = ({"_index": self.index, "_id": doc_id, "_source": stored_document(document, self.layout),
+                    **({"_routing": document["user_id"]} if document.get("user_id") else {})}
+                   for doc_id, document in documents)
+        for ok, item in helpers.streaming_bulk(self._client(), actions, chunk_size=chunk_size,
+                                               raise_on_error=False, raise_on_exception=False):
+            yield ok, None if ok else str(next(iter(item.values())).get("error"))
+
+    def stored_fingerprint(self, doc_id, user_id=None):
+        """content_hash, title, favicon and cluster of the page stored under an id, or None"""
+        es = self._client()
+        try:
+            with stage('es_get'):
+                response = es.get(index=self.index, id=doc_id, _source_includes=FINGERPRINT_SOURCE, routing=user_id)
+        except NotFoundError:
+            return None
+        return response["_source"]
+
+    def existing_ids(self, doc_ids, user_id=None):
+        """The ids of ``doc_ids`` that a library stores a page under"""
+        if not doc_ids:
+            return set()
+        es = self._client()
+        with stage('es_get'):
+            response = es.mget(index=self.index, body={"ids": list(doc_ids)}, _source=False, routing=user_id)
+        return {doc["_id"] for doc in response["docs"] if doc.get("found")}
+
+    def near_duplicate_candidates(self, doc_id, bands, user_id=None):
+        """Other pages of a library sharing a SimHash band with a document, as {"_id", "url", "simhash", "cluster"}"""
+        es = self._client()
+        with stage('es_search'):
+            results = es.search(index=self.index, body=near_duplicate_body(doc_id, bands, user_id), routing=user_id)
+        return candidates_from_hits(results["hits"]["hits"])
+
+    def search(self, query, user_id=None, size=SEARCH_PAGE_SIZE, offset=0, tier=None, search_after=None):
+        """Run the search tiers over a library for one page of hits; returns (tier, Elasticsearch response)"""
+        with stage('es_search'):
+            tier, results = tiered_search(lambda body: self.dispatcher.search(body, routing=user_id), query,
+                                          passages=self.layout == 'passages', user_id=user_id, size=size,
+                                          offset=offset, tier=tier, search_after=search_after)
+        record_stage('es_took', results.get('took', 0) / 1000)
+        return tier, results
+
+    def list_page(self, page_size, search_after=None, user_id=None, all_users=False):
+        """One page of a library's listing (or of every page), newest first, as Elasticsearch hits with sort values"""
+        es = self._client()
+        with stage('es_search'):
+            results = es.search(index=self.index, body=list_body(page_size, search_after, user_id, all_users),
+                                routing=None if all_users else user_id)
+        record_stage('es_took', results.get('took', 0) / 1000)
+        return results["hits"]["hits"]
+
+    def delete(self, url, user_id=None):
+        """Delete the page a library stores for a URL; returns False if there was none"""
+        es = self._client()
+        try:
+            with stage('es_delete'):
+                es.delete(index=self.index, id=document_id(url, user_id), routing=user_id)
+            return True
+        except NotFoundError:
+            # Documents indexed before ids were derived from the URL still have
+            # random ids; fall back to matching them by URL until migrate_doc_ids.py has run
+            result = es.delete_by_query(index=self.index, body={
+                "query": {"bool": {"filter": [{"term": {"url": url}}, owner_filter(user_id)]}}
+            }, routing=user_id)
+            return result["deleted"] > 0
+
+
+class EmbeddedBackend:
+    """Pages stored in an EmbeddedIndex file, searched inside this process"""
+
+    name = "Embedded search index"
+
+    def __init__(self, index):
+        self.index = index
+
+    def available(self):
+        return True
+
+    def retry_after(self):
+        return 0
+
+    def report_error(self, error):
+        pass
+
+    def index_document(self, doc_id, document):
+        with stage('embedded_index'):
+            self.index.upsert(doc_id, document)
+
+    def bulk_index(self, documents, chunk_size=500):
+        """Write (doc_id, document) pairs one transaction per chunk, yielding (ok, error) for each in order"""
+        chunk = []
+        for item in documents:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield from self._write_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._write_chunk(chunk)
+
+    def _write_chunk(self, chunk):
+        try:
+            with stage('embedded_index'):
+                self.index.upsert_many(chunk)
+            outcome = (True, None)
+        except Exception as e:
+            logger.error(f"Embedded index write failed: {str(e)}")
+            outcome = (False, str(e))
+        for _ in chunk:
+            yield outcome
+
+    def stored_fingerprint(self, doc_id, user_id=None):
+        # Ids already include the owner
+        return self.index.stored_fingerprint(doc_id)
+
+    def existing_ids(self, doc_ids, user_id=None):
+        return self.index.existing_ids(doc_ids)
+
+    def near_duplicate_candidates(self, doc_id, bands, user_id=None):
+        return self.index.near_duplicate_candidates(doc_id, bands, user_id)
+
+    def search(self, query, user_id=None, size=SEARCH_PAGE_SIZE, offset=0, tier=None, search_after=None):
+        """One page of hits of the search tiers over a library; returns (tier, response shaped like Elasticsearch's)"""
+        with stage('embedded_search'):
+            return self.index.tiered_search(query, user_id, size=size, offset=offset, tier=tier,
+                                            search_after=search_after)
+
+    def list_page(self, page_size, search_after=None, user_id=None, all_users=False):
+        with stage('embedded_search'):
+            return self.index.list_page(page_size, search_after, user_id, all_users)
+
+    def delete(self, url, user_id=None):
+        with stage('embedded_delete'):
+            return self.index.delete(document_id(url, user_id))
+
+
+def create_backend(es_manager):
+    """Build the backend configured by SEARCH_BACKEND"""
+    if SEARCH_BACKEND == 'embedded':
+        logger.info(f"Using the embedded search index at {EMBEDDED_INDEX_PATH}")
+        return EmbeddedBackend(EmbeddedIndex(EMBEDDED_INDEX_PATH))
+    if SEARCH_BACKEND != 'elasticsearch':
+        logger.warning(f"Unknown SEARCH_BACKEND '{SEARCH_BACKEND}', using Elasticsearch")
+    return ElasticsearchBackend(es_manager)
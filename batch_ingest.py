@@ -0,0 +1,149 @@
+import json
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from fingerprints import check_document
+from indexing import build_document, document_id
+from metrics import WRITES_SKIPPED
+from scraper import scrape_url
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHUNK_SIZE = 500
+
+
+def parse_url_list(data):
+    """Parse a JSON array, an NDJSON stream or a plain list of URLs, one per line.
+
+    ``data`` may also be an already decoded list of URLs or {"url": ...} objects.
+    """
+    if isinstance(data, list):
+        return [url for url in map(_url_from_entry, data) if url]
+
+    text = data.strip()
+    if text.startswith('['):
+        return parse_url_list(json.loads(text))
+
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        url = _url_from_entry(json.loads(line)) if line.startswith(('{', '"')) else line
+        if url:
+            urls.append(url)
+    return urls
+
+
+def _url_from_entry(entry):
+    if isinstance(entry, dict):
+        return (entry.get('url') or '').strip()
+    return str(entry).strip()
+
+
+def _scrape(url, prepare=None, scrape=scrape_url):
+    try:
+        scraped_data = scrape(url)
+    except Exception as e:
+        logger.error(f"Error scraping {url}: {str(e)}")
+        return url, None
+    if scraped_data and prepare:
+        return url, prepare(url, scraped_data)
+    return url, scraped_data
+
+
+def scrape_many(urls, concurrency=DEFAULT_CONCURRENCY, prepare=None, scrape=scrape_url):
+    """Scrape URLs concurrently, yielding (url, scraped_data) as each one finishes.
+
+    At most ``concurrency`` pages are fetched at once and only a small window
+    of futures is kept around, so arbitrarily long URL lists stream through
+    in constant memory. ``prepare(url, scraped_data)``, if given, runs on the
+    worker thread after a successful scrape and its result is yielded instead.
+    ``scrape(url)`` replaces scraper.scrape_url, e.g. to read pages from the HTML archive.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for url in urls:
+            pending.add(executor.submit(_scrape, url, prepare, scrape))
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def bulk_ingest(backend, urls, concurrency=DEFAULT_CONCURRENCY, chunk_size=DEFAULT_CHUNK_SIZE, on_indexed=None,
+                on_fetched=None, user_id=None, scrape=scrape_url):
+    """Scrape URLs concurrently and write them to a library in the backend in chunks.
+
+    Pages whose stored copy is unchanged, and near-duplicates under the
+    "skip" policy, are not written (see fingerprints.check_document).
+    Near-duplicates within one call are not detected, since none of them is
+    stored yet when the others are checked.
+
+    ``on_indexed(document)`` is called for every document the backend
+    accepted, and ``on_fetched(url, scraped_data)`` for every page whose
+    stored copy is now current (indexed or unchanged). Returns one result per URL: {"url", "status": "indexed" |
+    "unchanged" | "duplicate" | "failed", "error"}, plus "duplicate_of" for duplicates.
+    """
+    results = []
+    in_flight = deque()
+
+    def prepare(url, scraped_data):
+        # Runs on the scrape threads, so the fingerprint lookups overlap with fetching
+        document = build_document(url, scraped_data, user_id)
+        try:
+            return scraped_data, document, check_document(backend, document_id(url, user_id), document), None
+        except Exception as e:
+            backend.report_error(e)
+            logger.error(f"Fingerprint check failed for {url}: {str(e)}")
+            return scraped_data, document, "failed", str(e)
+
+    def documents():
+        for url, prepared in scrape_many(urls, concurrency, prepare, scrape):
+            if not prepared:
+                results.append({"url": url, "status": "failed", "error": "Failed to scrape URL"})
+                continue
+            scraped_data, document, status, error = prepared
+            if status == "failed":
+                results.append({"url": url, "status": "failed", "error": error})
+                continue
+            if status != "index":
+                WRITES_SKIPPED.labels(status).inc()
+                result = {"url": url, "status": status, "error": None}
+                if status == "duplicate":
+                    result["duplicate_of"] = document["duplicate_of"]
+                elif on_fetched:
+                    on_fetched(url, scraped_data)
+                results.append(result)
+                continue
+            in_flight.append((scraped_data, document))
+            yield document_id(url, user_id), document
+
+    # Backends report items in the order the documents were sent
+    for ok, error in backend.bulk_index(documents(), chunk_size=chunk_size):
+        scraped_data, document = in_flight.popleft()
+        url = document["url"]
+        if ok:
+            if on_indexed:
+                on_indexed(document)
+            if on_fetched:
+                on_fetched(url, scraped_data)
+            results.append({"url": url, "status": "indexed", "error": None})
+        else:
+            results.append({"url": url, "status": "failed", "error": error})
+
+    return results
+
+
+def summarize(results):
+    """Count the URLs of a bulk_ingest result list by status"""
+    summary = {"total": len(results), "indexed": 0, "unchanged": 0, "duplicate": 0, "failed": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    return summary
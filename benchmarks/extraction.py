@@ -0,0 +1,134 @@
+"""Compare the HTML extraction engines on a corpus of saved pages.
+
+Every page of the corpus is parsed by each installed engine on one thread,
+for per-page latency, then by ``--threads`` threads at once, the way
+request and /add_urls fetch threads call it: first on those threads (where
+the GIL serializes parsing) and then through a pool of ``--workers``
+extraction processes. Also reports how much text boilerplate stripping
+removes:
+
+    python -m benchmarks.extraction --corpus saved_pages/ --workers 4
+
+Save pages with e.g. ``wget --adjust-extension -r -l 1 <site>`` into a
+directory; every *.html / *.htm file below it is used. Without --corpus,
+the synthetic fixture pages are parsed (they have no site chrome, so they
+say nothing about stripping); --save writes them out.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixture_server import render_page
+from benchmarks.run_benchmarks import percentile
+from extraction import ENGINE_MODULES, Extractor, extract_html
+
+
+def load_corpus(path):
+    pages = []
+    for directory, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(('.html', '.htm')):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    pages.append((f"file://{os.path.join(directory, name)}", f.read()))
+    return pages
+
+
+def measure_serial(pages, engine, strip_boilerplate, rounds):
+    """Per-page parse latencies on one thread, over ``rounds`` passes"""
+    latencies, chars = [], 0
+    for _ in range(rounds):
+        for url, content in pages:
+            started = time.perf_counter()
+            chars += len(extract_html(url, content, None, engine, strip_boilerplate)["content"])
+            latencies.append(time.perf_counter() - started)
+    return sorted(latencies), chars / len(latencies)
+
+
+def measure_concurrent(pages, extractor, threads, rounds):
+    """Seconds to parse every page ``rounds`` times from ``threads`` threads"""
+    work = [page for _ in range(rounds) for page in pages]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        started = time.perf_counter()
+        list(executor.map(lambda page: extractor.extract(*page), work))
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTML extraction engines")
+    parser.add_argument('--corpus', help="directory of saved .html pages (default: the fixture pages)")
+    parser.add_argument('--pages', type=int, default=200, help="fixture pages to use without --corpus")
+    parser.add_argument('--save', help="write the fixture pages to this directory and exit")
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINE_MODULES),
+                        help="only benchmark this engine (repeatable)")
+    parser.add_argument('--threads', type=int, default=16, help="threads extracting at once")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="extraction processes")
+    parser.add_argument('--rounds', type=int, default=3, help="passes over the corpus per measurement")
+    parser.add_argument('--no-strip', action='store_true', help="measure without boilerplate stripping")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        for number in range(args.pages):
+            with open(os.path.join(args.save, f"page-{number}.html"), 'wb') as f:
+                f.write(render_page(number))
+        print(f"Wrote {args.pages} pages to {args.save}")
+        return 0
+
+    pages = load_corpus(args.corpus) if args.corpus else [
+        (f"http://fixture/page/{number}", render_page(number)) for number in range(args.pages)
+    ]
+    if not pages:
+        print(f"No .html pages found in {args.corpus}")
+        return 1
+    megabytes = sum(len(content) for _, content in pages) / 1e6
+    strip = not args.no_strip
+
+    results = []
+    for engine in args.engine or list(ENGINE_MODULES):
+        if ENGINE_MODULES[engine] is None:
+            print(f"Skipping {engine}: not installed", file=sys.stderr)
+            continue
+        latencies, chars = measure_serial(pages, engine, strip, args.rounds)
+        _, unstripped_chars = measure_serial(pages, engine, False, 1) if strip else (None, chars)
+        threaded = measure_concurrent(pages, Extractor(engine, strip, workers=0), args.threads, args.rounds)
+        pool = Extractor(engine, strip, workers=args.workers, pool_min_bytes=0)
+        pool.start()
+        try:
+            pooled = measure_concurrent(pages, pool, args.threads, args.rounds)
+        finally:
+            pool.close()
+        results.append({
+            "engine": engine,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "serial_pages_per_s": len(latencies) / sum(latencies),
+            "threads_pages_per_s": len(pages) * args.rounds / threaded,
+            "pool_pages_per_s": len(pages) * args.rounds / pooled,
+            "pool_mb_per_s": megabytes * args.rounds / pooled,
+            "text_kept": chars / unstripped_chars if unstripped_chars else 1.0
+        })
+
+    settings = {"pages": len(pages), "megabytes": round(megabytes, 1), "threads": args.threads,
+                "workers": args.workers, "strip_boilerplate": strip}
+    if args.json:
+        print(json.dumps({"settings": settings, "results": results}, indent=2))
+        return 0
+
+    print(f"\n{', '.join(f'{key}={value}' for key, value in settings.items())}\n")
+    header = (f"{'engine':<13}{'p50 ms':>8}{'p95 ms':>8}{'serial/s':>10}{'threads/s':>11}{'pool/s':>9}"
+              f"{'pool MB/s':>11}{'text kept':>11}")
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        print(f"{row['engine']:<13}{row['p50_ms']:>8.2f}{row['p95_ms']:>8.2f}{row['serial_pages_per_s']:>10.1f}"
+              f"{row['threads_pages_per_s']:>11.1f}{row['pool_pages_per_s']:>9.1f}{row['pool_mb_per_s']:>11.1f}"
+              f"{row['text_kept']:>10.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1083 @@
+"""In-process Elasticsearch stand-in for offline benchmarks.
+
+FakeCluster keeps indices in memory and answers the REST calls this app
+makes (index, get, delete, delete_by_query, search, msearch, bulk, mget,
+scroll and the index admin calls), including nested fields with inner_hits,
+plus aliases, index settings with write blocks, and _reindex as a task. FakeNode plugs it into the real elasticsearch-py
+client as a transport node, so request serialization, helpers.streaming_bulk
+and the mapping of HTTP errors to exceptions run exactly as they would
+against a cluster; only the network and Lucene are replaced.
+
+Documents are placed on ``index.number_of_shards`` shards by their routing
+value, or their _id without one, and a get, delete, update or routed search
+only reaches the shards its routing selects, so requests missing the routing
+of a routed document miss it as they would on a cluster with several shards.
+
+Text fields are analyzed like the webpages mapping: the standard tokenizer
+and lowercasing, plus edge n-grams when the analyzer declares an edge_ngram
+filter. Scoring is BM25. It is meant to have realistic relative costs, not
+to reproduce Elasticsearch's scores.
+"""
+import itertools
+import json
+import math
+import re
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from elastic_transport import ApiResponseMeta, BaseNode, HttpHeaders
+from elastic_transport._node import NodeApiResponse
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+
+TOKEN_RE = re.compile(r"\w+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+RESPONSE_HEADERS = {
+    "content-type": "application/json",
+    "x-elastic-product": "Elasticsearch"
+}
+
+
+def tokenize(text):
+    """Standard tokenizer plus lowercase filter"""
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+def edge_ngrams(token, min_gram, max_gram):
+    return [token[:n] for n in range(min_gram, min(max_gram, len(token)) + 1)]
+
+
+def fuzzy_distance(term, fuzziness):
+    """Maximum edit distance allowed for a term, following fuzziness=AUTO"""
+    if fuzziness in (None, 0, '0'):
+        return 0
+    if str(fuzziness).upper() == 'AUTO':
+        return 0 if len(term) < 3 else 1 if len(term) < 6 else 2
+    return int(fuzziness)
+
+
+def within_distance(a, b, limit):
+    """True if the Levenshtein distance between a and b is at most ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def source_value(source, path):
+    """Value of a dotted field path in a document source"""
+    value = source
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def flat_settings(settings, prefix=''):
+    """Index settings as {"index.<name>": value}, however they were nested or dotted"""
+    flat = {}
+    for key, value in settings.items():
+        if isinstance(value, dict):
+            flat.update(flat_settings(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return {key if key.startswith('index.') else f"index.{key}": value for key, value in flat.items()}
+
+
+def filter_source(source, spec):
+    """Apply a _source include/exclude spec to a document"""
+    if spec is None or spec is True:
+        return source
+    if isinstance(spec, str):
+        spec = [spec]
+    includes, excludes = (spec, []) if isinstance(spec, list) else (spec.get('includes', []), spec.get('excludes', []))
+    if isinstance(includes, str):
+        includes = [includes]
+    filtered = {key: value for key, value in source.items() if not includes or key in includes}
+    return {key: value for key, value in filtered.items() if key not in excludes}
+
+
+class ApiFailure(Exception):
+    """An Elasticsearch error response"""
+
+    def __init__(self, status, error_type, reason):
+        super().__init__(reason)
+        self.status = status
+        self.body = {
+            "error": {"root_cause": [{"type": error_type, "reason": reason}], "type": error_type, "reason": reason},
+            "status": status
+        }
+
+
+class FieldSpec:
+    """How one mapped field is indexed"""
+
+    def __init__(self, path, source_path, field_type, ngrams=None):
+        self.path = path
+        self.source_path = source_path
+        self.type = field_type
+        self.ngrams = ngrams
+
+    def term_frequencies(self, tokens):
+        """Indexed terms of a token list with their frequencies"""
+        counts = Counter(tokens)
+        if not self.ngrams:
+            return counts
+        terms = Counter()
+        for token, freq in counts.items():
+            for gram in edge_ngrams(token, *self.ngrams):
+                terms[gram] += freq
+        return terms
+
+
+class NestedMatch:
+    """Child hits of one nested query that asked for inner_hits, grouped by parent document"""
+
+    def __init__(self, name, path, spec, by_parent, matched):
+        self.name = name
+        self.path = path
+        self.spec = spec
+        self.by_parent = by_parent
+        self.matched = matched
+
+
+class FakeIndex:
+    """One index: document sources plus inverted indexes for text and keyword fields.
+
+    Each nested field gets a child FakeIndex holding one document per
+    object, with ids ``{parent id}#{offset}`` and field paths prefixed by
+    the nested path.
+    """
+
+    def __init__(self, name, body=None, prefix=''):
+        self.name = name
+        self.body = body or {}
+        self.prefix = prefix
+        self.nested = {}
+        self.fields = self._parse_mapping(self.body)
+        self.settings = {"index.number_of_replicas": "1"}
+        self.put_settings({key: value for key, value in self.body.get('settings', {}).items() if key != 'analysis'})
+        self.docs = {}
+        self.versions = {}
+        self.routings = {}
+        self.seq_no = 0
+
+        self.postings = defaultdict(lambda: defaultdict(dict))
+        self.keywords = defaultdict(lambda: defaultdict(set))
+        self.tokens = defaultdict(dict)
+        self.words = defaultdict(dict)
+        self.lengths = defaultdict(dict)
+        self.total_lengths = Counter()
+        # Fuzzy expansions of query terms, valid until the next write
+        self._expansions = {}
+
+    def _parse_mapping(self, body):
+        analysis = body.get('settings', {}).get('analysis', {})
+        filters = analysis.get('filter', {})
+        analyzers = analysis.get('analyzer', {})
+
+        def ngrams_of(analyzer_name):
+            for filter_name in analyzers.get(analyzer_name, {}).get('filter', []):
+                spec = filters.get(filter_name, {})
+                if spec.get('type') == 'edge_ngram':
+                    return spec.get('min_gram', 1), spec.get('max_gram', 2)
+            return None
+
+        fields = {}
+        for name, spec in body.get('mappings', {}).get('properties', {}).items():
+            path = f"{self.prefix}{name}"
+            if spec.get('type') == 'nested':
+                self.nested[name] = FakeIndex(f"{self.name}#{name}", {
+                    "settings": body.get('settings', {}),
+                    "mappings": {"properties": spec.get('properties', {})}
+                }, prefix=f"{path}.")
+                continue
+            ngrams = ngrams_of(spec.get('analyzer')) if spec.get('type') == 'text' else None
+            fields[path] = FieldSpec(path, name, spec.get('type', 'keyword'), ngrams)
+            for sub_name, sub_spec in spec.get('fields', {}).items():
+                fields[f"{path}.{sub_name}"] = FieldSpec(f"{path}.{sub_name}", name, sub_spec.get('type', 'keyword'))
+        return fields
+
+    def put_mapping(self, properties):
+        """Add fields to the mapping; like Elasticsearch, documents already stored are not reindexed"""
+        mappings = self.body.setdefault('mappings', {}).setdefault('properties', {})
+        for name, spec in properties.items():
+            path = f"{self.prefix}{name}"
+            if name in mappings or path in self.fields or spec.get('type') == 'nested':
+                continue
+            mappings[name] = spec
+            self.fields[path] = FieldSpec(path, name, spec.get('type', 'keyword'))
+
+    def put_settings(self, changes):
+        """Update dynamic settings; null resets a setting to its default"""
+        for key, value in flat_settings(changes).items():
+            if value is None:
+                self.settings.pop(key, None)
+            else:
+                self.settings[key] = str(value).lower() if isinstance(value, bool) else str(value)
+
+    def field(self, path):
+        if path not in self.fields:
+            # Dynamic mapping: strings are searchable as text
+            self.fields[path] = FieldSpec(path, path[len(self.prefix):] if path.startswith(self.prefix) else path, 'text')
+        return self.fields[path]
+
+    def shard(self, doc_id, routing=None):
+        """Shard holding a document: by its routing value, or its _id without one"""
+        shards = int(self.settings.get('index.number_of_shards', '1'))
+        return zlib.crc32((doc_id if routing is None else routing).encode()) % shards
+
+    def reaches(self, doc_id, routing=None):
+        """Whether a request for an _id with this routing lands on the shard holding the document"""
+        return doc_id in self.docs and self.shard(doc_id, self.routings.get(doc_id)) == self.shard(doc_id, routing)
+
+    def on_shards_of(self, scores, routing):
+        """The {doc_id: score} matches on the shards selected by a comma-separated routing, or all of them"""
+        if not routing:
+            return scores
+        shards = {self.shard('', value) for value in routing.split(',')}
+        return {doc_id: score for doc_id, score in scores.items()
+                if self.shard(doc_id, self.routings.get(doc_id)) in shards}
+
+    def put(self, doc_id, source, routing=None):
+        created = doc_id not in self.docs
+        if not created:
+            self.remove(doc_id)
+        self.docs[doc_id] = source
+        if routing is not None:
+            self.routings[doc_id] = routing
+        self.versions[doc_id] = self.versions.get(doc_id, 0) + 1
+        self.seq_no += 1
+        self._expansions.clear()
+
+        for name in list(source):
+            if isinstance(source[name], str) and f"{self.prefix}{name}" not in self.fields:
+                self.field(f"{self.prefix}{name}")
+        for spec in self.fields.values():
+            value = source_value(source, spec.source_path)
+            if value is None:
+                continue
+            if spec.type == 'text':
+                tokens = tokenize(str(value))
+                self.tokens[spec.path][doc_id] = tokens
+                self.words[spec.path][doc_id] = frozenset(tokens)
+                self.lengths[spec.path][doc_id] = len(tokens)
+                self.total_lengths[spec.path] += len(tokens)
+                for term, freq in spec.term_frequencies(tokens).items():
+                    self.postings[spec.path][term][doc_id] = freq
+            elif spec.type == 'keyword':
+                for item in (value if isinstance(value, list) else [value]):
+                    self.keywords[spec.path][item].add(doc_id)
+        for path, child in self.nested.items():
+            for offset, item in enumerate(source.get(path) or []):
+                child.put(f"{doc_id}#{offset}", item)
+        return created
+
+    def remove(self, doc_id):
+        source = self.docs.pop(doc_id, None)
+        if source is None:
+            return False
+        self.routings.pop(doc_id, None)
+        self.seq_no += 1
+        self._expansions.clear()
+        for spec in self.fields.values():
+            value = source_value(source, spec.source_path)
+            if value is None:
+                continue
+            if spec.type == 'text':
+                tokens = self.tokens[spec.path].pop(doc_id, [])
+                self.words[spec.path].pop(doc_id, None)
+                self.total_lengths[spec.path] -= self.lengths[spec.path].pop(doc_id, 0)
+                postings = self.postings[spec.path]
+                for term in spec.term_frequencies(tokens):
+                    postings[term].pop(doc_id, None)
+                    if not postings[term]:
+                        del postings[term]
+            elif spec.type == 'keyword':
+                for item in (value if isinstance(value, list) else [value]):
+                    ids = self.keywords[spec.path][item]
+                    ids.discard(doc_id)
+                    if not ids:
+                        del self.keywords[spec.path][item]
+        for path, child in self.nested.items():
+            for offset in range(len(source.get(path) or [])):
+                child.remove(f"{doc_id}#{offset}")
+        return True
+
+    # Query evaluation: every clause returns {doc_id: score} for the docs it matches
+
+    def evaluate(self, query, matched):
+        (kind, params), = query.items()
+        handler = getattr(self, f"_query_{kind}", None)
+        if handler is None:
+            raise ApiFailure(400, "parsing_exception", f"unknown query [{kind}]")
+        return handler(params, matched)
+
+    def _query_match_all(self, params, matched):
+        boost = params.get('boost', 1.0) if isinstance(params, dict) else 1.0
+        return {doc_id: boost for doc_id in self.docs}
+
+    def _query_match_none(self, params, matched):
+        return {}
+
+    def _query_match(self, params, matched):
+        (path, spec), = params.items()
+        if not isinstance(spec, dict):
+            spec = {"query": spec}
+        field = self.field(path)
+        if field.type != 'text':
+            return self._query_term({path: {"value": spec["query"], "boost": spec.get('boost', 1.0)}}, matched)
+
+        per_term = [self._term_scores(field, term, spec.get('fuzziness'), spec.get('prefix_length', 0), matched)
+                    for term in tokenize(str(spec["query"]))]
+        if not per_term:
+            return {}
+        if spec.get('operator', 'or').lower() == 'and':
+            candidates = set.intersection(*(set(scores) for scores in per_term))
+        else:
+            candidates = set().union(*per_term)
+        boost = spec.get('boost', 1.0)
+        return {doc_id: boost * sum(scores.get(doc_id, 0.0) for scores in per_term) for doc_id in candidates}
+
+    def _query_match_phrase(self, params, matched):
+        (path, spec), = params.items()
+        if not isinstance(spec, dict):
+            spec = {"query": spec}
+        return self._phrase(self.field(path), tokenize(str(spec["query"])), False, spec.get('boost', 1.0), matched)
+
+    def _query_match_phrase_prefix(self, params, matched):
+        (path, spec), = params.items()
+        if not isinstance(spec, dict):
+            spec = {"query": spec}
+        return self._phrase(self.field(path), tokenize(str(spec["query"])), True, spec.get('boost', 1.0), matched)
+
+    def _query_multi_match(self, params, matched):
+        fields = [path.split('^')[0] for path in params.get('fields', [])] or \
+            [spec.path for spec in self.fields.values() if spec.type == 'text']
+        tokens = tokenize(str(params["query"]))
+        kind = params.get('type', 'best_fields')
+        results = []
+        for path in fields:
+            field = self.field(path)
+            if kind in ('phrase', 'phrase_prefix'):
+                results.append(self._phrase(field, tokens, kind == 'phrase_prefix', 1.0, matched))
+            else:
+                results.append(self._query_match({path: {key: value for key, value in params.items()
+                                                         if key not in ('fields', 'type')}}, matched))
+        scores = {}
+        for result in results:
+            for doc_id, score in result.items():
+                scores[doc_id] = max(scores.get(doc_id, 0.0), score)
+        boost = params.get('boost', 1.0)
+        return {doc_id: score * boost for doc_id, score in scores.items()}
+
+    def _query_term(self, params, matched):
+        (path, spec), = params.items()
+        if not isinstance(spec, dict):
+            spec = {"value": spec}
+        field = self.field(path)
+        boost = spec.get('boost', 1.0)
+        if field.type == 'text':
+            return {doc_id: boost * score for doc_id, score in
+                    self._term_scores(field, str(spec["value"]), None, 0, matched).items()}
+        if field.type == 'keyword':
+            return {doc_id: boost for doc_id in self.keywords[path].get(spec["value"], ())}
+        return {doc_id: boost for doc_id, source in self.docs.items()
+                if source_value(source, field.source_path) == spec["value"]}
+
+    def _query_terms(self, params, matched):
+        params = dict(params)
+        boost = params.pop('boost', 1.0)
+        (path, values), = params.items()
+        scores = {}
+        for value in values:
+            scores.update(self._query_term({path: {"value": value, "boost": boost}}, matched))
+        return scores
+
+    def _query_ids(self, params, matched):
+        return {doc_id: 1.0 for doc_id in params.get('values', []) if doc_id in self.docs}
+
+    def _query_exists(self, params, matched):
+        field = self.field(params['field'])
+        return {doc_id: 1.0 for doc_id, source in self.docs.items()
+                if source_value(source, field.source_path) is not None}
+
+    def _query_range(self, params, matched):
+        (path, bounds), = params.items()
+        field = self.field(path)
+        checks = {
+            'gt': lambda value, bound: value > bound,
+            'gte': lambda value, bound: value >= bound,
+            'lt': lambda value, bound: value < bound,
+            'lte': lambda value, bound: value <= bound
+        }
+        scores = {}
+        for doc_id, source in self.docs.items():
+            value = source_value(source, field.source_path)
+            if value is not None and all(check(value, bounds[op]) for op, check in checks.items() if op in bounds):
+                scores[doc_id] = bounds.get('boost', 1.0)
+        return scores
+
+    def _query_bool(self, params, matched):
+        def clauses(name):
+            value = params.get(name, [])
+            return value if isinstance(value, list) else [value]
+
+        must = [self.evaluate(clause, matched) for clause in clauses('must')]
+        filters = [self.evaluate(clause, set()) for clause in clauses('filter')]
+        should = [self.evaluate(clause, matched) for clause in clauses('should')]
+        must_not = [self.evaluate(clause, set()) for clause in clauses('must_not')]
+
+        required = must + filters
+        if required:
+            candidates = set.intersection(*(set(scores) for scores in required))
+        else:
+            candidates = set().union(*should) if should else set(self.docs)
+
+        minimum = str(params.get('minimum_should_match', 0 if required else 1 if should else 0))
+        if minimum.endswith('%'):
+            minimum = len(should) * int(minimum[:-1]) // 100
+        else:
+            minimum = int(minimum)
+
+        results = {}
+        for doc_id in candidates:
+            if any(doc_id in excluded for excluded in must_not):
+                continue
+            should_hits = [scores[doc_id] for scores in should if doc_id in scores]
+            if len(should_hits) < minimum:
+                continue
+            results[doc_id] = (sum(scores[doc_id] for scores in must) + sum(should_hits)) * params.get('boost', 1.0)
+        return results
+
+    def _query_nested(self, params, matched):
+        path = params['path']
+        child = self.nested.get(path)
+        if child is None:
+            raise ApiFailure(400, "query_shard_exception", f"[nested] failed to find nested object under path [{path}]")
+        child_matched = set()
+        by_parent = defaultdict(list)
+        for child_id, score in child.evaluate(params['query'], child_matched).items():
+            parent, offset = child_id.rsplit('#', 1)
+            by_parent[parent].append((int(offset), score))
+
+        combine = {
+            'avg': lambda scores: sum(scores) / len(scores),
+            'max': max,
+            'min': min,
+            'sum': sum,
+            'none': lambda scores: 0.0
+        }[params.get('score_mode', 'avg')]
+        if 'inner_hits' in params:
+            spec = params['inner_hits'] or {}
+            matched.add(NestedMatch(spec.get('name', path), path, spec, by_parent, child_matched))
+        boost = params.get('boost', 1.0)
+        return {parent: boost * combine([score for _, score in children]) for parent, children in by_parent.items()}
+
+    def inner_hits(self, doc_id, match):
+        """inner_hits section of one hit: its best matching nested objects"""
+        child = self.nested[match.path]
+        children = sorted(match.by_parent.get(doc_id, []), key=lambda item: -item[1])
+        start = match.spec.get('from', 0)
+        hits = []
+        for offset, score in children[start:start + match.spec.get('size', 3)]:
+            child_id = f"{doc_id}#{offset}"
+            hit = {"_index": self.name, "_id": doc_id, "_nested": {"field": match.path, "offset": offset},
+                   "_score": score}
+            if match.spec.get('_source', True) is not False:
+                hit["_source"] = filter_source(child.docs[child_id], match.spec.get('_source'))
+            if match.spec.get('highlight'):
+                highlight = child.highlight(child_id, match.spec['highlight'], match.matched)
+                if highlight:
+                    hit["highlight"] = highlight
+            hits.append(hit)
+        return {"hits": {"total": {"value": len(children), "relation": "eq"},
+                         "max_score": children[0][1] if children else None, "hits": hits}}
+
+    def _expand(self, field, term, fuzziness, prefix_length):
+        """Index terms a query term matches, with fuzzy expansion when requested"""
+        postings = self.postings[field.path]
+        distance = fuzzy_distance(term, fuzziness)
+        if distance == 0:
+            return [term] if term in postings else []
+        key = (field.path, term, distance, prefix_length)
+        if key not in self._expansions:
+            prefix = term[:prefix_length]
+            self._expansions[key] = [candidate for candidate in postings
+                                     if candidate.startswith(prefix) and within_distance(term, candidate, distance)]
+        return self._expansions[key]
+
+    def _term_scores(self, field, term, fuzziness, prefix_length, matched):
+        scores = {}
+        docs = len(self.docs) or 1
+        avg_length = (self.total_lengths[field.path] / docs) or 1.0
+        lengths = self.lengths[field.path]
+        for candidate in self._expand(field, term, fuzziness, prefix_length):
+            postings = self.postings[field.path][candidate]
+            matched.add((field.path, candidate))
+            idf = math.log(1 + (docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths.get(doc_id, 0) / avg_length)
+                scores[doc_id] = max(scores.get(doc_id, 0.0), idf * freq * (BM25_K1 + 1) / (freq + norm))
+        return scores
+
+    def _phrase(self, field, tokens, prefix, boost, matched):
+        if not tokens:
+            return {}
+        postings = self.postings[field.path]
+        whole, last = (tokens[:-1], tokens[-1]) if prefix else (tokens, None)
+
+        # Narrow candidates with the inverted index, then verify positions on the token lists
+        keys = list(whole)
+        if last and field.ngrams and len(last) >= field.ngrams[0]:
+            keys.append(last[:field.ngrams[1]])
+        candidate_sets = [set(postings.get(key, ())) for key in keys]
+        candidates = set.intersection(*candidate_sets) if candidate_sets else set(self.tokens[field.path])
+
+        scores = {}
+        width = len(tokens)
+        for doc_id in candidates:
+            doc_tokens = self.tokens[field.path].get(doc_id, [])
+            for start in range(len(doc_tokens) - width + 1):
+                window = doc_tokens[start:start + width]
+                if window[:len(whole)] == whole and (last is None or window[-1].startswith(last)):
+                    scores[doc_id] = boost * width
+                    for token in window:
+                        matched.add((field.path, token))
+                    break
+        return scores
+
+    def highlight(self, doc_id, spec, matched):
+        """Build highlight fragments for the fields in a highlight spec"""
+        defaults = {key: value for key, value in spec.items() if key != 'fields'}
+        result = {}
+        for path, options in spec.get('fields', {}).items():
+            options = {**defaults, **(options or {})}
+            field = self.field(path)
+            text = source_value(self.docs[doc_id], field.source_path)
+            if not isinstance(text, str):
+                continue
+            if options.get('max_analyzed_offset'):
+                # Matches past it are left unhighlighted
+                text = text[:options['max_analyzed_offset']]
+            # Only terms that occur in this document can produce highlights
+            postings = self.postings[path]
+            terms = {item[1] for item in matched
+                     if isinstance(item, tuple) and item[0] == path and doc_id in postings.get(item[1], ())}
+            fragments = self._fragments(text, self._hit_words(doc_id, field, terms), options) if terms else []
+            if not fragments and options.get('no_match_size'):
+                # Like Elasticsearch, fall back to the start of the field cut at a word boundary
+                size = options['no_match_size']
+                end = text.rfind(' ', 0, size + 1) if len(text) > size else len(text)
+                fragments = [text[:end if end > 0 else size]]
+            if fragments:
+                result[path] = fragments
+        return result
+
+    def _hit_words(self, doc_id, field, terms):
+        """Distinct words of a document that one of the matched terms was indexed from"""
+        tokens = self.words[field.path].get(doc_id, frozenset())
+        if not field.ngrams:
+            return tokens & terms
+        prefixes = tuple(terms)
+        return {token for token in tokens if token.startswith(prefixes)}
+
+    def _fragments(self, text, words, options):
+        pre, post = options.get('pre_tags', ['<em>'])[0], options.get('post_tags', ['</em>'])[0]
+        size = options.get('fragment_size', 100)
+        count = options.get('number_of_fragments', 5)
+
+        def hits(start, end):
+            return (match for match in TOKEN_RE.finditer(text, start, end) if match.group().lower() in words)
+
+        def mark(start, end):
+            pieces, position = [], start
+            for match in hits(start, end):
+                pieces.extend([text[position:match.start()], pre, match.group(), post])
+                position = match.end()
+            pieces.append(text[position:end])
+            return ''.join(pieces)
+
+        if count == 0:
+            return [mark(0, len(text))] if next(hits(0, len(text)), None) else []
+
+        # Only scan as far as needed to fill the requested number of fragments
+        fragments, position = [], 0
+        while len(fragments) < count:
+            match = next(hits(position, len(text)), None)
+            if match is None:
+                break
+            start = text.rfind(' ', 0, max(match.start() - size // 4, 0)) + 1
+            end = min(len(text), start + size)
+            if end < len(text):
+                boundary = text.rfind(' ', match.end(), end)
+                end = boundary if boundary > 0 else end
+            fragments.append(mark(start, end))
+            position = max(end, match.end())
+        return fragments
+
+
+class FakeCluster:
+    """Thread-safe in-memory set of indices behind the Elasticsearch REST API.
+
+    ``latency`` adds a fixed delay in seconds to every request, to model the
+    network round trip to a real cluster.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.indices = {}
+        self.aliases = defaultdict(set)
+        self.tasks = {}
+        self._scrolls = {}
+        self._scroll_ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def handle(self, method, target, body):
+        """Answer one REST request; returns (status, response body or None)"""
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urlsplit(target)
+        path = [unquote(part) for part in parts.path.split('/') if part]
+        params = dict(parse_qsl(parts.query))
+        try:
+            with self._lock:
+                return self._route(method, path, params, body)
+        except ApiFailure as e:
+            return e.status, e.body
+
+    def _route(self, method, path, params, body):
+        if not path:
+            if method == 'HEAD':
+                return 200, None
+            return 200, {"name": "fake-es", "cluster_name": "fake", "version": {"number": "8.17.0"},
+                         "tagline": "You Know, for Search"}
+
+        if path[0] == '_bulk':
+            return self._bulk(None, body)
+        if path[0] == '_msearch':
+            return self._msearch(None, body)
+        if path[0] == '_search' and path[1:] == ['scroll']:
+            return self._scroll(method, json.loads(body or b'{}'))
+        if path[0] == '_alias' and len(path) == 2:
+            return self._get_alias(path[1])
+        if path[0] == '_aliases':
+            return self._update_aliases(json.loads(body)["actions"])
+        if path[0] == '_reindex':
+            return self._reindex(json.loads(body), params)
+        if path[0] == '_tasks' and len(path) == 2:
+            if path[1] not in self.tasks:
+                raise ApiFailure(404, "resource_not_found_exception", f"task [{path[1]}] isn't running")
+            return 200, self.tasks[path[1]]
+        if path[:2] == ['_cluster', 'health']:
+            for name in path[2:]:
+                self._resolve(name)
+            return 200, {"cluster_name": "fake", "status": "green", "timed_out": False}
+
+        index, rest = path[0], path[1:]
+        if not rest:
+            return self._index_admin(method, index, body, params)
+
+        action = rest[0]
+        if action in ('_doc', '_create') and len(rest) == 2:
+            return self._document(method, index, rest[1], body, create=action == '_create', params=params)
+        if action == '_doc' and method == 'POST':
+            return self._document('PUT', index, None, body)
+        handlers = {
+            '_search': lambda: self._search(index, json.loads(body or b'{}'), params),
+            '_count': lambda: self._count(index, json.loads(body or b'{}'), params),
+            '_msearch': lambda: self._msearch(index, body),
+            '_bulk': lambda: self._bulk(index, body),
+            '_mget': lambda: self._mget(index, json.loads(body), params),
+            '_delete_by_query': lambda: self._delete_by_query(index, json.loads(body), params),
+            '_mapping': lambda: self._mapping(method, index, body),
+            '_settings': lambda: self._settings(method, index, body),
+            '_refresh': lambda: (200, {"_shards": {"total": 1, "successful": 1, "failed": 0}})
+        }
+        if action in handlers:
+            return handlers[action]()
+        raise ApiFailure(400, "illegal_argument_exception", f"unsupported endpoint [{method} /{'/'.join(path)}]")
+
+    def _resolve(self, name):
+        """Indices named by an index name or an alias"""
+        if name in self.indices:
+            return [self.indices[name]]
+        if self.aliases.get(name):
+            return [self.indices[index] for index in sorted(self.aliases[name])]
+        raise ApiFailure(404, "index_not_found_exception", f"no such index [{name}]")
+
+    def _get_index(self, name, create=False):
+        if name not in self.indices and not self.aliases.get(name):
+            if not create:
+                raise ApiFailure(404, "index_not_found_exception", f"no such index [{name}]")
+            self.indices[name] = FakeIndex(name)
+        indices = self._resolve(name)
+        if len(indices) > 1:
+            raise ApiFailure(400, "illegal_argument_exception", f"alias [{name}] points to more than one index")
+        return indices[0]
+
+    def _writable(self, name, create=False):
+        index = self._get_index(name, create)
+        if index.settings.get('index.blocks.write') == 'true':
+            raise ApiFailure(403, "cluster_block_exception",
+                             f"index [{index.name}] blocked by: [FORBIDDEN/8/index write (api)];")
+        return index
+
+    def _index_admin(self, method, name, body, params=None):
+        if method == 'HEAD':
+            return (200 if name in self.indices or self.aliases.get(name) else 404), None
+        if method == 'PUT':
+            if name in self.indices or self.aliases.get(name):
+                raise ApiFailure(400, "resource_already_exists_exception", f"index [{name}] already exists")
+            body = json.loads(body) if body else {}
+            self.indices[name] = FakeIndex(name, body)
+            for alias in body.get('aliases', {}):
+                self.aliases[alias].add(name)
+            return 200, {"acknowledged": True, "shards_acknowledged": True, "index": name}
+        if method == 'DELETE':
+            if name in self.indices or (params or {}).get('ignore_unavailable') != 'true':
+                self._delete_index(name)
+            return 200, {"acknowledged": True}
+        index = self._get_index(name)
+        return 200, {index.name: {"settings": index.body.get('settings', {}),
+                                  "mappings": index.body.get('mappings', {})}}
+
+    def _delete_index(self, name):
+        if name not in self.indices:
+            raise ApiFailure(404, "index_not_found_exception", f"no such index [{name}]")
+        del self.indices[name]
+        for members in self.aliases.values():
+            members.discard(name)
+
+    def _get_alias(self, alias):
+        if not self.aliases.get(alias):
+            raise ApiFailure(404, "aliases_not_found_exception", f"alias [{alias}] missing")
+        return 200, {index: {"aliases": {alias: {}}} for index in sorted(self.aliases[alias])}
+
+    def _update_aliases(self, actions):
+        # Applied to a copy first, so a failing action leaves every alias as it was
+        aliases = defaultdict(set, {alias: set(members) for alias, members in self.aliases.items()})
+        removed = set()
+        for action in actions:
+            (op, spec), = action.items()
+            if spec['index'] not in self.indices:
+                raise ApiFailure(404, "index_not_found_exception", f"no such index [{spec['index']}]")
+            if op == 'add':
+                aliases[spec['alias']].add(spec['index'])
+            elif op == 'remove':
+                aliases[spec['alias']].discard(spec['index'])
+            elif op == 'remove_index':
+                removed.add(spec['index'])
+        for alias, members in aliases.items():
+            if members and alias in self.indices and alias not in removed:
+                raise ApiFailure(400, "invalid_alias_name_exception",
+                                 f"Invalid alias name [{alias}]: an index or data stream exists with the same name")
+        self.aliases = aliases
+        for index in removed:
+            self._delete_index(index)
+        return 200, {"acknowledged": True}
+
+    def _settings(self, method, name, body):
+        indices = self._resolve(name)
+        if method == 'PUT':
+            changes = json.loads(body)
+            for index in indices:
+                index.put_settings(changes)
+            return 200, {"acknowledged": True}
+        return 200, {index.name: {"settings": {"index": {key[len('index.'):]: value
+                                                         for key, value in index.settings.items()}}}
+                     for index in indices}
+
+    def _write_result(self, index, doc_id, result):
+        return {"_index": index.name, "_id": doc_id, "_version": index.versions.get(doc_id, 1), "result": result,
+                "_seq_no": index.seq_no, "_primary_term": 1,
+                "_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def _mapping(self, method, name, body):
+        index = self._get_index(name)
+        if method in ('PUT', 'POST'):
+            index.put_mapping(json.loads(body).get('properties', {}))
+            return 200, {"acknowledged": True}
+        return 200, {name: {"mappings": index.body.get('mappings', {})}}
+
+    def _document(self, method, name, doc_id, body, create=False, params=None):
+        routing = (params or {}).get('routing')
+        if method in ('PUT', 'POST'):
+            index = self._writable(name, create=True)
+            doc_id = doc_id or f"{index.seq_no:020d}"
+            if doc_id in index.docs and not index.reaches(doc_id, routing):
+                # A cluster would store a second document with this _id on the other shard
+                raise ApiFailure(400, "illegal_argument_exception",
+                                 f"[{doc_id}]: stored on another shard; the stand-in keeps one copy per _id")
+            if create and doc_id in index.docs:
+                raise ApiFailure(409, "version_conflict_engine_exception", f"[{doc_id}]: document already exists")
+            created = index.put(doc_id, json.loads(body), routing)
+            return (201 if created else 200), self._write_result(index, doc_id, "created" if created else "updated")
+
+        index = self._writable(name) if method == 'DELETE' else self._get_index(name)
+        if method == 'DELETE':
+            if not index.reaches(doc_id, routing):
+                return 404, self._write_result(index, doc_id, "not_found")
+            index.remove(doc_id)
+            return 200, self._write_result(index, doc_id, "deleted")
+        if not index.reaches(doc_id, routing):
+            return 404, {"_index": index.name, "_id": doc_id, "found": False}
+        includes = (params or {}).get('_source_includes')
+        source = filter_source(index.docs[doc_id], includes.split(',') if includes else None)
+        return 200, {"_index": index.name, "_id": doc_id, "_version": index.versions[doc_id], "found": True,
+                     **self._routing_of(index, doc_id), "_source": source}
+
+    @staticmethod
+    def _routing_of(index, doc_id):
+        """The _routing metadata of a hit, which Elasticsearch reports for routed documents"""
+        return {"_routing": index.routings[doc_id]} if doc_id in index.routings else {}
+
+    def _search(self, name, body, params):
+        started = time.perf_counter()
+        index = self._get_index(name)
+        matched = set()
+        scores = index.evaluate(body.get('query', {"match_all": {}}), matched)
+        scores = index.on_shards_of(scores, params.get('routing'))
+
+        sort = body.get('sort')
+        if isinstance(sort, (str, dict)):
+            sort = [sort]
+        # Index order is insertion order here
+        sort = [entry for entry in sort or [] if entry != '_doc'] or None
+        keys = [self._sort_key(entry) for entry in sort] if sort else [("_score", "desc")]
+
+        def values_of(doc_id):
+            return [scores[doc_id] if field == '_score' else
+                    source_value(index.docs[doc_id], index.field(field).source_path) for field, _ in keys]
+
+        rows = [(doc_id, values_of(doc_id)) for doc_id in scores]
+        for position, (_, order) in reversed(list(enumerate(keys))):
+            # Stable sorts from the last key to the first; missing values go last
+            present = [row for row in rows if row[1][position] is not None]
+            missing = [row for row in rows if row[1][position] is None]
+            present.sort(key=lambda row: row[1][position], reverse=order == 'desc')
+            rows = present + missing
+
+        search_after = body.get('search_after')
+        if search_after:
+            rows = [row for row in rows if self._after(row[1], search_after, keys)]
+
+        start = int(body.get('from', params.get('from', 0)))
+        size = int(body.get('size', params.get('size', 10)))
+        page = rows[start:start + size]
+        scroll_id = None
+        if params.get('scroll'):
+            scroll_id = f"scroll-{next(self._scroll_ids)}"
+            self._scrolls[scroll_id] = (name, body, [doc_id for doc_id, _ in rows[start + size:]])
+
+        nested_matches = [item for item in matched if isinstance(item, NestedMatch)]
+        # Sorted searches only report scores with track_scores
+        tracked = not sort or body.get('track_scores')
+        hits = []
+        for doc_id, sort_values in page:
+            hit = {"_index": index.name, "_id": doc_id, **self._routing_of(index, doc_id),
+                   "_score": scores[doc_id] if tracked else None}
+            if body.get('_source') is not False:
+                hit["_source"] = filter_source(index.docs[doc_id], body.get('_source'))
+            if sort:
+                hit["sort"] = sort_values
+            if body.get('highlight'):
+                highlight = index.highlight(doc_id, body['highlight'], matched)
+                if highlight:
+                    hit["highlight"] = highlight
+            if nested_matches:
+                hit["inner_hits"] = {match.name: index.inner_hits(doc_id, match) for match in nested_matches}
+            hits.append(hit)
+
+        result_hits = {"max_score": max(scores.values(), default=None) if tracked else None, "hits": hits}
+        track_total_hits = body.get('track_total_hits', True)
+        if track_total_hits is not False:
+            # An integer counts accurately up to that many hits, as Elasticsearch does (true means 10,000)
+            limit = 10000 if track_total_hits is True else int(track_total_hits)
+            total = {"value": min(len(rows), limit), "relation": "eq" if len(rows) <= limit else "gte"}
+            result_hits = {"total": total, **result_hits}
+        response = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": result_hits
+        }
+        if scroll_id:
+            response["_scroll_id"] = scroll_id
+        return 200, response
+
+    def _scroll(self, method, body):
+        """Next page of a scroll: the documents matched by the first search that still exist"""
+        scroll_ids = body.get('scroll_id')
+        if method == 'DELETE':
+            for scroll_id in scroll_ids if isinstance(scroll_ids, list) else [scroll_ids]:
+                self._scrolls.pop(scroll_id, None)
+            return 200, {"succeeded": True, "num_freed": 1}
+        if scroll_ids not in self._scrolls:
+            raise ApiFailure(404, "search_context_missing_exception", f"No search context found for id [{scroll_ids}]")
+        name, first_body, remaining = self._scrolls[scroll_ids]
+        size = int(first_body.get('size', 10))
+        page_ids, self._scrolls[scroll_ids] = remaining[:size], (name, first_body, remaining[size:])
+        page_body = {key: value for key, value in first_body.items() if key not in ('query', 'from', 'sort')}
+        status, response = self._search(name, {**page_body, "query": {"ids": {"values": page_ids}},
+                                               "size": len(page_ids)}, {})
+        return status, {**response, "_scroll_id": scroll_ids}
+
+    def _reindex(self, body, params):
+        """Copy matching documents into the destination index, optionally reported as a finished task"""
+        started = time.perf_counter()
+        source = body['source']
+        names = source['index'] if isinstance(source['index'], list) else [source['index']]
+        created = updated = 0
+        for name in names:
+            for index in self._resolve(name):
+                for doc_id in list(index.evaluate(source.get('query', {"match_all": {}}), set())):
+                    # Documents keep their routing, as with the default dest.routing of "keep"
+                    dest = self._writable(body['dest']['index'], create=True)
+                    if dest.put(doc_id, dict(index.docs[doc_id]), index.routings.get(doc_id)):
+                        created += 1
+                    else:
+                        updated += 1
+        counts = {"total": created + updated, "created": created, "updated": updated, "deleted": 0, "batches": 1}
+        response = {"took": int((time.perf_counter() - started) * 1000), "timed_out": False, **counts,
+                    "failures": []}
+        if params.get('wait_for_completion', 'true') != 'false':
+            return 200, response
+        task_id = f"fake-node:{len(self.tasks) + 1}"
+        self.tasks[task_id] = {"completed": True, "response": response,
+                               "task": {"id": len(self.tasks) + 1, "action": "indices:data/write/reindex",
+                                        "status": counts}}
+        return 200, {"task": task_id}
+
+    @staticmethod
+    def _sort_key(entry):
+        if isinstance(entry, str):
+            return entry, 'desc' if entry == '_score' else 'asc'
+        (field, options), = entry.items()
+        order = options.get('order', 'asc') if isinstance(options, dict) else options
+        return field, order
+
+    @staticmethod
+    def _after(values, search_after, keys):
+        for value, after, (_, order) in zip(values, search_after, keys):
+            if value == after:
+                continue
+            if value is None:
+                return True
+            return value < after if order == 'desc' else value > after
+        return False
+
+    def _count(self, name, body, params=None):
+        index = self._get_index(name)
+        matched = index.evaluate(body.get('query', {"match_all": {}}), set())
+        return 200, {"count": len(index.on_shards_of(matched, (params or {}).get('routing')))}
+
+    def _msearch(self, default_index, body):
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        responses = []
+        for header, search_body in zip(lines[0::2], lines[1::2]):
+            params = {"routing": header['routing']} if header.get('routing') else {}
+            status, response = self._search_or_error(header.get('index', default_index), search_body, params)
+            responses.append({**response, "status": status})
+        return 200, {"took": 0, "responses": responses}
+
+    def _search_or_error(self, name, body, params):
+        try:
+            return self._search(name, body, params)
+        except ApiFailure as e:
+            return e.status, e.body
+
+    def _bulk(self, default_index, body):
+        started = time.perf_counter()
+        lines = iter(json.loads(line) for line in body.splitlines() if line.strip())
+        items = []
+        for action in lines:
+            (op, meta), = action.items()
+            source = next(lines) if op in ('index', 'create', 'update') else None
+            name = meta.get('_index', default_index)
+            doc_id = meta.get('_id')
+            routing = meta.get('routing', meta.get('_routing'))
+            params = {"routing": routing} if routing is not None else None
+            try:
+                if op == 'delete':
+                    status, result = self._document('DELETE', name, doc_id, None, params=params)
+                elif op == 'update':
+                    index = self._writable(name)
+                    if not index.reaches(doc_id, routing):
+                        raise ApiFailure(404, "document_missing_exception", f"[{doc_id}]: document missing")
+                    index.put(doc_id, {**index.docs[doc_id], **source.get('doc', {})}, index.routings.get(doc_id))
+                    status, result = 200, self._write_result(index, doc_id, "updated")
+                else:
+                    status, result = self._document('PUT', name, doc_id, json.dumps(source).encode(),
+                                                    create=op == 'create', params=params)
+                items.append({op: {**result, "status": status}})
+            except ApiFailure as e:
+                items.append({op: {"_index": name, "_id": doc_id, "status": e.status, "error": e.body["error"]}})
+        errors = any(item[next(iter(item))]["status"] >= 300 for item in items)
+        return 200, {"took": int((time.perf_counter() - started) * 1000), "errors": errors, "items": items}
+
+    def _mget(self, name, body, params=None):
+        requests = body.get('docs') or [{"_id": doc_id} for doc_id in body.get('ids', [])]
+        docs = []
+        for request in requests:
+            routing = request.get('routing', request.get('_routing', (params or {}).get('routing')))
+            status, doc = self._document('GET', request.get('_index', name), request['_id'], None,
+                                         params={"routing": routing} if routing is not None else None)
+            docs.append(doc)
+        return 200, {"docs": docs}
+
+    def _delete_by_query(self, name, body, params=None):
+        started = time.perf_counter()
+        index = self._writable(name)
+        matched = index.evaluate(body.get('query', {"match_all": {}}), set())
+        doc_ids = list(index.on_shards_of(matched, (params or {}).get('routing')))
+        for doc_id in doc_ids:
+            index.remove(doc_id)
+        return 200, {"took": int((time.perf_counter() - started) * 1000), "timed_out": False,
+                     "total": len(doc_ids), "deleted": len(doc_ids), "failures": []}
+
+
+class FakeNode(BaseNode):
+    """Transport node that answers requests from a FakeCluster instead of the network"""
+
+    _CLIENT_META_HTTP_CLIENT = ("fake", "1.0")
+    cluster = None
+
+    def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        started = time.perf_counter()
+        status, response = self.cluster.handle(method, target, body)
+        meta = ApiResponseMeta(status=status, http_version="1.1", headers=HttpHeaders(RESPONSE_HEADERS),
+                               duration=time.perf_counter() - started, node=self.config)
+        return NodeApiResponse(meta, json.dumps(response).encode() if response is not None else b'')
+
+
+class AsyncFakeNode(FakeNode):
+    """FakeNode for AsyncElasticsearch"""
+
+    async def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        return FakeNode.perform_request(self, method, target, body, headers, request_timeout)
+
+
+def fake_client(cluster=None, **options):
+    """Elasticsearch client wired to an in-process cluster"""
+    node_class = type('BoundFakeNode', (FakeNode,), {'cluster': cluster or FakeCluster()})
+    return Elasticsearch('http://fake-es:9200', node_class=node_class, **options)
+
+
+def fake_async_client(cluster=None, **options):
+    """AsyncElasticsearch client wired to an in-process cluster"""
+    node_class = type('BoundAsyncFakeNode', (AsyncFakeNode,), {'cluster': cluster or FakeCluster()})
+    return AsyncElasticsearch('http://fake-es:9200', node_class=node_class, **options)
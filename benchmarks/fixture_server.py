@@ -0,0 +1,167 @@
+"""Local HTTP server serving synthetic web pages for offline benchmarks.
+
+Pages are generated deterministically from their number, so every run sees
+the same corpus. Sizes follow a small/medium/large mix, half the pages
+declare a favicon link and the rest rely on /favicon.ico, like real sites.
+"""
+import argparse
+import functools
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# (approximate body size in bytes, share of pages)
+SIZE_CLASSES = [
+    (4 * 1024, 0.6),
+    (32 * 1024, 0.3),
+    (256 * 1024, 0.1)
+]
+
+VOCABULARY_SIZE = 2000
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vi", "do", "pe", "zu", "ha", "fo", "gri", "stan", "mor"]
+
+
+def build_vocabulary(size=VOCABULARY_SIZE, seed=13):
+    """Deterministic list of distinct pseudo-words used to fill pages"""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+VOCABULARY = build_vocabulary()
+
+
+def page_size(number):
+    rng = random.Random(number)
+    roll = rng.random()
+    for size, share in SIZE_CLASSES:
+        if roll < share:
+            return size
+        roll -= share
+    return SIZE_CLASSES[-1][0]
+
+
+@functools.lru_cache(maxsize=4096)
+def render_page(number):
+    """HTML of synthetic page ``number``"""
+    rng = random.Random(number)
+    # A Zipf-like skew so some words are common and others rare, as in real text
+    weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+    title = ' '.join(rng.choices(VOCABULARY, weights=weights, k=4)).title()
+    favicon = f'<link rel="icon" href="/icons/{number}.png">' if number % 2 == 0 else ''
+
+    paragraphs, written, target = [], 0, page_size(number)
+    while written < target:
+        paragraph = ' '.join(rng.choices(VOCABULARY, weights=weights, k=60)) + '.'
+        paragraphs.append(f"<p>{paragraph.capitalize()}</p>")
+        written += len(paragraph) + 7
+
+    return (
+        f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{title} #{number}</title>{favicon}"
+        "<style>body { font-family: sans-serif; }</style><script>var tracking = true;</script></head>"
+        f"<body><h1>{title}</h1>{''.join(paragraphs)}</body></html>"
+    ).encode('utf-8')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Seconds to wait before answering, to model remote sites
+    delay = 0.0
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        if self.delay:
+            time.sleep(self.delay)
+
+        path = self.path.split('?')[0]
+        if path.startswith('/page/') and path[len('/page/'):].isdigit():
+            body, content_type = render_page(int(path[len('/page/'):])), 'text/html; charset=utf-8'
+        elif path == '/favicon.ico' or path.startswith('/icons/'):
+            body, content_type = b'\x00\x00\x01\x00', 'image/x-icon'
+        else:
+            body, content_type = b'Not found', 'text/plain'
+
+        if content_type == 'text/plain':
+            self.send_response(404)
+        else:
+            # Validators like a static file server, so conditional re-crawls get 304s
+            etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """Serves the synthetic pages from a background thread on 127.0.0.1"""
+
+    def __init__(self, port=0, delay=0.0):
+        handler = type('BoundFixtureHandler', (FixtureHandler,), {'delay': delay})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def page_url(self, number):
+        return f"{self.base_url}/page/{number}"
+
+    def page_urls(self, count, start=0):
+        return [self.page_url(number) for number in range(start, start + count)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fixture-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic benchmark pages at /page/<n>")
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before each response")
+    args = parser.parse_args()
+
+    server = FixtureServer(args.port, args.delay)
+    print(f"Serving synthetic pages at {server.base_url}/page/<n>")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Compare the "full" and "passages" content layouts on a real cluster.
+
+Loads the same synthetic corpus (the fixture pages, parsed by the app's
+scraper) into one scratch index per layout, force-merges them and reports
+the store size from the index stats, then runs the /search tiers against
+each index with and without highlighting and reports search latency,
+highlight overhead and the size of the responses:
+
+    python -m benchmarks.passage_layout --pages 500 --queries 300
+
+Connection settings come from the same ELASTIC_* variables as the app. The
+scratch indices are deleted afterwards unless --keep is given. --fake runs
+against the in-process stand-in to check the script itself; it has no
+Lucene store, so sizes are reported as n/a and its latencies say nothing
+about a real cluster.
+"""
+import argparse
+import copy
+import json
+import sys
+import time
+
+from elasticsearch import ApiError, helpers
+
+from benchmarks.fake_es import FakeCluster, fake_client
+from benchmarks.fixture_server import render_page
+from benchmarks.run_benchmarks import percentile, search_queries
+from es_client import create_elasticsearch_client
+from indexing import build_document, document_id, index_body, stored_document
+from scraper import extract_page
+from search_queries import SEARCH_TIERS, search_body
+
+LAYOUTS = ['full', 'passages']
+
+
+def load_corpus(es, index, layout, pages):
+    """Create a scratch index for a layout and bulk load the corpus into it"""
+    body = copy.deepcopy(index_body(layout))
+    body["settings"]["index"] = {"number_of_shards": 1, "number_of_replicas": 0}
+    if es.indices.exists(index=index):
+        es.indices.delete(index=index)
+    es.indices.create(index=index, body=body)
+
+    actions = ({"_index": index, "_id": document_id(url), "_source": stored_document(document, layout)}
+               for url, document in pages)
+    started = time.perf_counter()
+    helpers.bulk(es, actions, chunk_size=200)
+    es.indices.refresh(index=index)
+    elapsed = time.perf_counter() - started
+    try:
+        # One segment per index, so both layouts are measured in the same state
+        es.indices.forcemerge(index=index, max_num_segments=1)
+        es.indices.refresh(index=index)
+    except ApiError:
+        pass
+    return elapsed
+
+
+def index_size(es, index):
+    """(store bytes, Lucene documents) from the index stats, or (None, None) if they are unavailable"""
+    try:
+        stats = es.indices.stats(index=index, metric=["store", "docs"])
+    except ApiError:
+        return None, None
+    primaries = stats["indices"][index]["primaries"]
+    return primaries["store"]["size_in_bytes"], primaries["docs"]["count"]
+
+
+def without_highlight(node):
+    """Copy of a request body with every highlight section removed, including those of inner_hits"""
+    if isinstance(node, dict):
+        return {key: without_highlight(value) for key, value in node.items() if key != "highlight"}
+    if isinstance(node, list):
+        return [without_highlight(value) for value in node]
+    return node
+
+
+def time_searches(es, index, layout, queries, highlight):
+    """Run every query through every tier; returns client latencies, server took values and response bytes"""
+    latencies, took, response_bytes = [], [], 0
+    for query in queries:
+        for _, tier_query in SEARCH_TIERS:
+            body = search_body(query, tier_query, layout == 'passages')
+            if not highlight:
+                body = without_highlight(body)
+            started = time.perf_counter()
+            response = es.search(index=index, body=body)
+            latencies.append(time.perf_counter() - started)
+            took.append(response["took"] / 1000)
+            response_bytes += len(json.dumps(response.body))
+    return sorted(latencies), sorted(took), response_bytes
+
+
+def measure(es, index, layout, pages, queries):
+    load_seconds = load_corpus(es, index, layout, pages)
+    size, lucene_docs = index_size(es, index)
+    plain, plain_took, _ = time_searches(es, index, layout, queries, highlight=False)
+    highlighted, highlighted_took, response_bytes = time_searches(es, index, layout, queries, highlight=True)
+    return {
+        "layout": layout,
+        "load_s": load_seconds,
+        "store_bytes": size,
+        "lucene_docs": lucene_docs,
+        "search_p50_ms": percentile(plain, 50) * 1000,
+        "search_p95_ms": percentile(plain, 95) * 1000,
+        "highlight_p50_ms": percentile(highlighted, 50) * 1000,
+        "highlight_p95_ms": percentile(highlighted, 95) * 1000,
+        "took_p50_ms": percentile(plain_took, 50) * 1000,
+        "highlight_took_p50_ms": percentile(highlighted_took, 50) * 1000,
+        "response_kb_per_search": response_bytes / max(len(highlighted), 1) / 1024
+    }
+
+
+def print_report(rows, settings):
+    print(f"\n{settings}\n")
+    columns = [
+        ("layout", "layout", "{}"),
+        ("store MB", "store_bytes", "{:.1f}"),
+        ("lucene docs", "lucene_docs", "{}"),
+        ("load s", "load_s", "{:.1f}"),
+        ("p50 ms", "search_p50_ms", "{:.2f}"),
+        ("p95 ms", "search_p95_ms", "{:.2f}"),
+        ("hl p50 ms", "highlight_p50_ms", "{:.2f}"),
+        ("hl p95 ms", "highlight_p95_ms", "{:.2f}"),
+        ("took p50", "took_p50_ms", "{:.2f}"),
+        ("hl took p50", "highlight_took_p50_ms", "{:.2f}"),
+        ("resp KB", "response_kb_per_search", "{:.1f}")
+    ]
+    print(''.join(f"{title:>13}" for title, _, _ in columns))
+    for row in rows:
+        cells = []
+        for _, key, fmt in columns:
+            value = row[key]
+            if key == "store_bytes" and value is not None:
+                value = value / (1024 * 1024)
+            cells.append(f"{'n/a' if value is None else fmt.format(value):>13}")
+        print(''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure index size and search/highlight latency per content layout")
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=300, help="queries per run; each runs through both tiers")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--index-prefix', default='webpages-layout-bench')
+    parser.add_argument('--keep', action='store_true', help="keep the scratch indices for inspection")
+    parser.add_argument('--fake', action='store_true', help="use the in-process stand-in instead of a cluster")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    es = fake_client(FakeCluster()) if args.fake else create_elasticsearch_client()
+    if es is None:
+        return 1
+
+    pages = []
+    for number in range(args.pages):
+        url = f"http://fixtures.invalid/page/{number}"
+        pages.append((url, build_document(url, extract_page(url, render_page(number)))))
+    queries = search_queries(args.queries, args.seed)
+
+    rows, indices = [], []
+    try:
+        for layout in LAYOUTS:
+            indices.append(f"{args.index_prefix}-{layout}")
+            rows.append(measure(es, indices[-1], layout, pages, queries))
+    finally:
+        if not args.keep:
+            for index in indices:
+                es.indices.delete(index=index, ignore_unavailable=True)
+
+    settings = {"pages": args.pages, "queries": args.queries, "target": "stand-in" if args.fake else "cluster"}
+    if args.json:
+        json.dump({"settings": settings, "results": rows}, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(rows, ', '.join(f"{key}={value}" for key, value in settings.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
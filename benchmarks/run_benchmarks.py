@@ -0,0 +1,216 @@
+"""Offline load benchmark for the Flask routes.
+
+Starts the fixture page server and an in-process Elasticsearch stand-in
+(or the embedded index with --backend embedded), then drives /add_url,
+/search, /suggest, /urls and DELETE /url/<url> concurrently through Flask's test
+client and reports throughput and latency percentiles for each. Nothing leaves the machine, so runs are comparable across commits:
+
+    python -m benchmarks.run_benchmarks --pages 300 --concurrency 16
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from benchmarks.fake_es import FakeCluster, fake_client
+from benchmarks.fixture_server import VOCABULARY, FixtureServer
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run_phase(app, name, calls, concurrency):
+    """Run ``calls`` (functions taking a test client) on a thread pool and summarize them"""
+    local = threading.local()
+
+    def timed(call):
+        # Test clients keep per-instance state, so each worker thread gets its own
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        started = time.perf_counter()
+        response = call(local.client)
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, calls))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    return {
+        "operation": name,
+        "requests": len(results),
+        "errors": sum(1 for _, status in results if status >= 400),
+        "throughput": len(results) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000
+    }
+
+
+def search_queries(count, seed):
+    """Mix of common words, word pairs, prefixes and typos (which fall through to the fuzzy tier)"""
+    rng = random.Random(seed)
+    common = VOCABULARY[:200]
+    queries = []
+    for _ in range(count):
+        word = rng.choice(common)
+        roll = rng.random()
+        if roll < 0.4:
+            queries.append(word)
+        elif roll < 0.6:
+            queries.append(f"{word} {rng.choice(common)}")
+        elif roll < 0.8:
+            queries.append(word[:rng.randint(3, max(len(word) - 1, 3))])
+        else:
+            position = rng.randrange(1, len(word))
+            queries.append(word[:position] + rng.choice('xyzq') + word[position + 1:])
+    return queries
+
+
+def suggest_prefixes(count, seed):
+    """What a user has typed so far: the first one to five letters of a word, sometimes after a whole word"""
+    rng = random.Random(seed)
+    prefixes = []
+    for _ in range(count):
+        word = rng.choice(VOCABULARY[:500])
+        prefix = word[:rng.randint(1, min(5, len(word)))]
+        prefixes.append(f"{rng.choice(VOCABULARY[:200])} {prefix}" if rng.random() < 0.3 else prefix)
+    return prefixes
+
+
+def print_report(stats, settings):
+    print(f"\n{settings}\n")
+    header = f"{'operation':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for row in stats:
+        print(f"{row['operation']:<10}{row['requests']:>10}{row['errors']:>8}{row['throughput']:>10.1f}"
+              f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Flask routes against local fixtures")
+    parser.add_argument('--pages', type=int, default=200, help="pages to add (and later delete)")
+    parser.add_argument('--searches', type=int, default=1000)
+    parser.add_argument('--suggests', type=int, default=1000)
+    parser.add_argument('--lists', type=int, default=300)
+    parser.add_argument('--polls', type=int, default=1000,
+                        help="refreshes of an unchanged /urls with the client's ETag (needs --search-cache memory)")
+    parser.add_argument('--page-size', type=int, default=50, help="page_size used by the /urls phase")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--es-latency', type=float, default=0.0, help="simulated round trip to Elasticsearch, ms")
+    parser.add_argument('--page-delay', type=float, default=0.0, help="simulated response time of the pages, ms")
+    parser.add_argument('--backend', choices=['elasticsearch', 'embedded'], default='elasticsearch',
+                        help="SEARCH_BACKEND for the run; elasticsearch uses the in-process stand-in")
+    parser.add_argument('--layout', choices=['full', 'passages'], default='full',
+                        help="CONTENT_LAYOUT for the run (Elasticsearch backend only)")
+    parser.add_argument('--search-cache', choices=['none', 'memory'], default='none',
+                        help="SEARCH_CACHE_BACKEND for the run; 'none' measures Elasticsearch on every search")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    # Settings read at import time, so they must be in place before importing the app
+    workdir = tempfile.mkdtemp(prefix='linkedout-bench-')
+    os.environ['FAVICON_CACHE_PATH'] = os.path.join(workdir, 'favicon_cache.sqlite3')
+    os.environ['SEARCH_CACHE_BACKEND'] = args.search_cache
+    os.environ['INGEST_MODE'] = 'sync'
+    os.environ['SEARCH_BACKEND'] = args.backend
+    os.environ['CONTENT_LAYOUT'] = args.layout
+    os.environ['EMBEDDED_INDEX_PATH'] = os.path.join(workdir, 'search_index.sqlite3')
+    os.environ['HTML_ARCHIVE_PATH'] = os.path.join(workdir, 'html_archive.sqlite3')
+    # The stand-in makes writes searchable at once, so caching and ETags need not wait for a refresh
+    os.environ['SEARCH_CACHE_SETTLE_SECONDS'] = '0'
+    # Keeps the bundled vector store untouched; the phases only exercise lexical search
+    os.environ['SEMANTIC_SEARCH'] = 'false'
+
+    import app as webapp
+    from indexing import index_body
+
+    logging.disable(logging.WARNING)
+    if args.backend == 'elasticsearch':
+        es = fake_client(FakeCluster(latency=args.es_latency / 1000))
+        es.indices.create(index="webpages", body=index_body())
+        webapp.es_manager.set_client(es)
+
+    stats = []
+    with FixtureServer(delay=args.page_delay / 1000) as fixtures:
+        urls = fixtures.page_urls(args.pages)
+        stats.append(run_phase(webapp.app, 'add', [
+            lambda client, url=url: client.post('/add_url', data={"url": url}) for url in urls
+        ], args.concurrency))
+
+        stats.append(run_phase(webapp.app, 'search', [
+            lambda client, query=query: client.get('/search', query_string={"q": query})
+            for query in search_queries(args.searches, args.seed)
+        ], args.concurrency))
+
+        stats.append(run_phase(webapp.app, 'suggest', [
+            lambda client, prefix=prefix: client.get('/suggest', query_string={"q": prefix})
+            for prefix in suggest_prefixes(args.suggests, args.seed)
+        ], args.concurrency))
+
+        # Collect the cursors of every listing page first, then request pages at random
+        cursors, cursor = [None], None
+        with webapp.app.test_client() as client:
+            while True:
+                page = client.get('/urls', query_string={"page_size": args.page_size,
+                                                         **({"cursor": cursor} if cursor else {})}).get_json()
+                cursor = page.get("next_cursor")
+                if not cursor:
+                    break
+                cursors.append(cursor)
+        rng = random.Random(args.seed)
+        stats.append(run_phase(webapp.app, 'list', [
+            lambda client, cursor=rng.choice(cursors): client.get('/urls', query_string={
+                "page_size": args.page_size, **({"cursor": cursor} if cursor else {})
+            }) for _ in range(args.lists)
+        ], args.concurrency))
+
+        # The UI re-fetching /urls: with the search cache, the ETag of its last copy makes it a 304
+        with webapp.app.test_client() as client:
+            etag = client.get('/urls').headers.get('ETag', '')
+        stats.append(run_phase(webapp.app, 'poll', [
+            lambda client: client.get('/urls', headers={"If-None-Match": etag, "Accept-Encoding": "gzip, br"})
+            for _ in range(args.polls)
+        ], args.concurrency))
+
+        stats.append(run_phase(webapp.app, 'delete', [
+            lambda client, url=url: client.delete(f"/url/{quote(url, safe='')}") for url in urls
+        ], args.concurrency))
+
+    settings = {
+        "backend": args.backend,
+        "layout": args.layout,
+        "pages": args.pages,
+        "concurrency": args.concurrency,
+        "es_latency_ms": args.es_latency,
+        "page_delay_ms": args.page_delay,
+        "search_cache": args.search_cache
+    }
+    if args.json:
+        json.dump({"settings": settings, "results": stats}, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(stats, ', '.join(f"{key}={value}" for key, value in settings.items()))
+
+    if any(row["errors"] for row in stats):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
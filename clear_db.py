@@ -1,7 +1,14 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, NotFoundError, helpers
+import argparse
 import os
+import sys
+import time
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from indexing import index_body, index_version, versioned_index
+from search_cache import create_search_cache
+
 # Load environment variables
 load_dotenv()
 
@@ -12,6 +19,36 @@ ELASTIC_HOST = os.getenv('ELASTIC_HOST', 'localhost')
 ELASTIC_PORT = os.getenv('ELASTIC_PORT', '9200')
 ELASTIC_USE_SSL = os.getenv('ELASTIC_USE_SSL', 'true').lower() == 'true'
 
+# Reindex throttle in documents per second across all slices (-1 disables it),
+# and the number of slices copied in parallel ("auto": one per shard)
+REINDEX_REQUESTS_PER_SECOND = float(os.getenv('REINDEX_REQUESTS_PER_SECOND', '-1'))
+REINDEX_SLICES = os.getenv('REINDEX_SLICES', 'auto')
+# Documents written this many seconds before the copy started are copied again,
+# in case the clocks of the app servers lag behind this one
+REINDEX_CLOCK_SKEW = 300
+
+USERS_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "username": {"type": "keyword"},
+            "email": {
+                "type": "text",
+                "fields": {
+                    "keyword": {"type": "keyword"}
+                }
+            },
+            "password_hash": {"type": "keyword"},
+            "created_at": {"type": "date"}
+        }
+    }
+}
+
+# Index body of every alias, and the field holding the time each document was last written
+INDICES = {
+    'users': (USERS_INDEX_BODY, 'created_at'),
+    'webpages': (index_body(), 'timestamp')
+}
+
 def create_elasticsearch_client():
     """Create Elasticsearch client with appropriate configuration"""
     try:
@@ -19,7 +56,7 @@ def create_elasticsearch_client():
             'hosts': [f"{'https' if ELASTIC_USE_SSL else 'http'}://{ELASTIC_HOST}:{ELASTIC_PORT}"],
             'basic_auth': ("elastic", ELASTIC_PASSWORD)
         }
-        
+
         if ELASTIC_USE_SSL:
             config.update({
                 'ca_certs': ELASTIC_CERT_PATH,
@@ -29,7 +66,7 @@ def create_elasticsearch_client():
             config.update({
                 'verify_certs': False
             })
-            
+
         client = Elasticsearch(**config)
         if client.ping():
             print("Successfully connected to Elasticsearch!")
@@ -41,86 +78,191 @@ def create_elasticsearch_client():
         print(f"Failed to connect to Elasticsearch: {str(e)}")
         return None
 
+def aliased_indices(es, alias):
+    """Concrete indices behind an alias: [alias] if it is still a plain index, [] if neither exists"""
+    try:
+        return sorted(es.indices.get_alias(name=alias))
+    except NotFoundError:
+        return [alias] if es.indices.exists(index=alias) else []
+
+def create_aliased_index(es, alias, body, version=1):
+    name = versioned_index(alias, version)
+    es.indices.create(index=name, body={**body, "aliases": {alias: {}}})
+    return name
+
 def clear_and_recreate_indices():
     es = create_elasticsearch_client()
     if not es:
         print("Failed to connect to Elasticsearch")
         return
 
-    # List of indices to clear and recreate
-    indices = ['users', 'webpages']
-
-    for index in indices:
+    for alias, (body, _) in INDICES.items():
         try:
-            # Delete index if it exists
-            if es.indices.exists(index=index):
+            # Delete every index behind the alias, or the plain index of that name
+            for index in aliased_indices(es, alias):
                 es.indices.delete(index=index)
                 print(f"Deleted index: {index}")
 
-            # Create index with mappings
-            if index == 'users':
-                es.indices.create(index=index, body={
-                    "mappings": {
-                        "properties": {
-                            "username": {"type": "keyword"},
-                            "email": {
-                                "type": "text",
-                                "fields": {
-                                    "keyword": {"type": "keyword"}
-                                }
-                            },
-                            "password_hash": {"type": "keyword"},
-                            "created_at": {"type": "date"}
-                        }
-                    }
-                })
-            elif index == 'webpages':
-                es.indices.create(index=index, body={
-                    "settings": {
-                        "analysis": {
-                            "analyzer": {
-                                "custom_analyzer": {
-                                    "type": "custom",
-                                    "tokenizer": "standard",
-                                    "filter": ["lowercase", "custom_edge_ngram"]
-                                }
-                            },
-                            "filter": {
-                                "custom_edge_ngram": {
-                                    "type": "edge_ngram",
-                                    "min_gram": 2,
-                                    "max_gram": 10
-                                }
-                            }
-                        }
-                    },
-                    "mappings": {
-                        "properties": {
-                            "url": {"type": "keyword"},
-                            "content": {
-                                "type": "text",
-                                "analyzer": "custom_analyzer",
-                                "search_analyzer": "standard"
-                            },
-                            "title": {
-                                "type": "text",
-                                "analyzer": "custom_analyzer",
-                                "search_analyzer": "standard",
-                                "fields": {
-                                    "keyword": {
-                                        "type": "keyword"
-                                    }
-                                }
-                            },
-                            "favicon": {"type": "keyword"},
-                            "timestamp": {"type": "date"},
-                            "user_id": {"type": "keyword"}
-                        }
-                    }
-                })
-            print(f"Created index: {index}")
+            # Create the first version of the index, reached through the alias
+            print(f"Created index: {create_aliased_index(es, alias, body)}")
+        except Exception as e:
+            print(f"Error processing index {alias}: {str(e)}")
+
+def run_reindex(es, source, target, query=None, slices=REINDEX_SLICES,
+                requests_per_second=REINDEX_REQUESTS_PER_SECOND, poll_interval=5):
+    """Copy documents with a sliced, throttled _reindex task; returns how many were written"""
+    source_spec = {"index": source}
+    if query:
+        source_spec["query"] = query
+    task = es.reindex(source=source_spec, dest={"index": target}, slices=slices,
+                      requests_per_second=requests_per_second, wait_for_completion=False)["task"]
+    while True:
+        result = es.tasks.get(task_id=task)
+        if result.get("completed"):
+            break
+        status = result["task"]["status"]
+        print(f"  {status['created'] + status['updated']} of {status['total']} documents copied")
+        time.sleep(poll_interval)
+
+    response = result.get("response", {})
+    failures = result.get("error") or response.get("failures")
+    if failures:
+        raise RuntimeError(f"Reindex into {target} failed: {failures}")
+    return response.get("created", 0) + response.get("updated", 0)
+
+def prune_deleted(es, source, target):
+    """Delete the documents of target that are gone from source; returns how many"""
+    live = {(hit["_id"], hit.get("_routing"))
+            for hit in helpers.scan(es, index=source, query={"_source": False}, size=1000)}
+    stale = [(hit["_id"], hit.get("_routing"))
+             for hit in helpers.scan(es, index=target, query={"_source": False}, size=1000)
+             if (hit["_id"], hit.get("_routing")) not in live]
+    # Pages of a user's library are routed by its owner, and a delete without that routing misses them
+    actions = ({"_op_type": "delete", "_index": target, "_id": doc_id,
+                **({"_routing": routing} if routing is not None else {})} for doc_id, routing in stale)
+    for ok, item in helpers.streaming_bulk(es, actions, raise_on_error=False):
+        if not ok:
+            raise RuntimeError(f"Failed to delete {item['delete']['_id']} from {target}: {item['delete'].get('error')}")
+    return len(stale)
+
+def swap_alias(es, alias, sources, target):
+    """Point the alias at target instead of sources in one atomic update"""
+    actions = [{"add": {"index": target, "alias": alias}}]
+    if sources == [alias]:
+        # A plain index must be removed in the same update for the alias to take over its name
+        actions.append({"remove_index": {"index": alias}})
+    else:
+        actions += [{"remove": {"index": index, "alias": alias}} for index in sources]
+    es.indices.update_aliases(actions=actions)
+
+def set_write_block(es, indices, blocked):
+    for index in indices:
+        es.indices.put_settings(index=index, settings={"index.blocks.write": blocked})
+
+def reindex(es, alias, body, timestamp_field=None, slices=REINDEX_SLICES,
+            requests_per_second=REINDEX_REQUESTS_PER_SECOND, keep_old=False):
+    """Copy the index behind an alias into a new version with ``body``'s mappings, then swap the alias.
+
+    Searches and writes keep going to the old index during the bulk copy.
+    The old index is then write-blocked while documents written since the
+    copy started (by ``timestamp_field``) are copied again and documents
+    deleted meanwhile are removed; this short window is the only time
+    writes are refused. The alias moves to the new index atomically, and on
+    any failure before that the new index is dropped and nothing changes.
+    Returns the name of the index now behind the alias.
+    """
+    sources = aliased_indices(es, alias)
+    if not sources:
+        target = create_aliased_index(es, alias, body)
+        print(f"Created index: {target}")
+        return target
+
+    target = versioned_index(alias, max(index_version(alias, index) for index in sources) + 1)
+    settings = es.indices.get_settings(index=alias)
+    replicas = next(iter(settings.values()))["settings"]["index"].get("number_of_replicas", "1")
+    # Load without replicas or refreshes, then restore them, as recommended for bulk loads
+    es.indices.create(index=target, body={
+        **body, "settings": {**body.get("settings", {}), "number_of_replicas": 0, "refresh_interval": "-1"}
+    })
+    print(f"Copying {alias} ({', '.join(sources)}) into {target}")
+
+    started = datetime.utcnow() - timedelta(seconds=REINDEX_CLOCK_SKEW)
+    try:
+        print(f"Copied {run_reindex(es, alias, target, None, slices, requests_per_second)} documents")
+
+        set_write_block(es, sources, True)
+        es.indices.refresh(index=alias)
+        if timestamp_field:
+            since = {"range": {timestamp_field: {"gte": started.isoformat()}}}
+            # Unthrottled: writes are refused until it finishes
+            print(f"Copied {run_reindex(es, alias, target, since, slices, -1)} documents written during the copy")
+        es.indices.put_settings(index=target, settings={
+            "index": {"number_of_replicas": replicas, "refresh_interval": None}
+        })
+        es.indices.refresh(index=target)
+        print(f"Removed {prune_deleted(es, alias, target)} documents deleted during the copy")
+
+        source_count, target_count = es.count(index=alias)["count"], es.count(index=target)["count"]
+        if source_count != target_count:
+            raise RuntimeError(f"{target} has {target_count} documents, {alias} has {source_count}")
+        es.cluster.health(index=target, wait_for_status="yellow", timeout="5m")
+        swap_alias(es, alias, sources, target)
+    except BaseException:
+        print(f"Reindex of {alias} failed, removing {target}")
+        es.indices.delete(index=target, ignore_unavailable=True)
+        set_write_block(es, sources, False)
+        raise
+    print(f"Alias {alias} now points to {target}")
+
+    old = [index for index in sources if index != alias]
+    if keep_old:
+        # Kept for rolling back by hand, so it has to accept writes again
+        set_write_block(es, old, False)
+        print(f"Kept previous indices: {', '.join(old) or 'none'}")
+    else:
+        for index in old:
+            es.indices.delete(index=index)
+            print(f"Deleted index: {index}")
+    return target
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Delete and recreate the Elasticsearch indices, or reindex them into the current mappings "
+                    "without downtime"
+    )
+    parser.add_argument('--reindex', action='store_true',
+                        help="copy each index into a new version and swap its alias instead of deleting the data")
+    parser.add_argument('--index', action='append', choices=sorted(INDICES),
+                        help="only reindex this index (repeatable)")
+    parser.add_argument('--slices', default=REINDEX_SLICES, help="parallel reindex slices, or 'auto'")
+    parser.add_argument('--requests-per-second', type=float, default=REINDEX_REQUESTS_PER_SECOND,
+                        help="reindex throttle in documents per second, -1 for none")
+    parser.add_argument('--keep-old', action='store_true', help="keep the previous versioned index after the swap")
+    args = parser.parse_args()
+
+    if not args.reindex:
+        clear_and_recreate_indices()
+        return 0
+
+    es = create_elasticsearch_client()
+    if not es:
+        print("Failed to connect to Elasticsearch")
+        return 1
+
+    slices = int(args.slices) if args.slices.isdigit() else args.slices
+    for alias in args.index or sorted(INDICES):
+        body, timestamp_field = INDICES[alias]
+        try:
+            reindex(es, alias, body, timestamp_field, slices, args.requests_per_second, args.keep_old)
         except Exception as e:
-            print(f"Error processing index {index}: {str(e)}")
+            print(f"Error reindexing {alias}: {str(e)}")
+            return 2
+
+    # Scores can change with the new mappings
+    search_cache = create_search_cache()
+    if search_cache:
+        search_cache.invalidate()
+    return 0
 
 if __name__ == '__main__':
-    clear_and_recreate_indices() 
\ No newline at end of file
+    sys.exit(main())
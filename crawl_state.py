@@ -0,0 +1,157 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from indexing import document_id
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+RECRAWL_STATE_PATH = os.getenv('RECRAWL_STATE_PATH', 'crawl_state.sqlite3')
+# Seconds between fetches of a page: starts at the initial interval, halves
+# when the page changed and grows by half when it did not, within the bounds
+RECRAWL_INITIAL_INTERVAL = float(os.getenv('RECRAWL_INITIAL_INTERVAL', str(24 * 3600)))
+RECRAWL_MIN_INTERVAL = float(os.getenv('RECRAWL_MIN_INTERVAL', '3600'))
+RECRAWL_MAX_INTERVAL = float(os.getenv('RECRAWL_MAX_INTERVAL', str(30 * 24 * 3600)))
+# Claimed pages are hidden from other schedulers this long, in case this one dies mid-batch
+RECRAWL_LEASE = float(os.getenv('RECRAWL_LEASE', '900'))
+
+STATE_COLUMNS = ["doc_id", "url", "user_id", "etag", "last_modified", "last_fetched", "interval", "checks",
+                 "changes", "failures"]
+
+
+class CrawlState:
+    """Per-page crawl schedule persisted in a SQLite file.
+
+    Keeps the validators (ETag, Last-Modified) of the last fetch, when it
+    happened, the current re-crawl interval and how often the page was
+    checked, changed or failed. It lives outside the search backend, so a
+    304 or an unchanged page costs one small SQLite write instead of
+    rewriting the document. The file is shared by every process on the
+    host; schedulers claim due pages with a lease, so each is fetched once.
+    """
+
+    def __init__(self, path=RECRAWL_STATE_PATH, initial_interval=RECRAWL_INITIAL_INTERVAL,
+                 min_interval=RECRAWL_MIN_INTERVAL, max_interval=RECRAWL_MAX_INTERVAL):
+        self.path = path
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS crawl_state (
+                    doc_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    last_fetched REAL NOT NULL,
+                    next_fetch REAL NOT NULL,
+                    interval REAL NOT NULL,
+                    checks INTEGER NOT NULL DEFAULT 0,
+                    changes INTEGER NOT NULL DEFAULT 0,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    user_id TEXT
+                )
+            """)
+            if "user_id" not in {row[1] for row in conn.execute("PRAGMA table_info(crawl_state)")}:
+                conn.execute("ALTER TABLE crawl_state ADD COLUMN user_id TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS crawl_state_next_fetch ON crawl_state (next_fetch)")
+            self._local.conn = conn
+        return conn
+
+    def track(self, url, etag=None, last_modified=None, user_id=None):
+        """Record a page that was just fetched and stored; keeps its interval and history if already tracked"""
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT INTO crawl_state (doc_id, url, user_id, etag, last_modified, last_fetched, next_fetch, "
+                "interval) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (doc_id) DO UPDATE SET url = excluded.url, etag = excluded.etag, "
+                "last_modified = excluded.last_modified, last_fetched = excluded.last_fetched, "
+                "next_fetch = excluded.last_fetched + crawl_state.interval",
+                (document_id(url, user_id), url, user_id, etag, last_modified, now, now + self.initial_interval,
+                 self.initial_interval)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to record the crawl state of {url}: {str(e)}")
+
+    def seed(self, url, fetched_at, user_id=None):
+        """Start tracking a page stored before the scheduler ran, due at a random point of the first interval"""
+        self._connection().execute(
+            "INSERT OR IGNORE INTO crawl_state (doc_id, url, user_id, last_fetched, next_fetch, interval) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (document_id(url, user_id), url, user_id, fetched_at,
+             time.time() + random.uniform(0, self.initial_interval), self.initial_interval)
+        )
+
+    def forget(self, url, user_id=None):
+        try:
+            self._connection().execute("DELETE FROM crawl_state WHERE doc_id = ?", (document_id(url, user_id),))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to remove the crawl state of {url}: {str(e)}")
+
+    def is_tracked(self, doc_id):
+        row = self._connection().execute("SELECT 1 FROM crawl_state WHERE doc_id = ?", (doc_id,)).fetchone()
+        return row is not None
+
+    def pages(self):
+        """(url, user_id) of every tracked page, grouped by library"""
+        return self._connection().execute("SELECT url, user_id FROM crawl_state ORDER BY user_id, url").fetchall()
+
+    def claim_due(self, limit, lease=RECRAWL_LEASE):
+        """Claim up to ``limit`` due pages, the furthest behind their interval first.
+
+        A page that changes often has a short interval, so for the same time
+        since its last fetch it ranks above one that rarely changes.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(STATE_COLUMNS)} FROM crawl_state WHERE next_fetch <= ? "
+                "ORDER BY (? - last_fetched) / interval DESC LIMIT ?", (now, now, limit)
+            ).fetchall()
+            conn.executemany("UPDATE crawl_state SET next_fetch = ? WHERE doc_id = ?",
+                             [(now + lease, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [dict(zip(STATE_COLUMNS, row)) for row in rows]
+
+    def record(self, page, outcome, etag=None, last_modified=None):
+        """Schedule the next fetch of a claimed page after a "changed", "unchanged" or "failed" check"""
+        now = time.time()
+        conn = self._connection()
+        if outcome == "failed":
+            # Retry failing pages with exponential backoff; their interval and validators stay as they were
+            delay = min(page["interval"] * 2 ** page["failures"], self.max_interval)
+            conn.execute("UPDATE crawl_state SET next_fetch = ?, checks = checks + 1, failures = failures + 1 "
+                         "WHERE doc_id = ?", (now + delay, page["doc_id"]))
+            return
+        if outcome == "changed":
+            interval = max(page["interval"] / 2, self.min_interval)
+        else:
+            interval = min(page["interval"] * 1.5, self.max_interval)
+        conn.execute(
+            "UPDATE crawl_state SET etag = ?, last_modified = ?, last_fetched = ?, next_fetch = ?, interval = ?, "
+            "checks = checks + 1, changes = changes + ?, failures = 0 WHERE doc_id = ?",
+            (etag, last_modified, now, now + interval, interval, int(outcome == "changed"), page["doc_id"])
+        )
+
+
+crawl_state = CrawlState()
@@ -0,0 +1,502 @@
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from fingerprints import NEAR_DUPLICATE_CANDIDATES
+from indexing import WEBPAGES_INDEX_BODY
+from search_queries import HIGHLIGHT, SEARCH_HIGHLIGHT_MAX_CHARS, SEARCH_MIN_HITS, SEARCH_PAGE_SIZE
+
+# Load environment variables
+load_dotenv()
+
+EMBEDDED_INDEX_PATH = os.getenv('EMBEDDED_INDEX_PATH', 'search_index.sqlite3')
+
+# Same gram sizes as the custom_edge_ngram filter of the Elasticsearch mapping
+_EDGE_NGRAM = WEBPAGES_INDEX_BODY["settings"]["analysis"]["filter"]["custom_edge_ngram"]
+MIN_GRAM = _EDGE_NGRAM["min_gram"]
+MAX_GRAM = _EDGE_NGRAM["max_gram"]
+
+TOKEN_RE = re.compile(r"\w+")
+FIELDS = {"title": 0, "content": 1}
+LISTING_COLUMNS = ["url", "title", "favicon", "timestamp", "user_id"]
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Leading characters a fuzzy match must share with the query term, as in fuzzy_query
+FUZZY_PREFIX_LENGTH = 2
+# Above the last character any term can start with, for prefix range scans
+MAX_CHAR = '\U0010ffff'
+# Only the text the highlighter reads is loaded for a hit, as max_analyzed_offset bounds it in Elasticsearch
+HIGHLIGHT_CONTENT = (f"substr(d.content, 1, {SEARCH_HIGHLIGHT_MAX_CHARS})" if SEARCH_HIGHLIGHT_MAX_CHARS > 0
+                     else "d.content")
+
+
+def tokenize(text):
+    """Standard tokenizer plus lowercase filter"""
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+def fuzzy_distance(term):
+    """Edit distance allowed by fuzziness=AUTO"""
+    return 0 if len(term) < 3 else 1 if len(term) < 6 else 2
+
+
+def within_distance(a, b, limit):
+    """True if the Levenshtein distance between a and b is at most ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def query_grams(query):
+    """Search-side analysis: standard tokens, clipped to the longest indexed gram.
+
+    Elasticsearch cannot match query terms longer than max_gram, since no
+    gram that long was indexed; clipping keeps long words findable.
+    """
+    return [token[:MAX_GRAM] for token in tokenize(query) if len(token) >= MIN_GRAM]
+
+
+class EmbeddedIndex:
+    """On-disk inverted index over webpages, stored in a SQLite file.
+
+    Mirrors the Elasticsearch custom_analyzer without materializing every
+    edge n-gram: postings hold whole words, and a query gram matches every
+    word it is a prefix of through a range scan on the postings key. Ranking
+    is BM25 per field, searched in the same exact-then-fuzzy tiers as
+    search_queries, with highlight snippets built from the stored text.
+    Every write updates the postings of that one document in place.
+    Searches and listings cover one library: a user's pages, or the shared
+    pages stored without an owner.
+    """
+
+    def __init__(self, path=EMBEDDED_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        # SQLite takes one writer at a time; queue writers here instead of on its busy timeout
+        self._write_lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS docs (
+                    id INTEGER PRIMARY KEY,
+                    doc_id TEXT NOT NULL UNIQUE,
+                    url TEXT NOT NULL,
+                    title TEXT,
+                    content TEXT,
+                    favicon TEXT,
+                    timestamp TEXT,
+                    title_len INTEGER NOT NULL,
+                    content_len INTEGER NOT NULL,
+                    user_id TEXT
+                );
+                CREATE INDEX IF NOT EXISTS docs_listing ON docs (timestamp DESC, url);
+                CREATE TABLE IF NOT EXISTS postings (
+                    field INTEGER NOT NULL,
+                    term TEXT NOT NULL,
+                    doc INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (field, term, doc)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+                CREATE TABLE IF NOT EXISTS vocabulary (
+                    field INTEGER NOT NULL,
+                    term TEXT NOT NULL,
+                    df INTEGER NOT NULL,
+                    PRIMARY KEY (field, term)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    doc INTEGER PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    simhash TEXT NOT NULL,
+                    cluster TEXT,
+                    duplicate_of TEXT
+                );
+                CREATE TABLE IF NOT EXISTS simhash_bands (
+                    band TEXT NOT NULL,
+                    doc INTEGER NOT NULL,
+                    PRIMARY KEY (band, doc)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS simhash_bands_doc ON simhash_bands (doc);
+            """)
+            # Files created before pages had owners hold only shared pages
+            if "user_id" not in {row[1] for row in conn.execute("PRAGMA table_info(docs)")}:
+                conn.execute("ALTER TABLE docs ADD COLUMN user_id TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS docs_owner_listing ON docs (user_id, timestamp DESC, url)")
+            self._local.conn = conn
+        return conn
+
+    # Writes
+
+    def upsert(self, doc_id, document):
+        """Add a document, or replace the one stored under the same id"""
+        self.upsert_many([(doc_id, document)])
+
+    def upsert_many(self, documents):
+        """Add or replace several documents in one transaction"""
+        analyzed = [(doc_id, document, self._analyze(document)) for doc_id, document in documents]
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for doc_id, document, fields in analyzed:
+                    self._remove(conn, doc_id)
+                    cursor = conn.execute(
+                        "INSERT INTO docs (doc_id, url, title, content, favicon, timestamp, title_len, content_len, "
+                        "user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (doc_id, document["url"], document.get("title"), document.get("content"),
+                         document.get("favicon"), document.get("timestamp"),
+                         fields["title"][0], fields["content"][0], document.get("user_id"))
+                    )
+                    self._add_postings(conn, cursor.lastrowid, fields)
+                    self._add_fingerprint(conn, cursor.lastrowid, document)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, doc_id):
+        """Remove a document; returns False if it was not in the index"""
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                found = self._remove(conn, doc_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return found
+
+    @staticmethod
+    def _analyze(document):
+        # Words shorter than min_gram produce no grams in Elasticsearch either
+        fields = {}
+        for name in FIELDS:
+            tokens = tokenize(document.get(name))
+            fields[name] = (len(tokens), Counter(token for token in tokens if len(token) >= MIN_GRAM))
+        return fields
+
+    @staticmethod
+    def _add_postings(conn, doc, fields):
+        for name, (_, counts) in fields.items():
+            field = FIELDS[name]
+            conn.executemany("INSERT INTO postings (field, term, doc, tf) VALUES (?, ?, ?, ?)",
+                             [(field, term, doc, tf) for term, tf in counts.items()])
+            conn.executemany("INSERT INTO vocabulary (field, term, df) VALUES (?, ?, 1) "
+                             "ON CONFLICT (field, term) DO UPDATE SET df = df + 1",
+                             [(field, term) for term in counts])
+
+    @staticmethod
+    def _add_fingerprint(conn, doc, document):
+        if not document.get("content_hash"):
+            return
+        conn.execute("INSERT INTO fingerprints (doc, content_hash, simhash, cluster, duplicate_of) "
+                     "VALUES (?, ?, ?, ?, ?)",
+                     (doc, document["content_hash"], document["simhash"], document.get("cluster"),
+                      document.get("duplicate_of")))
+        conn.executemany("INSERT INTO simhash_bands (band, doc) VALUES (?, ?)",
+                         [(band, doc) for band in document["simhash_bands"]])
+
+    @staticmethod
+    def _remove(conn, doc_id):
+        row = conn.execute("SELECT id FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+        if not row:
+            return False
+        doc = row[0]
+        conn.execute("UPDATE vocabulary SET df = df - 1 "
+                     "WHERE (field, term) IN (SELECT field, term FROM postings WHERE doc = ?)", (doc,))
+        conn.execute("DELETE FROM vocabulary WHERE df <= 0 "
+                     "AND (field, term) IN (SELECT field, term FROM postings WHERE doc = ?)", (doc,))
+        conn.execute("DELETE FROM postings WHERE doc = ?", (doc,))
+        conn.execute("DELETE FROM simhash_bands WHERE doc = ?", (doc,))
+        conn.execute("DELETE FROM fingerprints WHERE doc = ?", (doc,))
+        conn.execute("DELETE FROM docs WHERE id = ?", (doc,))
+        return True
+
+    # Reads
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def list_page(self, page_size, search_after=None, user_id=None, all_users=False):
+        """One page of a library's documents (of all of them with ``all_users``), newest first, as search hits"""
+        columns = ', '.join(LISTING_COLUMNS)
+        conditions, params = ([], []) if all_users else (["user_id IS ?"], [user_id])
+        if search_after:
+            timestamp, url = search_after
+            conditions.append("(timestamp < ? OR (timestamp = ? AND url > ?))")
+            params.extend([timestamp, timestamp, url])
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ''
+        rows = self._connection().execute(
+            f"SELECT {columns} FROM docs {where}ORDER BY timestamp DESC, url ASC LIMIT ?", (*params, page_size)
+        ).fetchall()
+        return [{
+            "_source": dict(zip(LISTING_COLUMNS, row)),
+            "sort": [row[3], row[0]]
+        } for row in rows]
+
+    def stored_fingerprint(self, doc_id):
+        """content_hash, title, favicon and cluster of a stored document, or None if it has no fingerprint"""
+        row = self._connection().execute(
+            "SELECT f.content_hash, d.title, d.favicon, f.cluster FROM docs d JOIN fingerprints f ON f.doc = d.id "
+            "WHERE d.doc_id = ?", (doc_id,)
+        ).fetchone()
+        return dict(zip(("content_hash", "title", "favicon", "cluster"), row)) if row else None
+
+    def existing_ids(self, doc_ids):
+        """The ids of ``doc_ids`` that a document is stored under"""
+        doc_ids = list(doc_ids)
+        found = set()
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start:start + 500]
+            found.update(doc_id for doc_id, in self._connection().execute(
+                f"SELECT doc_id FROM docs WHERE doc_id IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return found
+
+    def near_duplicate_candidates(self, doc_id, bands, user_id=None, size=NEAR_DUPLICATE_CANDIDATES):
+        """Other documents of a library sharing a SimHash band, as {"_id", "url", "simhash", "cluster"}"""
+        if not bands:
+            return []
+        rows = self._connection().execute(
+            "SELECT DISTINCT d.doc_id, d.url, f.simhash, f.cluster FROM simhash_bands b "
+            "JOIN docs d ON d.id = b.doc JOIN fingerprints f ON f.doc = b.doc "
+            f"WHERE b.band IN ({','.join('?' * len(bands))}) AND d.doc_id != ? AND d.user_id IS ? LIMIT ?",
+            (*bands, doc_id, user_id, size)
+        ).fetchall()
+        return [dict(zip(("_id", "url", "simhash", "cluster"), row)) for row in rows]
+
+    def tiered_search(self, query, user_id=None, min_hits=SEARCH_MIN_HITS, size=SEARCH_PAGE_SIZE, offset=0, tier=None,
+                      search_after=None):
+        """Exact tier first, the fuzzy tier when it finds fewer than ``min_hits``, over one library.
+
+        Returns (tier name, response) with the response shaped like an
+        Elasticsearch search result, so search_queries.format_search_hits
+        applies unchanged. Hits are sorted by score, then by row id, and
+        carry those as sort values for ``search_after``; a ``tier`` pins the
+        tier, as pages reached with a cursor do.
+        """
+        started = time.perf_counter()
+        grams = query_grams(query)
+        scores, matched = {}, set()
+        if grams and tier != 'fuzzy':
+            scores, matched = self._search(grams, fuzzy=False, user_id=user_id)
+        if grams and (tier == 'fuzzy' or (tier is None and len(scores) < min_hits)):
+            tier = 'fuzzy'
+            scores, matched = self._search(grams, fuzzy=True, user_id=user_id)
+        tier = tier or 'exact'
+
+        ranked = scores.items()
+        if search_after:
+            after_score, after_doc = search_after
+            ranked = [(doc, score) for doc, score in ranked if (-score, doc) > (-after_score, after_doc)]
+        top = heapq.nsmallest(offset + size, ranked, key=lambda item: (-item[1], item[0]))[offset:]
+        hits = self._hits(top, matched)
+        return tier, {
+            "took": int((time.perf_counter() - started) * 1000),
+            "hits": {
+                "total": {"value": len(scores), "relation": "eq"},
+                "max_score": max(scores.values(), default=None),
+                "hits": hits
+            }
+        }
+
+    def _search(self, grams, fuzzy, user_id=None):
+        """Score a library's documents for the query grams; returns ({doc: score}, matched (field, gram) pairs)"""
+        conn = self._connection()
+        docs, avg_title, avg_content = conn.execute(
+            "SELECT COUNT(*), AVG(title_len), AVG(content_len) FROM docs"
+        ).fetchone()
+        if not docs:
+            return {}, set()
+        averages = {"title": avg_title or 1.0, "content": avg_content or 1.0}
+
+        # For each field and query gram: (idf, {doc: tf}) of every indexed gram it matches
+        matched = set()
+        field_terms = {}
+        for name, field in FIELDS.items():
+            per_gram = []
+            for gram in grams:
+                expansions = []
+                for expansion in (self._expansions(conn, field, gram) if fuzzy else [gram]):
+                    postings = self._gram_postings(conn, field, expansion)
+                    if postings:
+                        matched.add((name, expansion))
+                        idf = math.log(1 + (docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                        expansions.append((idf, postings))
+                per_gram.append(expansions)
+            field_terms[name] = per_gram
+
+        candidates = set()
+        for per_gram in field_terms.values():
+            for expansions in per_gram:
+                for _, postings in expansions:
+                    candidates.update(postings)
+        # Term statistics stay corpus-wide, like Elasticsearch's per-shard ones
+        lengths = self._lengths(conn, candidates, user_id)
+
+        scores = {}
+        for doc in lengths:
+            title = self._bm25(field_terms["title"], doc, lengths[doc][0], averages["title"])
+            content = self._bm25(field_terms["content"], doc, lengths[doc][1], averages["content"])
+            scores[doc] = 2.0 * title + content
+        self._phrase_boost(conn, scores, field_terms["title"], lengths, averages["title"], grams, fuzzy)
+        return scores, matched
+
+    @staticmethod
+    def _bm25(per_gram, doc, length, average):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+        score = 0.0
+        for expansions in per_gram:
+            # A fuzzy term scores as its best-matching expansion
+            score += max((idf * tf * (BM25_K1 + 1) / (tf + norm)
+                          for idf, postings in expansions
+                          for tf in (postings.get(doc),) if tf), default=0.0)
+        return score
+
+    def _phrase_boost(self, conn, scores, title_terms, lengths, average, grams, prefix_only):
+        """Boost documents whose title contains the query as a phrase (exact tier: match_phrase,
+        fuzzy tier: phrase_prefix), like the phrase clauses of the Elasticsearch tiers"""
+        if not scores:
+            return
+        ids = list(scores)
+        titles = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            titles.update(conn.execute(
+                f"SELECT id, title FROM docs WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+
+        width = len(grams)
+        boost = 1.0 if prefix_only else 3.0
+        for doc, title in titles.items():
+            tokens = tokenize(title)
+            for start in range(len(tokens) - width + 1):
+                window = tokens[start:start + width]
+                if all(token.startswith(gram) for token, gram in zip(window, grams)):
+                    scores[doc] += boost * self._bm25(title_terms, doc, lengths[doc][0], average)
+                    break
+
+    @staticmethod
+    def _gram_postings(conn, field, gram):
+        """Documents containing a word that starts with ``gram``, with summed term frequencies"""
+        return dict(conn.execute(
+            "SELECT doc, SUM(tf) FROM postings WHERE field = ? AND term >= ? AND term < ? GROUP BY doc",
+            (field, gram, gram + MAX_CHAR)
+        ).fetchall())
+
+    @staticmethod
+    def _expansions(conn, field, gram):
+        """Indexed grams within fuzziness=AUTO of ``gram`` sharing its first characters"""
+        distance = fuzzy_distance(gram)
+        if distance == 0:
+            return [gram]
+        prefix = gram[:FUZZY_PREFIX_LENGTH]
+        shortest = max(MIN_GRAM, len(gram) - distance)
+        longest = min(MAX_GRAM, len(gram) + distance)
+
+        candidates = set()
+        for (word,) in conn.execute("SELECT term FROM vocabulary WHERE field = ? AND term >= ? AND term < ?",
+                                    (field, prefix, prefix + MAX_CHAR)):
+            for length in range(shortest, min(longest, len(word)) + 1):
+                candidates.add(word[:length])
+        return [candidate for candidate in candidates if within_distance(gram, candidate, distance)]
+
+    @staticmethod
+    def _lengths(conn, docs, user_id=None):
+        """Field lengths of the documents among ``docs`` that belong to the library"""
+        lengths = {}
+        ids = list(docs)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for doc, title_len, content_len in conn.execute(
+                f"SELECT id, title_len, content_len FROM docs WHERE id IN ({','.join('?' * len(chunk))}) "
+                "AND user_id IS ?", (*chunk, user_id)
+            ):
+                lengths[doc] = (title_len, content_len)
+        return lengths
+
+    def _hits(self, top, matched):
+        if not top:
+            return []
+        conn = self._connection()
+        ids = [doc for doc, _ in top]
+        rows = {row[0]: row[1:] for row in conn.execute(
+            f"SELECT d.id, d.doc_id, d.url, d.title, {HIGHLIGHT_CONTENT}, d.favicon, d.timestamp, f.cluster "
+            f"FROM docs d LEFT JOIN fingerprints f ON f.doc = d.id WHERE d.id IN ({','.join('?' * len(ids))})", ids
+        )}
+
+        hits = []
+        for doc, score in top:
+            doc_id, url, title, content, favicon, timestamp, cluster = rows[doc]
+            highlight = {}
+            for name, text in (("content", content), ("title", title)):
+                grams = tuple(gram for field, gram in matched if field == name)
+                fragments = highlight_fragments(text, grams, HIGHLIGHT["fields"][name]) if grams else []
+                if fragments:
+                    highlight[name] = fragments
+            hit = {
+                "_id": doc_id,
+                "_score": score,
+                "_source": {"url": url, "title": title, "favicon": favicon, "timestamp": timestamp, "cluster": cluster},
+                "sort": [score, doc]
+            }
+            if highlight:
+                hit["highlight"] = highlight
+            hits.append(hit)
+        return hits
+
+
+def highlight_fragments(text, grams, options):
+    """Fragments of ``text`` around words starting with one of ``grams``, wrapped in the highlight tags"""
+    if not text:
+        return []
+    pre, post = options["pre_tags"][0], options["post_tags"][0]
+    size = options.get("fragment_size", 100)
+    count = options.get("number_of_fragments", 5)
+
+    def hits(start, end):
+        return (match for match in TOKEN_RE.finditer(text, start, end) if match.group().lower().startswith(grams))
+
+    def mark(start, end):
+        pieces, position = [], start
+        for match in hits(start, end):
+            pieces.extend([text[position:match.start()], pre, match.group(), post])
+            position = match.end()
+        pieces.append(text[position:end])
+        return ''.join(pieces)
+
+    fragments, position = [], 0
+    while len(fragments) < count:
+        match = next(hits(position, len(text)), None)
+        if match is None:
+            break
+        start = text.rfind(' ', 0, max(match.start() - size // 4, 0)) + 1
+        end = min(len(text), start + size)
+        if end < len(text):
+            boundary = text.rfind(' ', match.end(), end)
+            end = boundary if boundary > 0 else end
+        fragments.append(mark(start, end))
+        position = max(end, match.end())
+    return fragments
@@ -0,0 +1,132 @@
+import hashlib
+import importlib
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from indexing import split_words
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# "sentence-transformers", "hashing", or "package.module:factory" for a custom embedder
+EMBEDDER = os.getenv('EMBEDDER', 'sentence-transformers')
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-mpnet-base-v2')
+EMBEDDING_DEVICE = os.getenv('EMBEDDING_DEVICE') or None
+# 768 matches the bundled webpage_embeddings collection
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '768'))
+# Same chunking as the vectors already in chroma_db: 500 words, 50 shared with the next chunk
+EMBEDDING_CHUNK_WORDS = int(os.getenv('EMBEDDING_CHUNK_WORDS', '500'))
+EMBEDDING_CHUNK_OVERLAP = int(os.getenv('EMBEDDING_CHUNK_OVERLAP', '50'))
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def chunk_text(text, words=EMBEDDING_CHUNK_WORDS, overlap=EMBEDDING_CHUNK_OVERLAP):
+    """Split text into chunks of ``words`` words, each repeating the last ``overlap`` words of the previous one"""
+    return split_words(text, words, overlap)
+
+
+class HashingEmbedder:
+    """Dependency-free embedder: hashed word and word-bigram counts, L2-normalized.
+
+    Captures lexical overlap rather than meaning, but runs anywhere and is
+    deterministic, which makes it useful for tests, CI and benchmarks.
+    """
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        return value % self.dimensions, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dimensions
+            words = [word.lower() for word in TOKEN_RE.findall(text)]
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                index, sign = self._bucket(feature)
+                vector[index] += sign
+            norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+            vectors.append([value / norm for value in vector])
+        return vectors
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model, downloaded to the Hugging Face cache on first run"""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, device=EMBEDDING_DEVICE, batch_size=32):
+        # Fail at construction when the package is missing, so callers can fall back
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device=device)
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                 show_progress_bar=False).tolist()
+
+
+def create_embedder(name=EMBEDDER):
+    """Build the embedder named by EMBEDDER, or None if it cannot be loaded.
+
+    Custom embedders are given as ``package.module:factory``; the factory
+    returns an object with ``dimensions`` and ``embed(texts)`` returning one
+    vector per text.
+    """
+    try:
+        if name == 'hashing':
+            return HashingEmbedder()
+        if name == 'sentence-transformers':
+            return SentenceTransformerEmbedder()
+        module_name, _, attribute = name.partition(':')
+        return getattr(importlib.import_module(module_name), attribute)()
+    except ImportError as e:
+        logger.warning(f"Embedder '{name}' is not available ({str(e)}), semantic search is disabled")
+    except Exception as e:
+        logger.error(f"Failed to load embedder '{name}': {str(e)}")
+    return None
+
+
+class LazyEmbedder:
+    """Builds an embedder on first use, so a process that never embeds does not load a model.
+
+    If it cannot be built, every call raises, and callers degrade as they
+    do when an embedding fails.
+    """
+
+    def __init__(self, factory=create_embedder):
+        self.factory = factory
+        self._embedder = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._embedder is None and not self._failed:
+                started = time.perf_counter()
+                self._embedder = self.factory()
+                self._failed = self._embedder is None
+                if self._embedder:
+                    logger.info(f"Loaded the embedder in {time.perf_counter() - started:.1f}s")
+        if self._embedder is None:
+            raise RuntimeError("The embedder is not available")
+        return self._embedder
+
+    @property
+    def dimensions(self):
+        return self._load().dimensions
+
+    def embed(self, texts):
+        return self._load().embed(texts)
@@ -0,0 +1,293 @@
+from elasticsearch import ApiError, AsyncElasticsearch, ConnectionError, ConnectionTimeout, Elasticsearch
+import asyncio
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+from fingerprints import FINGERPRINT_PROPERTIES
+from indexing import index_body, versioned_index
+from tenancy import OWNER_PROPERTIES
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Get Elasticsearch credentials from environment variables
+ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
+ELASTIC_CERT_PATH = os.getenv('ELASTIC_CERT_PATH')
+ELASTIC_HOST = os.getenv('ELASTIC_HOST', 'localhost')
+ELASTIC_PORT = os.getenv('ELASTIC_PORT', '9200')
+ELASTIC_USE_SSL = os.getenv('ELASTIC_USE_SSL', 'true').lower() == 'true'
+ELASTIC_REQUEST_TIMEOUT = float(os.getenv('ELASTIC_REQUEST_TIMEOUT', '10'))
+
+# Circuit breaker: open after ES_BREAKER_THRESHOLD connection failures within
+# ES_BREAKER_WINDOW seconds, then probe again after a backoff that doubles on
+# every failed probe, from ES_BREAKER_RESET up to ES_BREAKER_MAX_RESET
+ES_BREAKER_THRESHOLD = int(os.getenv('ES_BREAKER_THRESHOLD', '3'))
+ES_BREAKER_WINDOW = float(os.getenv('ES_BREAKER_WINDOW', '30'))
+ES_BREAKER_RESET = float(os.getenv('ES_BREAKER_RESET', '2'))
+ES_BREAKER_MAX_RESET = float(os.getenv('ES_BREAKER_MAX_RESET', '60'))
+
+def client_config():
+    """Connection settings shared by the sync and async Elasticsearch clients"""
+    config = {
+        'hosts': [f"{'https' if ELASTIC_USE_SSL else 'http'}://{ELASTIC_HOST}:{ELASTIC_PORT}"],
+        'basic_auth': ("elastic", ELASTIC_PASSWORD),
+        'request_timeout': ELASTIC_REQUEST_TIMEOUT
+    }
+    
+    if ELASTIC_USE_SSL:
+        config.update({
+            'ca_certs': ELASTIC_CERT_PATH,
+            'verify_certs': True
+        })
+    else:
+        config.update({
+            'verify_certs': False
+        })
+    return config
+
+def create_elasticsearch_client():
+    """Create Elasticsearch client with appropriate configuration"""
+    try:
+        client = Elasticsearch(**client_config())
+        if client.ping():
+            print("Successfully connected to Elasticsearch!")
+            return client
+        else:
+            print("Failed to ping Elasticsearch")
+            return None
+    except Exception as e:
+        print(f"Failed to connect to Elasticsearch: {str(e)}")
+        return None
+
+def is_connection_error(error):
+    """True for failures that mean the cluster is unreachable or unhealthy, not a bad request"""
+    if isinstance(error, (ConnectionError, ConnectionTimeout)):
+        return True
+    return isinstance(error, ApiError) and error.meta.status >= 500
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker guarding calls to Elasticsearch.
+
+    While open every caller is refused immediately. Once the reset timeout
+    has passed a single caller is let through as a probe; its outcome
+    closes the breaker or re-opens it with a doubled timeout.
+    """
+
+    def __init__(self, threshold=ES_BREAKER_THRESHOLD, window=ES_BREAKER_WINDOW,
+                 reset_timeout=ES_BREAKER_RESET, max_reset_timeout=ES_BREAKER_MAX_RESET):
+        self.threshold = threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = 'closed'
+        self._failures = []
+        self._current_timeout = reset_timeout
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return 'pass', 'probe' (caller must report the outcome) or 'reject'"""
+        with self._lock:
+            if self.state == 'closed':
+                return 'pass'
+            if self.state == 'open' and time.monotonic() >= self._open_until:
+                self.state = 'half_open'
+                return 'probe'
+            return 'reject'
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info("Elasticsearch recovered, closing circuit breaker")
+            self.state = 'closed'
+            self._failures = []
+            self._current_timeout = self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'half_open':
+                # Failed probe: back off further before the next one
+                self._current_timeout = min(self._current_timeout * 2, self.max_reset_timeout)
+                self._open(now)
+                return
+            self._failures = [t for t in self._failures if now - t < self.window] + [now]
+            if self.state == 'closed' and len(self._failures) >= self.threshold:
+                self._open(now)
+
+    def trip(self):
+        """Open the breaker immediately, e.g. after a failed connection attempt"""
+        with self._lock:
+            self._open(time.monotonic())
+
+    def retry_after(self):
+        """Seconds until the next probe is allowed"""
+        with self._lock:
+            return max(0, int(self._open_until - time.monotonic()) + 1)
+
+    def _open(self, now):
+        self.state = 'open'
+        self._failures = []
+        self._open_until = now + self._current_timeout
+        logger.warning(f"Elasticsearch unhealthy, failing fast for {self._current_timeout:.1f}s")
+
+class ElasticsearchManager:
+    """Lazily connects to Elasticsearch and keeps reconnecting after outages.
+
+    Nothing touches the network at import time. The first get() creates the
+    client and makes sure the webpages index exists; connection failures
+    reported through report_error() trip the circuit breaker, during which
+    get() returns None so routes answer 503 without waiting on the cluster.
+    """
+
+    def __init__(self, breaker=None):
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return a usable client, or None while Elasticsearch is unavailable"""
+        decision = self.breaker.allow()
+        if decision == 'reject':
+            return None
+        if decision == 'pass' and self._ready:
+            return self._client
+
+        with self._lock:
+            if decision == 'pass' and self._ready:
+                return self._client
+            try:
+                self._connect()
+            except Exception as e:
+                logger.warning(f"Failed to connect to Elasticsearch: {str(e)}")
+                self._ready = False
+                if decision == 'probe':
+                    self.breaker.record_failure()
+                else:
+                    # Don't make every following request wait on a connect that just failed
+                    self.breaker.trip()
+                return None
+            self.breaker.record_success()
+            return self._client
+
+    def _connect(self):
+        if self._client is None:
+            self._client = Elasticsearch(**client_config())
+        if not self._client.ping():
+            raise ConnectionError("Failed to ping Elasticsearch")
+        if not self._ready:
+            if not self._client.indices.exists(index="webpages"):
+                # Behind an alias, so clear_db.py --reindex can swap in a new index later
+                body = {**index_body(), "aliases": {"webpages": {}}}
+                self._client.indices.create(index=versioned_index("webpages"), body=body)
+                print("Created 'webpages' index with edge ngram analyzer")
+            else:
+                self._add_new_fields()
+            self._ready = True
+            print("Successfully connected to Elasticsearch!")
+
+    def _add_new_fields(self):
+        # Indices created before pages were fingerprinted or owned lack these fields; adding them is a no-op otherwise
+        try:
+            self._client.indices.put_mapping(index="webpages",
+                                             properties={**OWNER_PROPERTIES, **FINGERPRINT_PROPERTIES})
+        except ApiError as e:
+            logger.warning(f"Failed to add the owner and fingerprint fields to the 'webpages' mapping: {str(e)}")
+
+    def report_error(self, error):
+        """Feed an exception from an Elasticsearch call into the circuit breaker"""
+        if is_connection_error(error):
+            self.breaker.record_failure()
+
+    def retry_after(self):
+        return self.breaker.retry_after()
+
+    def set_client(self, client):
+        """Use an already configured client (tests, benchmarks)"""
+        with self._lock:
+            self._client = client
+            self._ready = True
+            self.breaker.record_success()
+
+class AsyncElasticsearchManager:
+    """ElasticsearchManager for the ASGI app, built on AsyncElasticsearch"""
+
+    def __init__(self, breaker=None, **client_options):
+        self.breaker = breaker or CircuitBreaker()
+        self.client_options = client_options
+        self._client = None
+        self._ready = False
+        self._lock = None
+
+    async def get(self):
+        """Return a usable client, or None while Elasticsearch is unavailable"""
+        decision = self.breaker.allow()
+        if decision == 'reject':
+            return None
+        if decision == 'pass' and self._ready:
+            return self._client
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if decision == 'pass' and self._ready:
+                return self._client
+            try:
+                await self._connect()
+            except Exception as e:
+                logger.warning(f"Failed to connect to Elasticsearch: {str(e)}")
+                self._ready = False
+                if decision == 'probe':
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.trip()
+                return None
+            self.breaker.record_success()
+            return self._client
+
+    async def _connect(self):
+        if self._client is None:
+            self._client = AsyncElasticsearch(**client_config(), **self.client_options)
+        if not await self._client.ping():
+            raise ConnectionError("Failed to ping Elasticsearch")
+        if not self._ready:
+            if not await self._client.indices.exists(index="webpages"):
+                # Behind an alias, so clear_db.py --reindex can swap in a new index later
+                body = {**index_body(), "aliases": {"webpages": {}}}
+                await self._client.indices.create(index=versioned_index("webpages"), body=body)
+                print("Created 'webpages' index with edge ngram analyzer")
+            else:
+                await self._add_new_fields()
+            self._ready = True
+            print("Successfully connected to Elasticsearch!")
+
+    async def _add_new_fields(self):
+        try:
+            await self._client.indices.put_mapping(index="webpages",
+                                                   properties={**OWNER_PROPERTIES, **FINGERPRINT_PROPERTIES})
+        except ApiError as e:
+            logger.warning(f"Failed to add the owner and fingerprint fields to the 'webpages' mapping: {str(e)}")
+
+    def report_error(self, error):
+        """Feed an exception from an Elasticsearch call into the circuit breaker"""
+        if is_connection_error(error):
+            self.breaker.record_failure()
+
+    def retry_after(self):
+        return self.breaker.retry_after()
+
+    def set_client(self, client):
+        """Use an already configured client (tests, benchmarks)"""
+        self._client = client
+        self._ready = True
+        self.breaker.record_success()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
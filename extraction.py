@@ -0,0 +1,239 @@
+import codecs
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, UnicodeDammit
+from dotenv import load_dotenv
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Parser behind extract_page: "selectolax" (lexbor) or "lxml" (libxml2) are C parsers,
+# "html.parser" is BeautifulSoup's pure-Python one; "auto" takes the fastest installed
+EXTRACTION_ENGINE = os.getenv('EXTRACTION_ENGINE', 'auto').lower()
+EXTRACTION_STRIP_BOILERPLATE = os.getenv('EXTRACTION_STRIP_BOILERPLATE', 'true').lower() == 'true'
+# Processes parsing pages off the request threads; 0 parses on the calling thread
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '0'))
+# Smaller pages are parsed on the calling thread, where that is cheaper than sending them to a worker
+EXTRACTION_POOL_MIN_BYTES = int(os.getenv('EXTRACTION_POOL_MIN_BYTES', '16384'))
+
+# Never part of the page text
+NON_TEXT_TAGS = ("script", "style")
+# Site chrome removed by boilerplate stripping: navigation, sidebars, embeds and
+# controls, the page's header and footer (an article's own are kept) and
+# elements with the ARIA landmark roles of the same parts
+BOILERPLATE_TAGS = ("nav", "aside", "noscript", "template", "iframe", "svg", "button")
+PAGE_CHROME_TAGS = ("header", "footer")
+BOILERPLATE_ROLES = ("navigation", "banner", "contentinfo", "complementary", "search")
+
+BOILERPLATE_SELECTOR = ', '.join([
+    *BOILERPLATE_TAGS,
+    *(f"{tag}:not(article {tag})" for tag in PAGE_CHROME_TAGS),
+    *(f'[role="{role}"]' for role in BOILERPLATE_ROLES)
+])
+BOILERPLATE_XPATH = ' | '.join([
+    *(f"//{tag}" for tag in BOILERPLATE_TAGS),
+    *(f"//{tag}[not(ancestor::article)]" for tag in PAGE_CHROME_TAGS),
+    "//*[" + ' or '.join(f"@role='{role}'" for role in BOILERPLATE_ROLES) + "]"
+])
+NON_TEXT_XPATH = ' | '.join(f"//{tag}" for tag in NON_TEXT_TAGS)
+
+# In order of preference for "auto"
+ENGINE_MODULES = {
+    'selectolax': LexborHTMLParser,
+    'lxml': lxml,
+    'html.parser': BeautifulSoup
+}
+
+
+def _is_icon(rel):
+    return 'icon' in rel.lower() or 'shortcut' in rel.lower()
+
+
+def _extract_html_parser(content, encoding, strip_boilerplate):
+    soup = BeautifulSoup(content, 'html.parser', from_encoding=encoding)
+    for element in soup(NON_TEXT_TAGS):
+        element.decompose()
+    if strip_boilerplate:
+        for element in soup.select(BOILERPLATE_SELECTOR):
+            element.decompose()
+
+    title = soup.title.string if soup.title else "No title"
+    if title is not None:
+        # A NavigableString would pickle the whole tree with it when returned from a worker
+        title = str(title)
+    favicon_link = soup.find('link', rel=lambda r: r and _is_icon(r))
+    return title, favicon_link.get('href') if favicon_link else None, soup.get_text(separator=' ', strip=True)
+
+
+def _extract_lxml(content, encoding, strip_boilerplate):
+    # Without a <meta> charset libxml2 reads pages as Latin-1, so detect the charset as html.parser
+    # does (declared, BOM, <meta>, then guessed) and hand it UTF-8, which libxml2 always knows
+    markup = UnicodeDammit(content, [encoding] if encoding else [], is_html=True).unicode_markup
+    if markup is None:
+        markup = content.decode('utf-8', errors='replace')
+    try:
+        root = lxml.html.document_fromstring(markup.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
+    except lxml.etree.ParserError:
+        # Nothing but comments or markup without content, as the other engines see it too
+        return "No title", None, ''
+    xpath = f"{NON_TEXT_XPATH} | {BOILERPLATE_XPATH}" if strip_boilerplate else NON_TEXT_XPATH
+    for element in root.xpath(xpath):
+        element.drop_tree()
+
+    title = root.find('.//title')
+    favicon_link = next((link for link in root.iter('link') if _is_icon(link.get('rel') or '')), None)
+    text = ' '.join(part.strip() for part in root.xpath('//text()', smart_strings=False) if part.strip())
+    return ("No title" if title is None else title.text, None if favicon_link is None else favicon_link.get('href'),
+            text)
+
+
+def _extract_selectolax(content, encoding, strip_boilerplate):
+    if encoding:
+        content = content.decode(encoding, errors='replace')
+    # Without a declared charset, lexbor detects it from a BOM or <meta> as browsers do
+    tree = LexborHTMLParser(content, encoding=True)
+    tree.strip_tags(list(NON_TEXT_TAGS))
+    if strip_boilerplate:
+        nodes = tree.css(BOILERPLATE_SELECTOR)
+        # Removing a node frees its subtree, so skip nodes inside another one being removed
+        removed = {node.mem_id for node in nodes}
+        for node in nodes:
+            parent = node.parent
+            while parent is not None and parent.mem_id not in removed:
+                parent = parent.parent
+            if parent is None:
+                node.decompose()
+
+    title = tree.css_first('title')
+    favicon_link = next((link for link in tree.css('link[rel]') if _is_icon(link.attributes.get('rel') or '')), None)
+    return ("No title" if title is None else title.text(),
+            None if favicon_link is None else favicon_link.attributes.get('href'),
+            ' '.join(text for text in (node.text_content.strip() for node in tree.root.traverse(include_text=True)
+                                       if node.is_text_node) if text))
+
+
+ENGINES = {
+    'selectolax': _extract_selectolax,
+    'lxml': _extract_lxml,
+    'html.parser': _extract_html_parser
+}
+
+
+def resolve_engine(name=EXTRACTION_ENGINE):
+    """The installed engine to use for a configured name, falling back to html.parser"""
+    if name == 'auto':
+        return next(engine for engine, module in ENGINE_MODULES.items() if module is not None)
+    if name not in ENGINES:
+        logger.warning(f"Unknown extraction engine '{name}', using html.parser")
+        return 'html.parser'
+    if ENGINE_MODULES[name] is None:
+        logger.warning(f"Extraction engine '{name}' is not installed, using html.parser")
+        return 'html.parser'
+    return name
+
+
+def extract_html(url, content, encoding=None, engine='html.parser', strip_boilerplate=EXTRACTION_STRIP_BOILERPLATE):
+    """Parse downloaded HTML into title, text and the favicon declared by the page (if any)"""
+    if not content.strip():
+        return {"title": "No title", "content": "", "favicon": None}
+    try:
+        codecs.lookup(encoding or 'utf-8')
+    except LookupError:
+        # An unknown charset in Content-Type; let the parser detect it instead
+        encoding = None
+    title, favicon, text = ENGINES[engine](content, encoding, strip_boilerplate)
+    return {
+        "title": title,
+        "content": text,
+        "favicon": urljoin(url, favicon) if favicon else None
+    }
+
+
+def _ignore_interrupts():
+    # Ctrl-C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Extractor:
+    """Runs extract_html with the configured engine, in a process pool when ``workers`` is set.
+
+    Parsing holds the GIL, so pages parsed on request threads are parsed
+    one at a time however many threads fetch them. With workers, the
+    calling thread sends the raw bytes to a worker process and waits for
+    the extracted fields, and pages are parsed on as many cores. Pages
+    under ``pool_min_bytes`` are still parsed inline, as are pages whose
+    worker died (the pool is then replaced).
+    """
+
+    def __init__(self, engine=EXTRACTION_ENGINE, strip_boilerplate=EXTRACTION_STRIP_BOILERPLATE,
+                 workers=EXTRACTION_WORKERS, pool_min_bytes=EXTRACTION_POOL_MIN_BYTES):
+        self.engine = resolve_engine(engine)
+        self.strip_boilerplate = strip_boilerplate
+        self.workers = workers
+        self.pool_min_bytes = pool_min_bytes
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes now rather than on the first large page.
+
+        Workers are forked, so call this before the process starts threads
+        of its own, e.g. at import time of the app module.
+        """
+        if self.workers:
+            self._pool().submit(int).result()
+
+    def _pool(self):
+        with self._lock:
+            # A pool inherited through fork (e.g. gunicorn --preload) belongs to the parent
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() \
+                    else None
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_ignore_interrupts)
+                self._pid = os.getpid()
+            return self._executor
+
+    def extract(self, url, content, encoding=None):
+        if not self.workers or len(content) < self.pool_min_bytes:
+            return extract_html(url, content, encoding, self.engine, self.strip_boilerplate)
+        executor = self._pool()
+        try:
+            return executor.submit(extract_html, url, content, encoding, self.engine, self.strip_boilerplate).result()
+        except BrokenProcessPool:
+            logger.warning("An extraction worker died, restarting the pool")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            return extract_html(url, content, encoding, self.engine, self.strip_boilerplate)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown()
+
+
+# Global extractor instance
+extractor = Extractor()
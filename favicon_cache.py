@@ -0,0 +1,108 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+FAVICON_CACHE_PATH = os.getenv('FAVICON_CACHE_PATH', 'favicon_cache.sqlite3')
+FAVICON_CACHE_TTL = int(os.getenv('FAVICON_CACHE_TTL', str(7 * 24 * 3600)))
+FAVICON_CACHE_NEGATIVE_TTL = int(os.getenv('FAVICON_CACHE_NEGATIVE_TTL', str(24 * 3600)))
+FAVICON_CACHE_MAX_ENTRIES = int(os.getenv('FAVICON_CACHE_MAX_ENTRIES', '50000'))
+
+# Don't rewrite last_used on every hit; once a minute is plenty for LRU ordering
+TOUCH_INTERVAL = 60
+
+
+def origin_of(url):
+    """Return the scheme://host[:port] origin of a URL, lowercased"""
+    parts = urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+class FaviconCache:
+    """Origin -> default favicon URL cache persisted in a SQLite file.
+
+    The file is shared by every worker process on the host. Origins that
+    answered without a /favicon.ico are cached too (as NULL) with a shorter
+    TTL, so a miss is not re-probed on every scrape either; probes that got
+    no answer at all are not cached. When the table grows past
+    ``max_entries`` the least recently used origins are evicted.
+    """
+
+    def __init__(self, path=FAVICON_CACHE_PATH, ttl=FAVICON_CACHE_TTL,
+                 negative_ttl=FAVICON_CACHE_NEGATIVE_TTL, max_entries=FAVICON_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS favicons (
+                    origin TEXT PRIMARY KEY,
+                    favicon TEXT,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS favicons_last_used ON favicons (last_used)")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, origin):
+        """Return (True, favicon_or_None) on a fresh hit, or (False, None) on a miss"""
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT favicon, expires_at, last_used FROM favicons WHERE origin = ?", (origin,)
+            ).fetchone()
+            if not row or row[1] < now:
+                return False, None
+            if now - row[2] > TOUCH_INTERVAL:
+                conn.execute("UPDATE favicons SET last_used = ? WHERE origin = ?", (now, origin))
+            return True, row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Favicon cache lookup failed: {str(e)}")
+            return False, None
+
+    def store(self, origin, favicon):
+        """Remember the favicon for an origin; ``None`` records that it has none"""
+        now = time.time()
+        ttl = self.ttl if favicon else self.negative_ttl
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO favicons (origin, favicon, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (origin, favicon, now + ttl, now)
+            )
+            self._evict(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"Favicon cache store failed: {str(e)}")
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM favicons").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Trim an extra 10% so we don't evict on every insert once full
+        excess = count - self.max_entries + self.max_entries // 10
+        conn.execute(
+            "DELETE FROM favicons WHERE origin IN (SELECT origin FROM favicons ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
+
+
+favicon_cache = FaviconCache()
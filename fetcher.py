@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+import urllib3
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Connection and download limits for scraping remote pages
+FETCH_CONNECT_TIMEOUT = float(os.getenv('FETCH_CONNECT_TIMEOUT', '5'))
+FETCH_READ_TIMEOUT = float(os.getenv('FETCH_READ_TIMEOUT', '10'))
+FETCH_TOTAL_TIMEOUT = float(os.getenv('FETCH_TOTAL_TIMEOUT', '30'))
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(5 * 1024 * 1024)))
+FETCH_POOL_HOSTS = int(os.getenv('FETCH_POOL_HOSTS', '64'))
+FETCH_POOL_SIZE = int(os.getenv('FETCH_POOL_SIZE', '16'))
+FETCH_USER_AGENT = os.getenv('FETCH_USER_AGENT', 'LinkedOutBot/1.0 (+https://github.com/kishoreadhith-v/linked-out-backend)')
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    """Raised when a page cannot be fetched; ``cause`` names the failure category"""
+
+    def __init__(self, message, cause):
+        super().__init__(message)
+        self.cause = cause
+
+
+class FetchResult:
+    """A downloaded page: decoded body bytes plus the response metadata"""
+
+    def __init__(self, url, final_url, status_code, headers, content, encoding):
+        self.url = url
+        self.final_url = final_url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use.
+
+    Connections are kept alive and reused per host, so repeated scrapes of
+    the same site skip the TCP and TLS handshakes.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=FETCH_POOL_HOSTS, pool_maxsize=FETCH_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({
+                    'User-Agent': FETCH_USER_AGENT,
+                    'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.1'
+                })
+                _session = session
+    return _session
+
+
+def _media_type(content_type):
+    return content_type.split(';', 1)[0].strip().lower()
+
+
+def _set_read_timeout(response, timeout):
+    """Bound the next socket read of a streamed response; the pool resets it for the next request"""
+    connection = response.raw.connection
+    if connection is not None and connection.sock is not None:
+        connection.sock.settimeout(timeout)
+
+
+def fetch(url, headers=None, max_bytes=FETCH_MAX_BYTES, allowed_types=HTML_CONTENT_TYPES):
+    """Download a page with timeouts and a byte budget.
+
+    The body is streamed and decompressed (gzip/deflate, and br when brotli is
+    installed) as it arrives; the download is abandoned as soon as the
+    decoded size exceeds ``max_bytes`` or the total time exceeds
+    FETCH_TOTAL_TIMEOUT. Responses whose Content-Type is not in
+    ``allowed_types`` are rejected before any of the body is read. A 304
+    answer to conditional ``headers`` is returned with an empty body.
+    """
+    deadline = time.monotonic() + FETCH_TOTAL_TIMEOUT
+    try:
+        response = get_session().get(
+            url,
+            headers=headers,
+            stream=True,
+            timeout=(FETCH_CONNECT_TIMEOUT, min(FETCH_READ_TIMEOUT, FETCH_TOTAL_TIMEOUT))
+        )
+    except requests.exceptions.Timeout as e:
+        raise FetchError(f"Timed out fetching {url}: {e}", 'timeout')
+    except (requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema,
+            requests.exceptions.InvalidURL) as e:
+        raise FetchError(f"Invalid URL {url}: {e}", 'invalid_url')
+    except requests.exceptions.RequestException as e:
+        raise FetchError(f"Failed to fetch {url}: {e}", 'connection')
+
+    with response:
+        if response.status_code == 304:
+            # Answer to a conditional request: the copy the caller already has is current
+            return FetchResult(url, response.url, response.status_code, response.headers, b'', None)
+        if response.status_code >= 400:
+            raise FetchError(f"{url} returned HTTP {response.status_code}", 'http_status')
+
+        content_type = response.headers.get('Content-Type')
+        if allowed_types and content_type and _media_type(content_type) not in allowed_types:
+            raise FetchError(f"{url} is {_media_type(content_type)}, not HTML", 'content_type')
+
+        declared_length = response.headers.get('Content-Length')
+        if declared_length and declared_length.isdigit() and int(declared_length) > max_bytes:
+            raise FetchError(f"{url} is {declared_length} bytes, over the {max_bytes} byte limit", 'too_large')
+
+        chunks = []
+        received = 0
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise FetchError(f"Timed out downloading {url}", 'timeout')
+                # read1 returns what one socket read brings, and that read never waits past the deadline,
+                # so a server trickling bytes cannot hold the download open
+                _set_read_timeout(response, min(FETCH_READ_TIMEOUT, remaining))
+                chunk = response.raw.read1(CHUNK_SIZE, decode_content=True)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > max_bytes:
+                    raise FetchError(f"{url} exceeded the {max_bytes} byte limit", 'too_large')
+                chunks.append(chunk)
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise FetchError(f"Timed out downloading {url}: {e}", 'timeout')
+        except urllib3.exceptions.HTTPError as e:
+            raise FetchError(f"Failed to download {url}: {e}", 'connection')
+
+        # Only trust an explicit charset; otherwise let the parser sniff <meta charset>
+        encoding = response.encoding if content_type and 'charset=' in content_type.lower() else None
+        return FetchResult(url, response.url, response.status_code, response.headers, b''.join(chunks), encoding)
+
+
+def head_ok(url):
+    """Return True if a HEAD request to ``url`` answers 200, False for any other answer and None if it got none"""
+    try:
+        response = get_session().head(url, allow_redirects=True, timeout=(FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT))
+        response.close()
+        return response.status_code == 200
+    except requests.exceptions.RequestException:
+        return None
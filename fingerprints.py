@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import re
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from tenancy import owner_filter
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Pages whose SimHashes differ in at most this many of 64 bits are near-duplicates
+NEAR_DUPLICATE_DISTANCE = int(os.getenv('NEAR_DUPLICATE_DISTANCE', '3'))
+# "mark" stores near-duplicates in the cluster of the page they copy; "skip" does not store them
+NEAR_DUPLICATE_POLICY = os.getenv('NEAR_DUPLICATE_POLICY', 'mark').lower()
+NEAR_DUPLICATE_CANDIDATES = int(os.getenv('NEAR_DUPLICATE_CANDIDATES', '20'))
+# Shorter pages are never treated as near-duplicates: login walls and error
+# pages share most of their few words and would all end up in one cluster
+NEAR_DUPLICATE_MIN_WORDS = int(os.getenv('NEAR_DUPLICATE_MIN_WORDS', '50'))
+
+SIMHASH_BITS = 64
+# Words per shingle; shingles keep some word order, so reordered pages are not duplicates
+SHINGLE_WORDS = 3
+# Split into one more band than the allowed distance, two hashes within it share
+# at least one whole band (pigeonhole), which makes candidates a plain terms lookup
+SIMHASH_BANDS = NEAR_DUPLICATE_DISTANCE + 1
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Fields of the webpages mapping that hold the fingerprints
+FINGERPRINT_PROPERTIES = {
+    "content_hash": {"type": "keyword"},
+    "simhash": {"type": "keyword"},
+    "simhash_bands": {"type": "keyword"},
+    "cluster": {"type": "keyword"},
+    "duplicate_of": {"type": "keyword"}
+}
+
+# Stored fields compared by is_unchanged, fetched without the page text
+FINGERPRINT_SOURCE = ["content_hash", "title", "favicon", "cluster"]
+
+# Maps every byte to 1 if the given bit is set in it, else 0, for bytes.translate
+_BIT_TABLES = [bytes((byte >> bit) & 1 for byte in range(256)) for bit in range(8)]
+
+
+def normalize_text(text):
+    return ' '.join((text or '').lower().split())
+
+
+def content_hash(title, content):
+    """Exact fingerprint: sha256 of the whitespace- and case-normalized title and text"""
+    normalized = f"{normalize_text(title)}\n{normalize_text(content)}"
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def simhash(text):
+    """64-bit SimHash of the word shingles of a text, weighted by how often each occurs"""
+    words = TOKEN_RE.findall((text or '').lower())
+    if len(words) > SHINGLE_WORDS:
+        features = Counter(map(' '.join, zip(*(words[i:] for i in range(SHINGLE_WORDS)))))
+    else:
+        features = Counter([' '.join(words)])
+
+    # Concatenate the feature hashes, each repeated by its weight, so the votes
+    # for every bit can be counted over whole byte strings instead of per feature
+    width = SIMHASH_BITS // 8
+    hashes = b''.join([hashlib.blake2b(feature.encode('utf-8'), digest_size=width).digest() * weight
+                       for feature, weight in features.items()])
+    total = len(hashes) // width
+
+    # A bit is set when the features with that bit set outweigh those without it
+    value = 0
+    for position in range(width):
+        column = hashes[position::width]
+        for bit, table in enumerate(_BIT_TABLES):
+            if column.translate(table).count(1) * 2 > total:
+                value |= 1 << (position * 8 + bit)
+    return value
+
+
+def simhash_bands(value, bands=SIMHASH_BANDS):
+    """Band keys of a SimHash: "<band>:<bits of that band in hex>" """
+    keys, start = [], 0
+    for band in range(bands):
+        width = SIMHASH_BITS // bands + (1 if band < SIMHASH_BITS % bands else 0)
+        keys.append(f"{band}:{(value >> start) & ((1 << width) - 1):x}")
+        start += width
+    return keys
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def fingerprint(title, content):
+    """Fingerprint fields stored with a page; pages too short to compare get no SimHash bands"""
+    value = simhash(content)
+    long_enough = len((content or '').split()) >= NEAR_DUPLICATE_MIN_WORDS
+    return {
+        "content_hash": content_hash(title, content),
+        "simhash": f"{value:016x}",
+        "simhash_bands": simhash_bands(value) if long_enough else []
+    }
+
+
+def is_unchanged(document, stored):
+    """True if a stored page (content_hash, title and favicon) already matches the new document"""
+    return bool(stored) and stored.get("content_hash") == document["content_hash"] \
+        and stored.get("title") == document["title"] and stored.get("favicon") == document["favicon"]
+
+
+def closest_duplicate(document, candidates, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """The candidate ({"_id", "url", "simhash", "cluster"}) nearest to the document within max_distance, or None"""
+    value = int(document["simhash"], 16)
+    best, best_distance = None, max_distance + 1
+    for candidate in candidates:
+        if not candidate.get("simhash"):
+            continue
+        distance = hamming_distance(value, int(candidate["simhash"], 16))
+        if distance < best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+
+def check_document(backend, doc_id, document, policy=NEAR_DUPLICATE_POLICY):
+    """Compare a freshly built document with what the backend stores, before writing it.
+
+    Returns "unchanged" when the stored copy is identical, "duplicate" when
+    it nearly copies another page of the same library and the policy is
+    "skip", and "index" otherwise. Documents to be indexed get their
+    ``cluster`` set: the cluster of the page they duplicate, or their own id.
+    """
+    user_id = document.get("user_id")
+    if is_unchanged(document, backend.stored_fingerprint(doc_id, user_id)):
+        return "unchanged"
+    candidates = []
+    if document["simhash_bands"]:
+        candidates = backend.near_duplicate_candidates(doc_id, document["simhash_bands"], user_id)
+    return assign_cluster(doc_id, document, candidates, policy)
+
+
+def assign_cluster(doc_id, document, candidates, policy=NEAR_DUPLICATE_POLICY):
+    """Second half of check_document, once the near-duplicate candidates are fetched"""
+    duplicate = closest_duplicate(document, candidates)
+    if duplicate:
+        document["cluster"] = duplicate.get("cluster") or duplicate["_id"]
+        document["duplicate_of"] = duplicate["url"]
+        if policy == 'skip':
+            return "duplicate"
+    else:
+        document["cluster"] = doc_id
+        document.pop("duplicate_of", None)
+    return "index"
+
+
+def near_duplicate_body(doc_id, bands, user_id=None, size=NEAR_DUPLICATE_CANDIDATES):
+    """Search body for pages of a library sharing a SimHash band with a document, other than itself"""
+    return {
+        "query": {
+            "bool": {
+                "filter": [{"terms": {"simhash_bands": bands}}, owner_filter(user_id)],
+                "must_not": [{"ids": {"values": [doc_id]}}]
+            }
+        },
+        "_source": ["url", "simhash", "cluster"],
+        "size": size
+    }
+
+
+def candidates_from_hits(hits):
+    return [{"_id": hit["_id"], **hit["_source"]} for hit in hits]
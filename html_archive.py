@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from dotenv import load_dotenv
+
+from indexing import document_id
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Keep the HTML of every fetched page, so rebuild_index.py can re-extract it without the network
+HTML_ARCHIVE = os.getenv('HTML_ARCHIVE', 'true').lower() == 'true'
+HTML_ARCHIVE_PATH = os.getenv('HTML_ARCHIVE_PATH', 'html_archive.sqlite3')
+# Compressed bytes kept; the pages fetched longest ago are evicted past it
+HTML_ARCHIVE_MAX_BYTES = int(os.getenv('HTML_ARCHIVE_MAX_BYTES', str(1024 ** 3)))
+HTML_ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('HTML_ARCHIVE_COMPRESSION_LEVEL', '6'))
+
+
+class HtmlArchive:
+    """Raw HTML of the last fetch of every URL, compressed in a SQLite file.
+
+    Bodies are stored once per sha256 of their bytes, so mirrors and pages
+    re-fetched unchanged cost nothing extra; each URL (by normalized form)
+    points at the body of its last fetch, with the charset it was served
+    with and the favicon it resolved to. Bodies no URL points at are
+    deleted. When the compressed bodies outgrow ``max_bytes``, the URLs
+    fetched longest ago are evicted. The file is shared by every process on
+    the host.
+    """
+
+    def __init__(self, path=HTML_ARCHIVE_PATH, max_bytes=HTML_ARCHIVE_MAX_BYTES,
+                 level=HTML_ARCHIVE_COMPRESSION_LEVEL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.level = level
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS bodies (
+                    hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    raw_size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS pages (
+                    doc_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    encoding TEXT,
+                    favicon TEXT,
+                    fetched_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS pages_hash ON pages (hash);
+                CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at);
+                -- Running total of the compressed bodies, kept by triggers so every process sees it
+                CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL);
+                INSERT OR IGNORE INTO totals (id, size) VALUES (0, 0);
+                CREATE TRIGGER IF NOT EXISTS bodies_added AFTER INSERT ON bodies
+                    BEGIN UPDATE totals SET size = size + new.size; END;
+                CREATE TRIGGER IF NOT EXISTS bodies_removed AFTER DELETE ON bodies
+                    BEGIN UPDATE totals SET size = size - old.size; END;
+            """)
+            self._local.conn = conn
+        return conn
+
+    def store(self, url, content, encoding=None, favicon=None):
+        """Archive the body of a fetch of ``url``, replacing the previous one"""
+        digest = hashlib.sha256(content).hexdigest()
+        doc_id = document_id(url)
+        try:
+            conn = self._connection()
+            known = conn.execute("SELECT 1 FROM bodies WHERE hash = ?", (digest,)).fetchone()
+            # Compressed outside the write transaction, which other processes wait on
+            data = None if known else zlib.compress(content, self.level)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if data is None and not conn.execute("SELECT 1 FROM bodies WHERE hash = ?", (digest,)).fetchone():
+                    # Evicted by another process since the check above
+                    data = zlib.compress(content, self.level)
+                if data is not None:
+                    conn.execute("INSERT OR IGNORE INTO bodies (hash, data, size, raw_size) VALUES (?, ?, ?, ?)",
+                                 (digest, data, len(data), len(content)))
+                previous = conn.execute("SELECT hash FROM pages WHERE doc_id = ?", (doc_id,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages (doc_id, url, hash, encoding, favicon, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc_id, url, digest, encoding, favicon, time.time())
+                )
+                if previous and previous[0] != digest:
+                    self._drop_unreferenced(conn, [previous[0]])
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"HTML archive store failed for {url}: {str(e)}")
+
+    def load(self, url):
+        """The last archived fetch of a URL as {"url", "content", "encoding", "favicon", "fetched_at"}, or None"""
+        try:
+            row = self._connection().execute(
+                "SELECT p.url, b.data, p.encoding, p.favicon, p.fetched_at FROM pages p "
+                "JOIN bodies b ON b.hash = p.hash WHERE p.doc_id = ?", (document_id(url),)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"HTML archive read failed for {url}: {str(e)}")
+            return None
+        if not row:
+            return None
+        return {"url": row[0], "content": zlib.decompress(row[1]), "encoding": row[2], "favicon": row[3],
+                "fetched_at": row[4]}
+
+    def contains(self, url):
+        try:
+            return self._connection().execute(
+                "SELECT 1 FROM pages WHERE doc_id = ?", (document_id(url),)
+            ).fetchone() is not None
+        except sqlite3.Error as e:
+            logger.warning(f"HTML archive read failed for {url}: {str(e)}")
+            return False
+
+    def stats(self):
+        """{"pages", "bodies", "size" (compressed bytes), "raw_size"}"""
+        conn = self._connection()
+        pages = conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        bodies, size, raw_size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0) FROM bodies"
+        ).fetchone()
+        return {"pages": pages, "bodies": bodies, "size": size, "raw_size": raw_size}
+
+    @staticmethod
+    def _drop_unreferenced(conn, hashes):
+        conn.executemany(
+            "DELETE FROM bodies WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM pages WHERE pages.hash = bodies.hash)",
+            [(digest,) for digest in hashes]
+        )
+
+    def _evict(self, conn):
+        size = conn.execute("SELECT size FROM totals").fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        # Trim an extra 10% so we don't evict on every store once full
+        target = self.max_bytes - self.max_bytes // 10
+        while size > target:
+            evicted = conn.execute("SELECT doc_id, hash FROM pages ORDER BY fetched_at LIMIT 100").fetchall()
+            if not evicted:
+                break
+            conn.executemany("DELETE FROM pages WHERE doc_id = ?", [(row[0],) for row in evicted])
+            self._drop_unreferenced(conn, {row[1] for row in evicted})
+            size = conn.execute("SELECT size FROM totals").fetchone()[0]
+
+
+# Global archive instance; None when HTML_ARCHIVE=false
+html_archive = HtmlArchive() if HTML_ARCHIVE else None
@@ -0,0 +1,146 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from flask import request
+
+from metrics import stage
+from search_cache import SEARCH_CACHE_TTL
+from tenancy import USER_HEADER
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Seconds clients may reuse a /urls or /search response without asking again; 0 revalidates it every time
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', '0'))
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', 'true').lower() == 'true'
+# Smaller bodies are sent as they are, where compressing saves less than it costs
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', '5'))
+
+COMPRESSIBLE_TYPES = ('application/json',)
+# In order of preference when the client accepts several equally; br needs the optional brotli package
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+class IndexETags:
+    """ETags for responses that depend only on the request and the contents of the index.
+
+    A tag combines the search cache's index version with a digest of the
+    path, query string and user, so a client sending it back in
+    If-None-Match is answered 304 without reading the index. No tag is
+    issued until the generation is settled (see SearchCache.settled), while
+    the write behind it may not be searchable yet: a response built then
+    would carry the new tag with the old contents. Without a shared
+    search cache, writes by other processes leave the version alone, so
+    tags also change every ``period`` seconds, as cached searches expire.
+    """
+
+    def __init__(self, search_cache, period=SEARCH_CACHE_TTL):
+        self.search_cache = search_cache
+        self.period = period
+
+    def etag(self, path, args, user_id=None):
+        """Weak ETag of a request given its (name, value) query arguments, or None if it gets none"""
+        version = self.search_cache.version() if self.search_cache else None
+        if version is None:
+            return None
+        epoch, generation = version
+        if not self.search_cache.settled(generation):
+            return None
+
+        tag = f"{epoch[:12]}.{generation}"
+        if not self.search_cache.shared and self.period:
+            tag += f".{int(time.time() // self.period)}"
+        variant = hashlib.sha1(json.dumps([path, sorted(args), user_id]).encode('utf-8')).hexdigest()[:16]
+        return f'W/"{tag}.{variant}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header lists ``etag``, compared weakly as RFC 9110 requires"""
+    if not if_none_match or not etag:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+
+def cache_headers(etag):
+    """ETag, Cache-Control and Vary headers of a /urls or /search response (or its 304)"""
+    headers = {"Vary": f"Accept-Encoding, {USER_HEADER}" if RESPONSE_COMPRESSION else USER_HEADER}
+    if etag:
+        headers["ETag"] = etag
+    # Responses differ per user, so only the client's own cache may keep them
+    if etag and HTTP_CACHE_MAX_AGE:
+        headers["Cache-Control"] = f"private, max-age={HTTP_CACHE_MAX_AGE}"
+    else:
+        headers["Cache-Control"] = "private, no-cache"
+    return headers
+
+
+def compressible(content_type, size):
+    """Whether a response body of this type and size is worth compressing"""
+    return (RESPONSE_COMPRESSION and size >= RESPONSE_COMPRESSION_MIN_BYTES
+            and (content_type or '').split(';')[0].strip().lower() in COMPRESSIBLE_TYPES)
+
+
+def negotiate_encoding(accept_encoding):
+    """Preferred encoding of ENCODINGS that an Accept-Encoding header allows, or None to send the body as is"""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    quality, _, encoding = max((qualities.get(encoding, qualities.get('*', 0.0)), -position, encoding)
+                               for position, encoding in enumerate(ENCODINGS))
+    return encoding if quality > 0 else None
+
+
+def compress(body, encoding):
+    """Encode a response body with ``encoding`` (one of ENCODINGS)"""
+    with stage('compress'):
+        if encoding == 'br':
+            return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+        # mtime=0 keeps the output identical for identical bodies
+        return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def init_app(app):
+    """Compress the JSON responses of a Flask app for clients that accept it"""
+    if not RESPONSE_COMPRESSION:
+        return
+
+    @app.after_request
+    def _compress(response):
+        if (response.direct_passthrough or response.is_streamed or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or not compressible(response.mimetype, response.calculate_content_length() or 0)):
+            return response
+        # The body now depends on Accept-Encoding, also for clients sent it as is
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if encoding:
+            response.set_data(compress(response.get_data(), encoding))
+            response.headers['Content-Encoding'] = encoding
+        return response
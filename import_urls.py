@@ -0,0 +1,53 @@
+import argparse
+import sys
+
+from backends import create_backend
+from batch_ingest import DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY, bulk_ingest, parse_url_list
+from es_client import ElasticsearchManager
+from extraction import extractor
+from crawl_state import crawl_state
+from ingest_cli import IngestHooks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape and index a list of URLs in bulk")
+    parser.add_argument('file', help="File with one URL per line, NDJSON ({\"url\": ...}) or a JSON array; '-' for stdin")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Pages fetched in parallel")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Documents per bulk request")
+    parser.add_argument('--report', help="Write per-URL results as NDJSON to this file")
+    parser.add_argument('--user-id', help="Import into this user's library instead of the shared one")
+    args = parser.parse_args()
+
+    if args.file == '-':
+        urls = parse_url_list(sys.stdin.read())
+    else:
+        with open(args.file) as f:
+            urls = parse_url_list(f.read())
+
+    # Before the fetch threads start, as the workers are forked
+    extractor.start()
+
+    # Writes to the backend selected by SEARCH_BACKEND, like the web app
+    backend = create_backend(ElasticsearchManager())
+    if not backend.available():
+        print(f"Failed to connect to {backend.name}")
+        return 1
+
+    # Chunks are embedded in the background while scraping continues
+    hooks = IngestHooks()
+
+    print(f"Importing {len(urls)} URLs with concurrency {args.concurrency}...")
+    def track_page(url, scraped_data):
+        crawl_state.track(url, scraped_data.get("etag"), scraped_data.get("last_modified"), args.user_id)
+
+    results = bulk_ingest(backend, urls, concurrency=args.concurrency, chunk_size=args.chunk_size,
+                          on_indexed=hooks.page_stored, on_fetched=track_page, user_id=args.user_id)
+    summary = hooks.finish(results, args.report)
+
+    print(f"Indexed {summary['indexed']} of {summary['total']} URLs ({summary['unchanged']} unchanged, "
+          f"{summary['duplicate']} near-duplicates skipped, {summary['failed']} failed)")
+    return 0 if summary["failed"] == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import copy
+import hashlib
+import os
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from dotenv import load_dotenv
+
+from fingerprints import FINGERPRINT_PROPERTIES, fingerprint
+from tenancy import OWNER_PROPERTIES
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# How page text is stored in Elasticsearch: "full" keeps one content field,
+# "passages" splits it into nested passages of PASSAGE_WORDS words
+CONTENT_LAYOUT = os.getenv('CONTENT_LAYOUT', 'full').lower()
+PASSAGE_WORDS = int(os.getenv('PASSAGE_WORDS', '100'))
+# Words repeated at the start of the next passage, so short phrases spanning a boundary still match
+PASSAGE_OVERLAP = int(os.getenv('PASSAGE_OVERLAP', '10'))
+# Passages kept per page; 0 keeps them all
+PASSAGE_MAX_COUNT = int(os.getenv('PASSAGE_MAX_COUNT', '0'))
+
+# Settings and mappings of the webpages index
+WEBPAGES_INDEX_BODY = {
+    "settings": {
+        "analysis": {
+            "analyzer": {
+                "custom_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "custom_edge_ngram"]
+                }
+            },
+            "filter": {
+                "custom_edge_ngram": {
+                    "type": "edge_ngram",
+                    "min_gram": 2,
+                    "max_gram": 10
+                }
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "url": {"type": "keyword"},
+            "content": {
+                "type": "text",
+                "analyzer": "custom_analyzer",
+                "search_analyzer": "standard"
+            },
+            "title": {
+                "type": "text",
+                "analyzer": "custom_analyzer",
+                "search_analyzer": "standard",
+                "fields": {
+                    "keyword": {
+                        "type": "keyword"
+                    }
+                }
+            },
+            "favicon": {"type": "keyword"},
+            "timestamp": {"type": "date"},
+            # When a page re-extracted from the HTML archive was fetched
+            "fetched_at": {"type": "date"},
+            **OWNER_PROPERTIES,
+            **FINGERPRINT_PROPERTIES
+        }
+    }
+}
+
+
+# The same index with the page text as nested passages: each passage is a
+# small Lucene document, so scoring and highlighting work on one passage at a time
+WEBPAGES_PASSAGES_INDEX_BODY = copy.deepcopy(WEBPAGES_INDEX_BODY)
+WEBPAGES_PASSAGES_INDEX_BODY["mappings"]["properties"]["passages"] = {
+    "type": "nested",
+    "properties": {
+        "text": WEBPAGES_PASSAGES_INDEX_BODY["mappings"]["properties"].pop("content"),
+        "position": {"type": "integer"}
+    }
+}
+
+
+def index_body(layout=CONTENT_LAYOUT):
+    """Settings and mappings of the webpages index for a content layout"""
+    return WEBPAGES_PASSAGES_INDEX_BODY if layout == 'passages' else WEBPAGES_INDEX_BODY
+
+
+def versioned_index(alias, version=1):
+    """Name of one version of the concrete index behind an alias, e.g. webpages-000002"""
+    return f"{alias}-{version:06d}"
+
+
+def index_version(alias, name):
+    """Version of a concrete index named by versioned_index, or 0 for the unversioned original"""
+    suffix = name[len(alias) + 1:] if name.startswith(f"{alias}-") else ''
+    return int(suffix) if suffix.isdigit() else 0
+
+
+def split_words(text, words, overlap=0):
+    """Split text into runs of ``words`` words, each repeating the last ``overlap`` words of the previous one"""
+    tokens = (text or '').split()
+    if not tokens:
+        return []
+    step = max(words - overlap, 1)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(' '.join(tokens[start:start + words]))
+        if start + words >= len(tokens):
+            break
+    return chunks
+
+
+def stored_document(document, layout=CONTENT_LAYOUT):
+    """The document as written to Elasticsearch: unchanged, or with its content split into passages"""
+    if layout != 'passages':
+        return document
+    passages = split_words(document.get("content"), PASSAGE_WORDS, PASSAGE_OVERLAP)
+    if PASSAGE_MAX_COUNT:
+        passages = passages[:PASSAGE_MAX_COUNT]
+    stored = {key: value for key, value in document.items() if key != "content"}
+    stored["passages"] = [{"text": text, "position": position} for position, text in enumerate(passages)]
+    return stored
+
+
+def normalize_url(url):
+    """Canonical form of a URL used to derive document ids.
+
+    Lowercases the scheme and host, drops default ports and the fragment,
+    sorts query parameters and gives an empty path a trailing slash, so
+    trivially different spellings of the same page map to one document.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    netloc = (parts.hostname or '').lower()
+    if parts.port and DEFAULT_PORTS.get(scheme) != parts.port:
+        netloc = f"{netloc}:{parts.port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else '')
+        netloc = f"{userinfo}@{netloc}"
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def document_id(url, user_id=None):
+    """Deterministic Elasticsearch _id for a URL: sha256 of its normalized form, prefixed by the owner if any"""
+    key = normalize_url(url) if user_id is None else f"{user_id}\n{normalize_url(url)}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def build_document(url, scraped_data, user_id=None):
+    """Build the webpages document stored for a scraped URL, with the fingerprints of its text"""
+    document = {
+        "url": url,
+        "title": scraped_data["title"],
+        "content": scraped_data["content"],
+        "favicon": scraped_data["favicon"],
+        # The time of the write, which clear_db --reindex catches up from
+        "timestamp": datetime.utcnow().isoformat(),
+        **fingerprint(scraped_data["title"], scraped_data["content"])
+    }
+    if scraped_data.get("fetched_at"):
+        # Pages re-extracted from the HTML archive keep the time they were fetched
+        document["fetched_at"] = scraped_data["fetched_at"]
+    if user_id is not None:
+        document["user_id"] = user_id
+    return document
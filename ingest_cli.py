@@ -0,0 +1,54 @@
+import json
+
+from batch_ingest import summarize
+from search_cache import create_search_cache
+from semantic_index import EmbeddingQueue, create_semantic_index
+
+
+class IngestHooks:
+    """What the command-line ingesters (import_urls.py, recrawl.py, rebuild_index.py) update besides the backend.
+
+    Stored pages of the shared library are embedded in the background, as
+    in app.py, and cached searches are invalidated once pages changed. The
+    search cache only reaches other processes when it is shared
+    (SEARCH_CACHE_BACKEND=redis).
+    """
+
+    def __init__(self):
+        semantic_index = create_semantic_index()
+        self.embedding_queue = EmbeddingQueue(semantic_index) if semantic_index else None
+        self.search_cache = create_search_cache()
+
+    def page_stored(self, document):
+        """``on_indexed`` callback for bulk_ingest and RecrawlScheduler"""
+        # The vector store holds the shared library only, as in app.py
+        if self.embedding_queue and not document.get("user_id"):
+            self.embedding_queue.add(document["url"], document["title"], document["favicon"], document["content"])
+
+    def index_changed(self):
+        if self.search_cache:
+            self.search_cache.invalidate()
+
+    def wait(self):
+        """Block until the pages queued for embedding are written"""
+        if self.embedding_queue:
+            print("Waiting for embeddings...")
+            self.embedding_queue.join()
+
+    def finish(self, results, report=None):
+        """Wait for the embeddings, then write the per-URL results of bulk_ingest as NDJSON to ``report`` (or print
+        the failures) and invalidate cached searches if a page was indexed; returns summarize(results)"""
+        self.wait()
+        if report:
+            with open(report, 'w') as f:
+                for result in results:
+                    f.write(json.dumps(result) + "\n")
+        else:
+            for result in results:
+                if result["status"] == "failed":
+                    print(f"FAILED {result['url']}: {result['error']}")
+
+        summary = summarize(results)
+        if summary["indexed"]:
+            self.index_changed()
+        return summary
@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue cannot accept more jobs"""
+
+
+class IngestQueue:
+    """Bounded pool of worker threads that ingest URLs in the background.
+
+    Jobs are kept in a heap ordered by the time they become runnable, so a
+    failed job can be pushed back with a backoff delay without blocking a
+    worker while it waits.
+    """
+
+    def __init__(self, handler, workers=4, max_size=1000, max_attempts=3,
+                 backoff_base=2.0, backoff_max=60.0, job_ttl=3600):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.job_ttl = job_ttl
+
+        self._jobs = {}
+        self._pending = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads if they are not running yet"""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, url, **options):
+        """Queue a URL for ingestion and return a snapshot of the new job"""
+        self.start()
+        now = time.time()
+        with self._cond:
+            self._prune(now)
+            if len(self._pending) >= self.max_size:
+                raise QueueFullError("Ingestion queue is full")
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "url": url,
+                "options": options,
+                "status": "queued",
+                "attempts": 0,
+                "error": None,
+                "result": None,
+                "created_at": now,
+                "updated_at": now,
+                "next_attempt_at": now
+            }
+            self._jobs[job["id"]] = job
+            heapq.heappush(self._pending, (now, next(self._counter), job["id"]))
+            self._cond.notify()
+            return self._snapshot(job)
+
+    def get(self, job_id):
+        """Return a snapshot of a job, or None if it is unknown or expired"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def stats(self):
+        """Return the number of jobs in each state"""
+        with self._cond:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    if self._pending and self._pending[0][0] <= now:
+                        _, _, job_id = heapq.heappop(self._pending)
+                        break
+                    timeout = self._pending[0][0] - now if self._pending else None
+                    self._cond.wait(timeout)
+
+                job = self._jobs.get(job_id)
+                if not job:
+                    continue
+                job["status"] = "running"
+                job["attempts"] += 1
+                job["updated_at"] = now
+                url, options = job["url"], job["options"]
+
+            try:
+                result = self.handler(url, **options)
+            except Exception as e:
+                self._fail(job_id, e)
+            else:
+                with self._cond:
+                    job["status"] = "succeeded"
+                    job["result"] = result
+                    job["error"] = None
+                    job["updated_at"] = time.time()
+                logger.info(f"Ingested {url} (job {job_id})")
+
+    def _fail(self, job_id, error):
+        with self._cond:
+            job = self._jobs[job_id]
+            now = time.time()
+            job["error"] = str(error)
+            job["updated_at"] = now
+
+            if job["attempts"] >= self.max_attempts or not getattr(error, "retryable", True):
+                job["status"] = "failed"
+                logger.error(f"Giving up on {job['url']} after {job['attempts']} attempt(s): {error}")
+                return
+
+            # Exponential backoff: base, base^2, ... capped at backoff_max
+            delay = min(self.backoff_base ** job["attempts"], self.backoff_max)
+            job["status"] = "retrying"
+            job["next_attempt_at"] = now + delay
+            heapq.heappush(self._pending, (now + delay, next(self._counter), job_id))
+            self._cond.notify()
+            logger.warning(f"Retrying {job['url']} in {delay:.1f}s (attempt {job['attempts']} failed: {error})")
+
+    def _prune(self, now):
+        # Drop finished jobs that nobody has polled for a while
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] in ("succeeded", "failed") and now - job["updated_at"] > self.job_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _snapshot(job):
+        return {key: value for key, value in job.items() if key != "options"}
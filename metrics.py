@@ -0,0 +1,139 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Load environment variables
+load_dotenv()
+
+# Always add a Server-Timing header, not only when the client sends X-Debug-Timing: 1
+METRICS_TIMING_HEADER = os.getenv('METRICS_TIMING_HEADER', 'false').lower() == 'true'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    'linkedout_request_duration_seconds', 'HTTP request latency by route',
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    'linkedout_stage_duration_seconds', 'Latency of the stages inside a request',
+    ['stage'], buckets=LATENCY_BUCKETS
+)
+SCRAPE_FAILURES = Counter(
+    'linkedout_scrape_failures_total', 'Scrapes that failed, by cause', ['cause']
+)
+WRITES_SKIPPED = Counter(
+    'linkedout_writes_skipped_total', 'Page writes skipped by the fingerprint check, by reason', ['reason']
+)
+RECRAWL_RESULTS = Counter(
+    'linkedout_recrawl_total', 'Pages re-crawled by the scheduler, by outcome', ['outcome']
+)
+SEARCHES_COALESCED = Counter(
+    'linkedout_searches_coalesced_total', 'Searches answered by an identical search that was already in flight'
+)
+SEARCH_BATCHES = Counter(
+    'linkedout_search_batches_total', '_msearch requests sent by the search dispatcher, each with several searches'
+)
+IN_FLIGHT = Gauge(
+    'linkedout_requests_in_flight', 'Requests currently being served', multiprocess_mode='livesum'
+)
+
+# Stage timings of the current request, for the Server-Timing header
+_timings = ContextVar('stage_timings', default=None)
+
+
+def record_stage(name, seconds):
+    """Record a stage duration measured elsewhere (e.g. Elasticsearch's own `took`)"""
+    STAGE_LATENCY.labels(name).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def current_timings():
+    """Stage timings recorded so far for the current request"""
+    return list(_timings.get() or [])
+
+
+def start_request():
+    """Begin tracking a request; returns the token for finish_request"""
+    IN_FLIGHT.inc()
+    return time.perf_counter(), _timings.set([])
+
+
+def finish_request(token, route, method, status):
+    """Observe the request latency and return the elapsed seconds and stage timings"""
+    started, timings_token = token
+    elapsed = time.perf_counter() - started
+    timings = _timings.get() or []
+    _timings.reset(timings_token)
+    IN_FLIGHT.dec()
+    REQUEST_LATENCY.labels(route, method, str(status)).observe(elapsed)
+    return elapsed, timings
+
+
+def server_timing(elapsed, timings):
+    """Format stage timings as a Server-Timing header value"""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+    entries.append(f"total;dur={elapsed * 1000:.1f}")
+    return ', '.join(entries)
+
+
+def wants_timing(headers):
+    return METRICS_TIMING_HEADER or headers.get('X-Debug-Timing') == '1'
+
+
+def render_metrics():
+    """Return (body, content type) for the /metrics endpoint"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Aggregate the samples written by every worker process
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    """Instrument every Flask route and expose GET /metrics"""
+    @app.before_request
+    def _start_timer():
+        g.metrics_token = start_request()
+
+    @app.after_request
+    def _observe(response):
+        token = g.pop('metrics_token', None)
+        if token is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        elapsed, timings = finish_request(token, route, request.method, response.status_code)
+        if wants_timing(request.headers):
+            response.headers['Server-Timing'] = server_timing(elapsed, timings)
+        return response
+
+    @app.teardown_request
+    def _release(error=None):
+        # after_request is skipped when a view raises; keep the gauge honest
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            finish_request(token, route, request.method, 500)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        body, content_type = render_metrics()
+        return Response(body, content_type=content_type)
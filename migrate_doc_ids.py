@@ -0,0 +1,143 @@
+import argparse
+import sys
+
+from elasticsearch import helpers
+
+from clear_db import create_elasticsearch_client
+from indexing import document_id, normalize_url
+from search_cache import create_search_cache
+
+
+def collect_groups(es, index):
+    """Map each (owner, normalized URL) to the (_id, timestamp, routing) of every document storing it.
+
+    Each user's copy of a page is a document of its own, so copies are only
+    collapsed within one library.
+    """
+    groups = {}
+    for hit in helpers.scan(es, index=index, query={"_source": ["url", "timestamp", "user_id"]}, size=1000):
+        source = hit.get("_source", {})
+        if not source.get("url"):
+            continue
+        key = (source.get("user_id"), normalize_url(source["url"]))
+        groups.setdefault(key, []).append((hit["_id"], source.get("timestamp") or "", hit.get("_routing")))
+    return groups
+
+
+def plan_migration(groups):
+    """Return (user_id, keep, target_id, stale) for every page whose documents need rewriting.
+
+    ``keep`` and each of ``stale`` are (_id, routing) pairs. The most
+    recently scraped copy of a page wins: it is re-stored under the
+    deterministic id of its library, routed by its owner, and every other
+    copy is deleted. A copy already under the target id but routed
+    differently counts as stale too.
+    """
+    plan = []
+    for (user_id, normalized), docs in groups.items():
+        target_id = document_id(normalized, user_id)
+        keep_id, _, keep_routing = max(docs, key=lambda doc: doc[1])
+        stale = [(doc_id, routing) for doc_id, _, routing in docs if (doc_id, routing) != (target_id, user_id)]
+        if stale:
+            plan.append((user_id, (keep_id, keep_routing), target_id, stale))
+    return plan
+
+
+def _delete_action(index, doc_id, routing):
+    action = {"_op_type": "delete", "_index": index, "_id": doc_id}
+    if routing is not None:
+        action["routing"] = routing
+    return action
+
+
+def copy_actions(es, index, plan, batch_size=500):
+    """Index actions that store each surviving copy under its deterministic id and owner's routing"""
+    to_copy = [(user_id, keep, target_id, stale) for user_id, keep, target_id, stale in plan
+               if keep != (target_id, user_id)]
+    for start in range(0, len(to_copy), batch_size):
+        batch = to_copy[start:start + batch_size]
+        # Fetch the surviving copies in one round trip per batch; routed copies are only found with their routing
+        response = es.mget(index=index, body={"docs": [
+            {"_id": keep_id, **({"routing": routing} if routing is not None else {})}
+            for _, (keep_id, routing), _, _ in batch
+        ]})
+        sources = {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+        for user_id, (keep_id, _), target_id, stale in batch:
+            if keep_id not in sources:
+                continue
+            # A misrouted copy under the target id may share a shard with the new one, where deleting it
+            # afterwards would delete the new copy; bulk applies the items of a shard in order
+            for doc_id, routing in stale:
+                if doc_id == target_id:
+                    yield _delete_action(index, doc_id, routing)
+            action = {"_op_type": "index", "_index": index, "_id": target_id, "_source": sources[keep_id]}
+            if user_id is not None:
+                action["routing"] = user_id
+            yield action
+
+
+def run_bulk(es, actions):
+    """Run bulk actions, returning ((op, _id) of the actions that succeeded, number of failures)"""
+    succeeded = set()
+    failed = 0
+    for ok, item in helpers.streaming_bulk(es, actions, raise_on_error=False, raise_on_exception=False):
+        op, result = next(iter(item.items()))
+        # A stale copy that is already gone is as good as deleted
+        if ok or (op == "delete" and result.get("status") == 404):
+            succeeded.add((op, result.get("_id")))
+        else:
+            failed += 1
+            print(f"Failed to {op} {result.get('_id')}: {result.get('error')}")
+    return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-key webpages documents by owner and normalized URL hash, and collapse duplicates "
+                    "within each library"
+    )
+    parser.add_argument('--index', default='webpages')
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would change")
+    args = parser.parse_args()
+
+    es = create_elasticsearch_client()
+    if not es:
+        print("Failed to connect to Elasticsearch")
+        return 1
+
+    groups = collect_groups(es, args.index)
+    total_docs = sum(len(docs) for docs in groups.values())
+    print(f"Found {total_docs} documents for {len(groups)} distinct pages ({total_docs - len(groups)} duplicates)")
+
+    plan = plan_migration(groups)
+    print(f"{len(plan)} pages need to be rewritten")
+    if args.dry_run or not plan:
+        return 0
+
+    # Copy first, and only delete the old copies of pages whose new document was written
+    succeeded, copy_failures = run_bulk(es, copy_actions(es, args.index, plan))
+    copied = {doc_id for op, doc_id in succeeded if op == "index"}
+    print(f"Re-keyed {len(copied)} documents")
+
+    delete_actions = (
+        _delete_action(args.index, stale_id, routing)
+        for user_id, keep, target_id, stale in plan
+        if keep == (target_id, user_id) or target_id in copied
+        for stale_id, routing in stale
+        # Misrouted copies under the target id were deleted with the copy, if one was written
+        if stale_id != target_id or keep == (target_id, user_id)
+    )
+    deleted, delete_failures = run_bulk(es, delete_actions)
+    print(f"Deleted {len(deleted)} stale copies")
+
+    es.indices.refresh(index=args.index)
+    search_cache = create_search_cache()
+    if search_cache:
+        search_cache.invalidate()
+    failures = copy_failures + delete_failures
+    print(f"Migration finished with {failures} failures")
+    return 0 if failures == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import base64
+import json
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(sort_values):
+    """Turn the sort values of the last hit on a page into an opaque cursor"""
+    raw = json.dumps(sort_values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, shape=None):
+    """Inverse of encode_cursor; returns the search_after values.
+
+    ``shape`` gives the accepted type (or tuple of types) of each value, so
+    a cursor that does not fit the sort it pages is rejected here rather
+    than by the backend.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise InvalidCursorError("Invalid cursor")
+    if not isinstance(values, list):
+        raise InvalidCursorError("Invalid cursor")
+    if shape is not None and not _fits(values, shape):
+        raise InvalidCursorError("Invalid cursor")
+    return values
+
+
+def _fits(values, shape):
+    # bool is an int to isinstance, but never a sort value
+    return len(values) == len(shape) and all(
+        isinstance(value, types) and not isinstance(value, bool) for value, types in zip(values, shape)
+    )
+
+
+def page_size_arg(args, name='page_size', default=100, maximum=1000):
+    """Read a page size query parameter, clamped to [1, maximum]"""
+    try:
+        size = int(args.get(name, default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
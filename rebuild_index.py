@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+from itertools import groupby
+
+from backends import create_backend
+from batch_ingest import DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY, bulk_ingest
+from crawl_state import crawl_state
+from es_client import ElasticsearchManager
+from extraction import Extractor
+from html_archive import HtmlArchive
+from ingest_cli import IngestHooks
+from recrawl import seed_state
+
+
+def archived_scrape(archive, extractor):
+    """A scrape function for bulk_ingest that re-extracts the archived HTML of a URL instead of fetching it"""
+    def scrape(url):
+        page = archive.load(url)
+        if not page:
+            return None
+        scraped_data = extractor.extract(url, page["content"], page["encoding"])
+        # The favicon the page resolved to when fetched, so the site's /favicon.ico is not probed again
+        if not scraped_data["favicon"]:
+            scraped_data["favicon"] = page["favicon"]
+        scraped_data["fetched_at"] = datetime.utcfromtimestamp(page["fetched_at"]).isoformat()
+        return scraped_data
+    return scrape
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-extract every stored page from the HTML archive and re-index the pages whose text changed, "
+                    "without fetching them again"
+    )
+    parser.add_argument('--user-id', help="only rebuild this user's library")
+    parser.add_argument('--shared', action='store_true', help="only rebuild the shared library")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="Pages read and checked against the backend in parallel")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Documents per bulk request")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Extraction processes")
+    parser.add_argument('--report', help="Write per-URL results as NDJSON to this file")
+    args = parser.parse_args()
+
+    # Before any threads start, as the workers are forked
+    extractor = Extractor(workers=args.workers, pool_min_bytes=0)
+    extractor.start()
+
+    # Writes to the backend selected by SEARCH_BACKEND, like the web app
+    backend = create_backend(ElasticsearchManager())
+    if not backend.available():
+        print(f"Failed to connect to {backend.name}")
+        return 1
+
+    # Pages stored before the crawl state existed are only listed by the backend;
+    # after clear_db.py the backend is empty and the crawl state lists them all
+    seed_state(backend, crawl_state)
+    pages = crawl_state.pages()
+    if args.user_id or args.shared:
+        pages = [page for page in pages if page[1] == args.user_id]
+
+    archive = HtmlArchive()
+    missing = {url for url, _ in pages if not archive.contains(url)}
+    pages = [page for page in pages if page[0] not in missing]
+
+    # Changed pages of the shared library are re-embedded, as in import_urls.py
+    hooks = IngestHooks()
+
+    print(f"Re-extracting {len(pages)} archived pages with {extractor.engine}...")
+    scrape = archived_scrape(archive, extractor)
+    results = []
+    try:
+        for user_id, library in groupby(pages, key=lambda page: page[1]):
+            results.extend(bulk_ingest(
+                backend, [url for url, _ in library], concurrency=args.concurrency, chunk_size=args.chunk_size,
+                on_indexed=hooks.page_stored, user_id=user_id, scrape=scrape
+            ))
+    finally:
+        extractor.close()
+    summary = hooks.finish(results, args.report)
+
+    print(f"Re-indexed {summary['indexed']} of {summary['total']} pages ({summary['unchanged']} unchanged, "
+          f"{summary['duplicate']} near-duplicates skipped, {summary['failed']} failed)")
+    if missing:
+        print(f"{len(missing)} pages are not in the archive; add them again to fetch them")
+    return 0 if summary["failed"] == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
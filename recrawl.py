@@ -0,0 +1,259 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from backends import create_backend
+from crawl_state import crawl_state
+from es_client import ElasticsearchManager
+from extraction import extractor
+from fingerprints import check_document
+from indexing import build_document
+from ingest_cli import IngestHooks
+from metrics import RECRAWL_RESULTS, stage
+from scraper import scrape_if_modified
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Run the scheduler inside the web app; `python recrawl.py` runs it on its own
+RECRAWL = os.getenv('RECRAWL', 'false').lower() == 'true'
+RECRAWL_CONCURRENCY = int(os.getenv('RECRAWL_CONCURRENCY', '8'))
+# Politeness: requests in flight to one host, and seconds between the starts of two of them
+RECRAWL_PER_HOST = int(os.getenv('RECRAWL_PER_HOST', '2'))
+RECRAWL_HOST_DELAY = float(os.getenv('RECRAWL_HOST_DELAY', '1.0'))
+RECRAWL_BATCH_SIZE = int(os.getenv('RECRAWL_BATCH_SIZE', '100'))
+# Seconds to sleep when nothing is due
+RECRAWL_POLL_INTERVAL = float(os.getenv('RECRAWL_POLL_INTERVAL', '60'))
+
+
+def host_of(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+class HostLimiter:
+    """Per-host politeness: at most ``per_host`` requests in flight and ``delay`` seconds between starts"""
+
+    def __init__(self, per_host=RECRAWL_PER_HOST, delay=RECRAWL_HOST_DELAY):
+        self.per_host = per_host
+        self.delay = delay
+        self._slots = defaultdict(lambda: threading.Semaphore(per_host))
+        self._next_start = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        with self._lock:
+            slots = self._slots[host]
+        slots.acquire()
+        with self._lock:
+            start = max(time.monotonic(), self._next_start[host])
+            self._next_start[host] = start + self.delay
+        time.sleep(max(start - time.monotonic(), 0))
+
+    def release(self, host):
+        self._slots[host].release()
+
+
+class RecrawlScheduler:
+    """Background re-crawl of stored pages with conditional GETs.
+
+    Due pages are claimed from the CrawlState in batches and grouped by
+    host; each host gets at most ``per_host`` lanes, so one large site
+    cannot take every worker or flood its server. A page is requested with
+    If-None-Match / If-Modified-Since, so an unchanged page answers 304
+    without a body and is never parsed. Pages that do return a body go
+    through fingerprints.check_document, and only those whose text changed
+    are written to the backend. ``on_indexed(document)`` and
+    ``on_change()`` are called after each write, as after /add_url. Every
+    page in the backend that the state does not track yet is seeded when
+    the scheduler starts.
+    """
+
+    def __init__(self, backend, state, on_indexed=None, on_change=None, concurrency=RECRAWL_CONCURRENCY,
+                 batch_size=RECRAWL_BATCH_SIZE, poll_interval=RECRAWL_POLL_INTERVAL, limiter=None):
+        self.backend = backend
+        self.state = state
+        self.on_indexed = on_indexed
+        self.on_change = on_change
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.limiter = limiter or HostLimiter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Run the scheduler on a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="recrawl-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        # Pages stored before anything was tracked are picked up on every start; pages already
+        # tracked keep their schedule. Retried with the batches until the backend answers
+        seeded = False
+        while not self._stop.is_set():
+            try:
+                if not seeded:
+                    self.seed()
+                    seeded = True
+                processed = self.run_once()
+            except Exception as e:
+                self.backend.report_error(e)
+                logger.error(f"Re-crawl batch failed: {str(e)}")
+                processed = 0
+            if not processed:
+                self._stop.wait(self.poll_interval)
+
+    def seed(self, page_size=1000):
+        """Track every page in the backend that the crawl state does not know yet"""
+        seeded = seed_state(self.backend, self.state, page_size)
+        logger.info(f"Re-crawl scheduler tracking {seeded} stored pages")
+        return seeded
+
+    def run_once(self):
+        """Re-crawl one batch of due pages; returns {outcome: count}"""
+        pages = self.state.claim_due(self.batch_size)
+        if not pages:
+            return {}
+        by_host = defaultdict(list)
+        for page in pages:
+            by_host[host_of(page["url"])].append(page)
+        lanes = []
+        for host, host_pages in by_host.items():
+            for lane in range(min(self.limiter.per_host, len(host_pages))):
+                lanes.append((host, host_pages[lane::self.limiter.per_host]))
+
+        outcomes = defaultdict(int)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="recrawl") as executor:
+            for lane_outcomes in executor.map(lambda lane: self._run_lane(*lane), lanes):
+                for outcome in lane_outcomes:
+                    outcomes[outcome] += 1
+        logger.info(f"Re-crawled {len(pages)} pages: {dict(outcomes)}")
+        return dict(outcomes)
+
+    def _run_lane(self, host, pages):
+        outcomes = []
+        for page in pages:
+            self.limiter.acquire(host)
+            try:
+                outcomes.append(self.recrawl(page))
+            finally:
+                self.limiter.release(host)
+        return outcomes
+
+    def recrawl(self, page):
+        """Conditionally re-fetch one claimed page and re-index it if its text changed; returns the outcome"""
+        url = page["url"]
+        modified, scraped_data = scrape_if_modified(url, page["etag"], page["last_modified"])
+        if not modified:
+            outcome, etag, last_modified = "not_modified", page["etag"], page["last_modified"]
+        elif not scraped_data:
+            outcome, etag, last_modified = "failed", None, None
+        else:
+            etag, last_modified = scraped_data.get("etag"), scraped_data.get("last_modified")
+            outcome = self._store(page, url, scraped_data)
+
+        RECRAWL_RESULTS.labels(outcome).inc()
+        self.state.record(page, "unchanged" if outcome in ("not_modified", "unchanged", "duplicate") else outcome,
+                          etag, last_modified)
+        return outcome
+
+    def _store(self, page, url, scraped_data):
+        document = build_document(url, scraped_data, page["user_id"])
+        try:
+            status = check_document(self.backend, page["doc_id"], document)
+            # Don't bring back a page deleted while it was being fetched
+            if status != "index" or not self.state.is_tracked(page["doc_id"]):
+                return status
+            with stage('recrawl_index'):
+                self.backend.index_document(page["doc_id"], document)
+        except Exception as e:
+            self.backend.report_error(e)
+            logger.error(f"Failed to re-index {url}: {str(e)}")
+            return "failed"
+        if self.on_indexed:
+            self.on_indexed(document)
+        if self.on_change:
+            self.on_change()
+        return "changed"
+
+
+def seed_state(backend, state, page_size=1000):
+    """Add every page of every library in the backend to the crawl state; returns how many were listed"""
+    seeded, search_after = 0, None
+    while True:
+        hits = backend.list_page(page_size, search_after, all_users=True)
+        for hit in hits:
+            source = hit["_source"]
+            # Pages rebuilt from the HTML archive were fetched before they were written
+            fetched_at = source.get("fetched_at") or source.get("timestamp")
+            state.seed(source["url"], _timestamp(fetched_at), source.get("user_id"))
+            seeded += 1
+        if len(hits) < page_size:
+            break
+        search_after = hits[-1]["sort"]
+    return seeded
+
+
+def _timestamp(value):
+    """Epoch seconds of a stored (UTC) timestamp, or now if it is missing or malformed"""
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-crawl stored pages whose re-crawl interval has passed")
+    parser.add_argument('--once', action='store_true', help="re-crawl the pages due now and exit")
+    parser.add_argument('--seed', action='store_true',
+                        help="with --once, track every page in the backend first (the scheduler always does)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # Before the re-crawl threads start, as the workers are forked
+    extractor.start()
+
+    # Writes to the backend selected by SEARCH_BACKEND, like the web app
+    backend = create_backend(ElasticsearchManager())
+    if not backend.available():
+        print(f"Failed to connect to {backend.name}")
+        return 1
+
+    # Changed pages are re-embedded, as in import_urls.py
+    hooks = IngestHooks()
+    scheduler = RecrawlScheduler(backend, crawl_state, on_indexed=hooks.page_stored, on_change=hooks.index_changed)
+    if args.seed and args.once:
+        scheduler.seed()
+    if not args.once:
+        scheduler.run()
+        return 0
+
+    totals = defaultdict(int)
+    while True:
+        outcomes = scheduler.run_once()
+        if not outcomes:
+            break
+        for outcome, count in outcomes.items():
+            totals[outcome] += count
+    hooks.wait()
+    print(f"Re-crawled {sum(totals.values())} pages: " +
+          ', '.join(f"{count} {outcome}" for outcome, count in sorted(totals.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
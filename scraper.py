@@ -0,0 +1,74 @@
+import logging
+from urllib.parse import urljoin
+
+from extraction import extractor
+from favicon_cache import favicon_cache, origin_of
+from fetcher import FetchError, fetch, head_ok
+from html_archive import html_archive
+from metrics import SCRAPE_FAILURES, stage
+
+logger = logging.getLogger(__name__)
+
+def default_favicon_for(url):
+    """Return the site's /favicon.ico if it exists, consulting the per-origin cache first"""
+    origin = origin_of(url)
+    hit, favicon = favicon_cache.lookup(origin)
+    if hit:
+        return favicon
+
+    # Try default favicon location
+    default_favicon = urljoin(url, '/favicon.ico')
+    found = head_ok(default_favicon)
+    if found is None:
+        # A timeout or connection error says nothing about the favicon; probe again on the next scrape
+        return None
+    favicon = default_favicon if found else None
+    favicon_cache.store(origin, favicon)
+    return favicon
+
+def extract_page(url, content, encoding=None):
+    """Parse downloaded HTML into title, text and the favicon declared by the page (if any)"""
+    return extractor.extract(url, content, encoding)
+
+def validators(headers):
+    """ETag and Last-Modified of a response, for conditional requests on the next fetch"""
+    return {"etag": headers.get('ETag'), "last_modified": headers.get('Last-Modified')}
+
+def conditional_headers(etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+def scrape_url(url):
+    """Scrape a page into title, content and favicon, plus its etag and last_modified validators; None on failure"""
+    modified, scraped_data = scrape_if_modified(url)
+    return scraped_data
+
+def scrape_if_modified(url, etag=None, last_modified=None):
+    """Conditional scrape: (False, None) when the server answers 304 Not Modified, else (True, scrape_url's result)"""
+    try:
+        with stage('fetch'):
+            page = fetch(url, headers=conditional_headers(etag, last_modified))
+        if page.status_code == 304:
+            return False, None
+        with stage('parse'):
+            scraped_data = extract_page(url, page.content, page.encoding)
+        if not scraped_data["favicon"]:
+            with stage('favicon'):
+                scraped_data["favicon"] = default_favicon_for(url)
+        scraped_data.update(validators(page.headers))
+        if html_archive:
+            with stage('archive'):
+                html_archive.store(url, page.content, page.encoding, scraped_data["favicon"])
+        return True, scraped_data
+    except FetchError as e:
+        SCRAPE_FAILURES.labels(e.cause).inc()
+        logger.warning(f"Skipping {url} ({e.cause}): {str(e)}")
+        return True, None
+    except Exception as e:
+        SCRAPE_FAILURES.labels('parse').inc()
+        logger.error(f"Error scraping {url}: {str(e)}")
+        return True, None
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+SEARCH_CACHE_BACKEND = os.getenv('SEARCH_CACHE_BACKEND', 'memory').lower()
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '60'))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '1000'))
+# Elasticsearch's refresh_interval: a write is not searchable for this long, so nothing read meanwhile is kept
+SEARCH_CACHE_SETTLE_SECONDS = float(os.getenv('SEARCH_CACHE_SETTLE_SECONDS', '1.0'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class MemoryBackend:
+    """In-process LRU store with per-entry expiry.
+
+    Mirrors the subset of the Redis API the cache needs (get/set/incr), so it
+    can stand in for Redis in tests and single-process deployments.
+    """
+
+    # Writes by other processes do not reach its counters
+    shared = False
+
+    def __init__(self, max_entries=SEARCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._epoch = uuid.uuid4().hex
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return str(self._counters[key])
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ex=None):
+        expires_at = time.monotonic() + ex if ex else float('inf')
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def epoch(self, key):
+        # The counters start over with the process
+        return self._epoch
+
+
+class RedisBackend:
+    """Shared store for multi-worker deployments; needs the optional ``redis`` package"""
+
+    shared = True
+
+    def __init__(self, url=REDIS_URL):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ex=None):
+        self.client.set(key, value, ex=ex)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def epoch(self, key):
+        # Created with the counters, and gone with them when Redis is flushed
+        value = self.client.get(key)
+        if value is None:
+            self.client.set(key, uuid.uuid4().hex, nx=True)
+            value = self.client.get(key)
+        return value.decode('utf-8')
+
+
+class SearchCache:
+    """Cache of serialized search responses, invalidated by an index generation counter.
+
+    Every write to the index bumps the generation, which is part of each
+    cache key, so entries written before the change simply stop being
+    looked up and age out through LRU eviction or their TTL. The bump comes
+    before the write is searchable, so a generation is only ``settled``
+    (its searches worth caching) ``settle`` seconds after it was first seen.
+    """
+
+    # Generations whose first sighting is remembered; older ones are no longer current anyway
+    MAX_TRACKED_GENERATIONS = 64
+
+    def __init__(self, backend, ttl=SEARCH_CACHE_TTL, prefix='search', settle=SEARCH_CACHE_SETTLE_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.settle = settle
+        self._first_seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def generation(self):
+        """Current index generation, or None if the backend is unreachable"""
+        try:
+            return int(self.backend.get(f"{self.prefix}:generation") or 0)
+        except Exception as e:
+            logger.warning(f"Search cache unavailable: {str(e)}")
+            return None
+
+    def version(self):
+        """(epoch, generation) of the index, or None if the backend is unreachable.
+
+        The epoch is a random id of the generation counter, replaced when the
+        counter starts over (a new process with the memory backend, a flushed
+        Redis), so a version is never repeated for a different index state.
+        """
+        try:
+            epoch = self.backend.epoch(f"{self.prefix}:epoch")
+            return epoch, int(self.backend.get(f"{self.prefix}:generation") or 0)
+        except Exception as e:
+            logger.warning(f"Search cache unavailable: {str(e)}")
+            return None
+
+    def settled(self, generation):
+        """Whether searches at ``generation`` see every write behind it.
+
+        A generation counts from when this process first bumped or read it,
+        so one bumped by another process may be seen a little late, never early.
+        """
+        if not self.settle:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            first_seen = self._first_seen.setdefault(generation, now)
+            while len(self._first_seen) > self.MAX_TRACKED_GENERATIONS:
+                self._first_seen.popitem(last=False)
+        return now - first_seen >= self.settle
+
+    @property
+    def shared(self):
+        """Whether generation bumps of other processes are seen"""
+        return self.backend.shared
+
+    def key(self, generation, query, **params):
+        """Cache key for a query and its paging parameters at a given generation"""
+        normalized = ' '.join(query.lower().split())
+        digest = hashlib.sha1(json.dumps([normalized, params], sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{self.prefix}:{generation}:{digest}"
+
+    def get(self, key):
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Search cache read failed: {str(e)}")
+            return None
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Search cache write failed: {str(e)}")
+
+    def invalidate(self):
+        """Bump the generation after any change to the webpages index; returns the new generation, or None"""
+        try:
+            generation = int(self.backend.incr(f"{self.prefix}:generation"))
+        except Exception as e:
+            logger.warning(f"Search cache invalidation failed: {str(e)}")
+            return None
+        # Its settle window starts now, not when a search first reads it
+        self.settled(generation)
+        return generation
+
+
+def create_search_cache():
+    """Build the search cache configured by SEARCH_CACHE_BACKEND, or None if disabled"""
+    if SEARCH_CACHE_BACKEND in ('none', 'off', 'disabled'):
+        return None
+    if SEARCH_CACHE_BACKEND == 'redis':
+        try:
+            return SearchCache(RedisBackend())
+        except ImportError:
+            logger.warning("redis is not installed, falling back to the in-memory search cache")
+    return SearchCache(MemoryBackend())
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from metrics import SEARCH_BATCHES, SEARCHES_COALESCED
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+SEARCH_BATCH_WINDOW_MS = float(os.getenv('SEARCH_BATCH_WINDOW_MS', '5'))
+SEARCH_BATCH_MAX = int(os.getenv('SEARCH_BATCH_MAX', '32'))
+SEARCH_DISPATCH_THREADS = int(os.getenv('SEARCH_DISPATCH_THREADS', '4'))
+SEARCH_DISPATCH_TIMEOUT = float(os.getenv('SEARCH_DISPATCH_TIMEOUT', '30'))
+
+
+class SearchDispatchError(Exception):
+    """Raised when one search inside an _msearch batch fails"""
+
+
+class _Flight:
+    """A search request that is queued or running, shared by every caller asking for it"""
+
+    def __init__(self, body, routing=None):
+        self.body = body
+        self.routing = routing
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 1
+
+
+class SearchDispatcher:
+    """Sits between the /search handler and Elasticsearch.
+
+    Identical request bodies that are already queued or running are
+    coalesced (singleflight): later callers wait for the first one's result
+    instead of sending their own search. A search arriving while nothing
+    else is queued or running is sent at once; otherwise the collector waits
+    ``window`` seconds for more, and the searches are sent together as one
+    _msearch, each keeping its own routing.
+    """
+
+    def __init__(self, get_client, index="webpages", window=SEARCH_BATCH_WINDOW_MS / 1000.0,
+                 max_batch=SEARCH_BATCH_MAX, threads=SEARCH_DISPATCH_THREADS):
+        self.get_client = get_client
+        self.index = index
+        self.window = window
+        self.max_batch = max_batch
+        self.threads = threads
+
+        self._inflight = {}
+        self._queue = []
+        self._cond = threading.Condition()
+        self._collector = None
+        self._executor = None
+        # Batches submitted to the executor and not finished yet
+        self._running = 0
+
+    def search(self, body, routing=None, timeout=SEARCH_DISPATCH_TIMEOUT):
+        """Run a search body through the dispatcher and return the Elasticsearch response"""
+        key = json.dumps([routing, body], sort_keys=True, separators=(',', ':'))
+        with self._cond:
+            flight = self._inflight.get(key)
+            if flight:
+                flight.waiters += 1
+                SEARCHES_COALESCED.inc()
+            else:
+                flight = _Flight(body, routing)
+                self._inflight[key] = flight
+                self._queue.append((key, flight))
+                self._ensure_started()
+                self._cond.notify()
+
+        if not flight.done.wait(timeout):
+            raise TimeoutError("Search timed out waiting for Elasticsearch")
+        if flight.error:
+            raise flight.error
+        return flight.result
+
+    def _ensure_started(self):
+        if self._collector is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="search-dispatch")
+            self._collector = threading.Thread(target=self._collect, name="search-collector", daemon=True)
+            self._collector.start()
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                concurrent = self._running > 0 or len(self._queue) > 1
+
+            # A lone search goes out at once; under concurrency, give other requests a moment to join the batch
+            if concurrent and self.window > 0:
+                time.sleep(self.window)
+
+            with self._cond:
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+                self._running += 1
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        try:
+            client = self.get_client()
+            if client is None:
+                raise SearchDispatchError("Elasticsearch is not available")
+
+            if len(batch) == 1:
+                flight = batch[0][1]
+                outcomes = [self._outcome(lambda: client.search(index=self.index, body=flight.body,
+                                                                routing=flight.routing))]
+            else:
+                SEARCH_BATCHES.inc()
+                lines = []
+                for _, flight in batch:
+                    lines.extend([{"routing": flight.routing} if flight.routing else {}, flight.body])
+                responses = client.msearch(index=self.index, body=lines)["responses"]
+                outcomes = [
+                    (None, SearchDispatchError(str(response["error"]))) if "error" in response else (response, None)
+                    for response in responses
+                ]
+        except Exception as e:
+            outcomes = [(None, e)] * len(batch)
+
+        with self._cond:
+            self._running -= 1
+            for (key, flight), (result, error) in zip(batch, outcomes):
+                # Once finished, a new identical request must trigger a fresh search
+                self._inflight.pop(key, None)
+                flight.result, flight.error = result, error
+                flight.done.set()
+
+    @staticmethod
+    def _outcome(call):
+        try:
+            return call(), None
+        except Exception as e:
+            return None, e
+
+
+class _Abandoned(Exception):
+    """Resolves a flight whose leading caller was cancelled, so that its followers run the call themselves"""
+
+
+class AsyncSingleflight:
+    """asyncio counterpart of the dispatcher's coalescing: one awaitable per in-flight key"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, call):
+        """Await ``call()``, or the result of an identical call that is already running"""
+        while key in self._inflight:
+            SEARCHES_COALESCED.inc()
+            try:
+                return await asyncio.shield(self._inflight[key])
+            except _Abandoned:
+                # The first follower to wake up starts a fresh call, and the others wait for it
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await call()
+        except BaseException as e:
+            # Followers are resolved however the call ends, including when this caller is cancelled
+            future.set_exception(e if isinstance(e, Exception) else _Abandoned())
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
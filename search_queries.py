@@ -0,0 +1,364 @@
+import os
+
+from dotenv import load_dotenv
+
+from indexing import CONTENT_LAYOUT
+from pagination import decode_cursor, encode_cursor, page_size_arg
+from tenancy import owner_filter, with_owner
+
+# Load environment variables
+load_dotenv()
+
+# Escalate to the fuzzy tier when the exact tier finds fewer hits than this
+SEARCH_MIN_HITS = int(os.getenv('SEARCH_MIN_HITS', '3'))
+# Rank constant of reciprocal rank fusion; larger values flatten the gap between top and lower ranks
+RRF_K = int(os.getenv('RRF_K', '60'))
+# Show one page per near-duplicate cluster in search results (see fingerprints.py)
+SEARCH_COLLAPSE_DUPLICATES = os.getenv('SEARCH_COLLAPSE_DUPLICATES', 'true').lower() == 'true'
+# Hits per /search page, unless the request passes size
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '10'))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', '100'))
+# Elasticsearch's index.max_result_window: pages past from + size of this are reached with a cursor
+SEARCH_MAX_RESULT_WINDOW = int(os.getenv('SEARCH_MAX_RESULT_WINDOW', '10000'))
+# Characters of a page's text the highlighter reads, so its cost stops growing with the page; 0 reads them all
+SEARCH_HIGHLIGHT_MAX_CHARS = int(os.getenv('SEARCH_HIGHLIGHT_MAX_CHARS', '100000'))
+
+# The only fields of a hit /search reads; content stays on the shards
+SEARCH_SOURCE = ["url", "title", "favicon", "cluster"]
+# url breaks score ties, so results come in a stable order and search_after never skips or repeats a hit
+SEARCH_SORT = [{"_score": {"order": "desc"}}, {"url": {"order": "asc"}}]
+# A /search cursor: the tier, then the sort values (the embedded index breaks ties by its row id instead of url)
+SEARCH_CURSOR_SHAPE = (str, (int, float), (int, str))
+
+HIGHLIGHT = {
+    "fields": {
+        "content": {
+            "fragment_size": 150,
+            "number_of_fragments": 1,
+            "pre_tags": ["<mark>"],
+            "post_tags": ["</mark>"]
+        },
+        "title": {
+            "fragment_size": 150,
+            "number_of_fragments": 1,
+            "pre_tags": ["<mark>"],
+            "post_tags": ["</mark>"]
+        }
+    }
+}
+if SEARCH_HIGHLIGHT_MAX_CHARS > 0:
+    # Text past it is not highlighted, instead of failing the search as index.highlight.max_analyzed_offset does
+    HIGHLIGHT["max_analyzed_offset"] = SEARCH_HIGHLIGHT_MAX_CHARS
+
+
+# Best passage of each hit with the passages layout, highlighted like the content field
+PASSAGE_INNER_HITS = {
+    "size": 1,
+    "_source": False,
+    "highlight": {
+        "fields": {
+            "passages.text": {
+                **HIGHLIGHT["fields"]["content"],
+                # A passage matched only by a fuzzy or prefix term still yields a snippet
+                "no_match_size": HIGHLIGHT["fields"]["content"]["fragment_size"]
+            }
+        }
+    }
+}
+
+
+def passage_clause(clauses):
+    """Wrap content clauses in one nested query scored by, and returning, the best passage"""
+    return {
+        "nested": {
+            "path": "passages",
+            "query": {"bool": {"should": clauses, "minimum_should_match": 1}},
+            "score_mode": "max",
+            "inner_hits": PASSAGE_INNER_HITS
+        }
+    }
+
+
+def exact_query(query, passages=False):
+    """Cheap first tier: plain term matches plus a title phrase boost, no fuzziness"""
+    if passages:
+        content = passage_clause([{"match": {"passages.text": {"query": query}}}])
+    else:
+        content = {"match": {"content": {"query": query}}}
+    return {
+        "bool": {
+            "should": [
+                {"match": {"title": {"query": query, "boost": 2.0}}},
+                content,
+                {"match_phrase": {"title": {"query": query, "boost": 3.0}}}
+            ],
+            "minimum_should_match": 1
+        }
+    }
+
+
+def fuzzy_query(query, passages=False):
+    """Expensive fallback tier: fuzzy matches plus phrase_prefix over title and content"""
+    if passages:
+        return fuzzy_passage_query(query)
+    return {
+        "bool": {
+            "should": [
+                {
+                    "match": {
+                        "title": {
+                            "query": query,
+                            "boost": 2.0,
+                            "fuzziness": "AUTO",
+                            "prefix_length": 2
+                        }
+                    }
+                },
+                {
+                    "match": {
+                        "content": {
+                            "query": query,
+                            "fuzziness": "AUTO",
+                            "prefix_length": 2
+                        }
+                    }
+                },
+                {
+                    "multi_match": {
+                        "query": query,
+                        "fields": ["title", "content"],
+                        "type": "phrase_prefix"
+                    }
+                }
+            ],
+            "minimum_should_match": 1
+        }
+    }
+
+
+def fuzzy_passage_query(query):
+    """fuzzy_query for the passages layout; phrase_prefix cannot span the title and a nested field, so it is split"""
+    return {
+        "bool": {
+            "should": [
+                {
+                    "match": {
+                        "title": {
+                            "query": query,
+                            "boost": 2.0,
+                            "fuzziness": "AUTO",
+                            "prefix_length": 2
+                        }
+                    }
+                },
+                {"match_phrase_prefix": {"title": {"query": query}}},
+                passage_clause([
+                    {
+                        "match": {
+                            "passages.text": {
+                                "query": query,
+                                "fuzziness": "AUTO",
+                                "prefix_length": 2
+                            }
+                        }
+                    },
+                    {"match_phrase_prefix": {"passages.text": {"query": query}}}
+                ])
+            ],
+            "minimum_should_match": 1
+        }
+    }
+
+
+# Tiers in the order they are tried
+SEARCH_TIERS = [
+    ("exact", exact_query),
+    ("fuzzy", fuzzy_query)
+]
+
+
+def search_body(query, tier_query, passages=False, user_id=None, size=SEARCH_PAGE_SIZE, offset=0, search_after=None,
+                min_hits=SEARCH_MIN_HITS):
+    """Search request body for one page of one tier, over one user's library or the shared one"""
+    body = {
+        "query": with_owner(tier_query(query, passages=True) if passages else tier_query(query), user_id),
+        # Passage text comes back through inner_hits
+        "highlight": {"fields": {"title": HIGHLIGHT["fields"]["title"]}} if passages else HIGHLIGHT,
+        "_source": SEARCH_SOURCE,
+        "sort": SEARCH_SORT,
+        "track_scores": True,
+        "size": size,
+        # Enough to choose the tier; counting every match is not needed
+        "track_total_hits": min_hits
+    }
+    if offset:
+        body["from"] = offset
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+
+def total_hits(results):
+    return results["hits"].get("total", {}).get("value", len(results["hits"]["hits"]))
+
+
+def _tiers(tier):
+    return SEARCH_TIERS if tier is None else [(name, tier_query) for name, tier_query in SEARCH_TIERS if name == tier]
+
+
+def tiered_search(run_search, query, min_hits=SEARCH_MIN_HITS, passages=CONTENT_LAYOUT == 'passages', user_id=None,
+                  size=SEARCH_PAGE_SIZE, offset=0, tier=None, search_after=None):
+    """Run tiers in order until one matches at least ``min_hits`` pages.
+
+    ``run_search`` takes a request body and returns the Elasticsearch
+    response. Returns (tier name, response) for the last tier that ran.
+    Every page of a query is answered by the same tier: pages reached
+    with a cursor pass the ``tier`` recorded in it.
+    """
+    tiers = _tiers(tier)
+    for position, (tier, tier_query) in enumerate(tiers):
+        results = run_search(search_body(query, tier_query, passages, user_id, size, offset, search_after, min_hits))
+        is_last = position == len(tiers) - 1
+        if is_last or total_hits(results) >= min_hits:
+            return tier, results
+
+
+async def async_tiered_search(run_search, query, min_hits=SEARCH_MIN_HITS, passages=CONTENT_LAYOUT == 'passages',
+                              user_id=None, size=SEARCH_PAGE_SIZE, offset=0, tier=None, search_after=None):
+    """tiered_search for coroutine ``run_search`` callables (used by the ASGI app)"""
+    tiers = _tiers(tier)
+    for position, (tier, tier_query) in enumerate(tiers):
+        results = await run_search(search_body(query, tier_query, passages, user_id, size, offset, search_after,
+                                               min_hits))
+        is_last = position == len(tiers) - 1
+        if is_last or total_hits(results) >= min_hits:
+            return tier, results
+
+
+def search_page_args(args):
+    """Paging parameters of a /search request: (size, offset, tier, search_after).
+
+    ``from`` pages by offset up to SEARCH_MAX_RESULT_WINDOW; ``cursor``
+    continues after the last hit of a previous page (see next_search_cursor).
+    Raises ValueError for parameters that cannot be served.
+    """
+    size = page_size_arg(args, 'size', SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+    try:
+        offset = int(args.get('from', 0))
+    except (TypeError, ValueError):
+        raise ValueError("from must be an integer")
+    if offset < 0:
+        raise ValueError("from must not be negative")
+    if offset + size > SEARCH_MAX_RESULT_WINDOW:
+        raise ValueError(f"from + size must not exceed {SEARCH_MAX_RESULT_WINDOW}; page further with cursor")
+
+    tier, search_after = None, None
+    if args.get('cursor'):
+        if offset:
+            raise ValueError("from and cursor cannot be combined")
+        values = decode_cursor(args['cursor'], SEARCH_CURSOR_SHAPE)
+        if values[0] not in dict(SEARCH_TIERS):
+            raise ValueError("Invalid cursor")
+        tier, search_after = values[0], values[1:]
+    return size, offset, tier, search_after
+
+
+def next_search_cursor(tier, hits, size):
+    """Cursor of the page after ``hits`` (before collapsing), or None on the last page"""
+    if len(hits) < size or "sort" not in hits[-1]:
+        return None
+    return encode_cursor([tier, *hits[-1]["sort"]])
+
+
+def best_passage(hit):
+    """Highlight fragments of the best matching passage of a hit, if it has one"""
+    passages = hit.get("inner_hits", {}).get("passages", {}).get("hits", {}).get("hits", [])
+    if not passages:
+        return None
+    return passages[0].get("highlight", {}).get("passages.text")
+
+
+def format_search_hits(hits):
+    """Shape Elasticsearch hits into the /search response items"""
+    items = []
+    for hit in hits:
+        highlight = hit.get("highlight", {})
+        passage = best_passage(hit)
+        if passage:
+            # Reported as the content highlight, so clients see the same shape with either layout
+            highlight = {**highlight, "content": passage}
+        items.append({
+            "url": hit["_source"]["url"],
+            "title": hit["_source"]["title"],
+            "favicon": hit["_source"].get("favicon"),
+            "score": hit["_score"],
+            "highlight": highlight,
+            "snippet": highlight["content"][0] if "content" in highlight else None
+        })
+    return items
+
+
+# Fields of format=compact items: the snippet, without the highlight it is taken from
+COMPACT_FIELDS = ("url", "title", "favicon", "score", "snippet")
+
+
+def compact_search_hits(items):
+    """/search response items reduced to COMPACT_FIELDS"""
+    return [{field: item.get(field) for field in COMPACT_FIELDS} for item in items]
+
+
+def collapse_duplicates(hits):
+    """Keep the best scoring hit of each near-duplicate cluster; pages without a cluster stand alone"""
+    seen, kept = set(), []
+    for hit in hits:
+        cluster = hit["_source"].get("cluster") or hit["_id"]
+        if cluster not in seen:
+            seen.add(cluster)
+            kept.append(hit)
+    return kept
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked lists of keys into one, best first.
+
+    Each key scores the sum of 1 / (k + rank) over the lists it appears in,
+    so only ranks matter and BM25 scores need not be comparable to cosine
+    similarities. Returns [(key, fused score)].
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+LIST_FIELDS = ["url", "title", "favicon", "timestamp", "fetched_at", "user_id"]
+
+
+# Sort values of a /urls page: the timestamp (epoch millis from Elasticsearch, ISO text from the embedded index) and url
+LIST_CURSOR_SHAPE = ((int, str), str)
+
+
+def list_body(page_size, search_after=None, user_id=None, all_users=False):
+    """Request body for one page of the /urls listing of a library (or of every page), newest first"""
+    body = {
+        "query": {"match_all": {}} if all_users else {"bool": {"filter": [owner_filter(user_id)]}},
+        # url breaks timestamp ties so search_after never skips or repeats a page
+        "sort": [{"timestamp": {"order": "desc"}}, {"url": {"order": "asc"}}],
+        "size": page_size,
+        "_source": LIST_FIELDS,
+        "track_total_hits": False
+    }
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+
+def format_listing(hits):
+    """Shape Elasticsearch hits into the /urls response items"""
+    return [{
+        "url": hit["_source"]["url"],
+        "title": hit["_source"]["title"],
+        "favicon": hit["_source"].get("favicon"),
+        "timestamp": hit["_source"]["timestamp"]
+    } for hit in hits]
@@ -0,0 +1,200 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from embeddings import LazyEmbedder, chunk_text, create_embedder
+from indexing import document_id
+from metrics import record_stage
+
+try:
+    import chromadb
+except ImportError:
+    chromadb = None
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+SEMANTIC_SEARCH = os.getenv('SEMANTIC_SEARCH', 'true').lower() == 'true'
+CHROMA_PATH = os.getenv('CHROMA_PATH', 'chroma_db')
+CHROMA_COLLECTION = os.getenv('CHROMA_COLLECTION', 'webpage_embeddings')
+# Chunks fetched per query; several can belong to the same page
+SEMANTIC_CANDIDATES = int(os.getenv('SEMANTIC_CANDIDATES', '30'))
+SEMANTIC_TOP_K = int(os.getenv('SEMANTIC_TOP_K', '10'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '200'))
+EMBEDDING_QUEUE_SIZE = int(os.getenv('EMBEDDING_QUEUE_SIZE', '10000'))
+
+SNIPPET_CHARS = 150
+
+
+class SemanticIndex:
+    """Page chunks and their embeddings in a Chroma collection.
+
+    Chunk ids are ``{url}_{chunk_index}`` with the URL in the metadata, the
+    layout of the vectors already shipped in chroma_db.
+    """
+
+    def __init__(self, embedder, path=CHROMA_PATH, collection=CHROMA_COLLECTION):
+        self.embedder = embedder
+        self.client = chromadb.PersistentClient(path=path, settings=chromadb.Settings(anonymized_telemetry=False))
+        self.collection = self.client.get_or_create_collection(collection, metadata={"hnsw:space": "cosine"})
+
+    def replace(self, pages, batch_size=EMBEDDING_BATCH_SIZE):
+        """Embed and store (url, title, favicon, content) pages, replacing their previous chunks"""
+        ids, documents, metadatas = [], [], []
+        for url, title, favicon, content in pages:
+            for index, chunk in enumerate(chunk_text(content)):
+                ids.append(f"{url}_{index}")
+                documents.append(chunk)
+                # Chroma rejects None metadata values
+                metadatas.append({"url": url, "doc_id": document_id(url), "chunk_index": index,
+                                  "title": title or '', "favicon": favicon or ''})
+
+        embeddings = []
+        for start in range(0, len(documents), batch_size):
+            embeddings.extend(self.embedder.embed(documents[start:start + batch_size]))
+
+        # A page that shrank leaves chunk ids the upsert would not overwrite
+        self.delete([page[0] for page in pages])
+        if ids:
+            self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        return len(ids)
+
+    def delete(self, urls):
+        """Delete the chunks of these URLs, also matching other spellings of the same normalized URL"""
+        if urls:
+            self.collection.delete(where={"$or": [
+                {"url": {"$in": list(urls)}},
+                {"doc_id": {"$in": [document_id(url) for url in urls]}}
+            ]})
+
+    def search(self, query, top_k=SEMANTIC_TOP_K, candidates=SEMANTIC_CANDIDATES):
+        """Nearest chunks to the query, collapsed to the best chunk per page, closest first"""
+        results = self.collection.query(
+            query_embeddings=self.embedder.embed([query]),
+            n_results=candidates,
+            include=["metadatas", "documents", "distances"]
+        )
+        pages, seen = [], set()
+        for metadata, document, distance in zip(results["metadatas"][0], results["documents"][0],
+                                                results["distances"][0]):
+            url = metadata.get("url")
+            if not url or url in seen:
+                continue
+            seen.add(url)
+            pages.append({
+                "url": url,
+                "title": metadata.get("title") or url,
+                "favicon": metadata.get("favicon") or None,
+                "score": 1.0 - distance,
+                "snippet": (document or '')[:SNIPPET_CHARS] or None
+            })
+            if len(pages) >= top_k:
+                break
+        return pages
+
+
+class EmbeddingQueue:
+    """Single background worker that embeds pages in batches, off the request path.
+
+    Adds arriving within ``window`` seconds of each other are embedded
+    together, up to ``batch_size`` pages. Deletes are applied in arrival
+    order, after any adds queued before them. ``on_change`` runs after
+    every write so cached hybrid results are invalidated.
+    """
+
+    def __init__(self, index, on_change=None, batch_size=EMBEDDING_BATCH_SIZE,
+                 window=EMBEDDING_BATCH_WINDOW_MS / 1000, max_size=EMBEDDING_QUEUE_SIZE):
+        self.index = index
+        self.on_change = on_change
+        self.batch_size = batch_size
+        self.window = window
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker thread if it is not running yet"""
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._worker, name="embedding-worker", daemon=True)
+            self._thread.start()
+
+    def add(self, url, title, favicon, content):
+        self._put(("add", (url, title, favicon, content)))
+
+    def delete(self, url):
+        self._put(("delete", url))
+
+    def join(self):
+        """Block until everything queued so far has been written"""
+        self._queue.join()
+
+    def _put(self, item):
+        self.start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # The lexical index already has the page; it only misses from hybrid results
+            logger.warning(f"Embedding queue is full, dropping {item[0]} of {item[1] if item[0] == 'delete' else item[1][0]}")
+
+    def _next_batch(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(items) < self.batch_size and items[-1][0] == "add":
+            timeout = deadline - time.monotonic()
+            try:
+                items.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _worker(self):
+        while True:
+            items = self._next_batch()
+            try:
+                adds = [page for kind, page in items if kind == "add"]
+                if adds:
+                    # The last version queued for a URL wins
+                    pages = list({page[0]: page for page in adds}.values())
+                    started = time.perf_counter()
+                    chunks = self.index.replace(pages, self.batch_size)
+                    record_stage('embed', time.perf_counter() - started)
+                    logger.info(f"Embedded {chunks} chunks from {len(pages)} pages")
+                if items[-1][0] == "delete":
+                    self.index.delete([items[-1][1]])
+                if self.on_change:
+                    self.on_change()
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(items)} item(s) failed: {str(e)}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+
+def create_semantic_index(lazy=False):
+    """Open the vector store configured by CHROMA_PATH, or None if semantic search is disabled or unavailable.
+
+    With ``lazy``, the embedder is loaded by the first query or write that
+    needs it rather than now, as the web app does so workers boot without it.
+    """
+    if not SEMANTIC_SEARCH:
+        return None
+    if chromadb is None:
+        logger.warning("chromadb is not installed, semantic search is disabled")
+        return None
+    embedder = LazyEmbedder() if lazy else create_embedder()
+    if embedder is None:
+        return None
+    try:
+        return SemanticIndex(embedder)
+    except Exception as e:
+        logger.error(f"Failed to open the vector store at {CHROMA_PATH}: {str(e)}")
+        return None
@@ -0,0 +1,235 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from indexing import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+SUGGEST_LIMIT = int(os.getenv('SUGGEST_LIMIT', '8'))
+SUGGEST_MAX_LIMIT = int(os.getenv('SUGGEST_MAX_LIMIT', '20'))
+# Pages collected under a prefix before ranking; bounds the work for one- or two-letter prefixes
+SUGGEST_CANDIDATES = int(os.getenv('SUGGEST_CANDIDATES', '200'))
+# How often, in seconds, /suggest checks whether another process changed the index
+SUGGEST_CHECK_INTERVAL = float(os.getenv('SUGGEST_CHECK_INTERVAL', '1.0'))
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+def url_words(url):
+    """Words of a URL's host (without www.) and path"""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').removeprefix('www.')
+    return tokenize(f"{host} {parts.path}")
+
+
+class _Node:
+    __slots__ = ('children', 'keys')
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()
+
+
+class PrefixIndex:
+    """Character trie over the words of page titles and URLs.
+
+    Pages are keyed by their normalized URL, like the documents in the
+    index. Each word's final node holds the pages containing that word, so
+    adding or deleting a page only touches the paths of its own words. Content is
+    never indexed. Reads and writes share one lock; a lookup walks the
+    prefix and collects at most ``candidates`` pages breadth-first, so
+    shorter completions come first and cost stays flat for short prefixes.
+    """
+
+    def __init__(self, candidates=SUGGEST_CANDIDATES):
+        self.candidates = candidates
+        self._root = _Node()
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def add(self, url, title, favicon=None, timestamp=None):
+        """Add or replace the entry of a page"""
+        key = normalize_url(url)
+        words = set(tokenize(title)) | set(url_words(url))
+        with self._lock:
+            self._remove(key)
+            self._pages[key] = {"url": url, "title": title or url, "favicon": favicon, "timestamp": timestamp or '',
+                                "title_words": tuple(tokenize(title)), "words": frozenset(words)}
+            for word in words:
+                node = self._root
+                for char in word:
+                    node = node.children.setdefault(char, _Node())
+                node.keys.add(key)
+
+    def delete(self, url):
+        with self._lock:
+            return self._remove(normalize_url(url))
+
+    def _remove(self, key):
+        page = self._pages.pop(key, None)
+        if page is None:
+            return False
+        for word in page["words"]:
+            path = [self._root]
+            for char in word:
+                path.append(path[-1].children[char])
+            path[-1].keys.discard(key)
+            # Prune nodes that no longer lead to any page
+            for depth in range(len(word), 0, -1):
+                node = path[depth]
+                if node.keys or node.children:
+                    break
+                del path[depth - 1].children[word[depth - 1]]
+        return True
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """Pages whose title or URL has a word starting with every word of the query, best first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # The longest word is usually the most selective one to walk
+        anchor = max(tokens, key=len)
+        others = [token for token in tokens if token is not anchor]
+        prefix = ' '.join(tokens)
+
+        with self._lock:
+            matches = []
+            for key in self._collect(anchor):
+                page = self._pages[key]
+                if all(any(word.startswith(token) for word in page["words"]) for token in others):
+                    matches.append(page)
+
+        def rank(page):
+            title = ' '.join(page["title_words"])
+            in_title = all(any(word.startswith(token) for word in page["title_words"]) for token in tokens)
+            return (not title.startswith(prefix), not in_title, len(title))
+
+        # Newest first among equally ranked pages
+        matches.sort(key=lambda page: page["timestamp"], reverse=True)
+        matches.sort(key=rank)
+        return [{"url": page["url"], "title": page["title"], "favicon": page["favicon"]} for page in matches[:limit]]
+
+    def _collect(self, prefix):
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        found, queue = [], deque([node])
+        seen = set()
+        while queue and len(found) < self.candidates:
+            node = queue.popleft()
+            for key in node.keys:
+                if key not in seen:
+                    seen.add(key)
+                    found.append(key)
+            queue.extend(node.children.values())
+        return found
+
+
+class SuggestIndex:
+    """PrefixIndex kept in step with the search backend.
+
+    This process's own adds and deletes are applied incrementally. When the
+    search cache generation moves without them (another worker or
+    import_urls.py wrote to the index), the trie is rebuilt from the
+    backend's listing on a background thread and swapped in whole, while
+    lookups keep using the previous one.
+    """
+
+    def __init__(self, backend, search_cache=None, check_interval=SUGGEST_CHECK_INTERVAL, page_size=1000):
+        self.backend = backend
+        self.search_cache = search_cache
+        self.check_interval = check_interval
+        self.page_size = page_size
+        self.index = PrefixIndex()
+        self.generation = None
+        self.loaded = False
+        self._next_check = 0.0
+        self._loading = False
+        # Writes made while a reload runs, replayed on the new trie before it is swapped in
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, url, title, favicon=None, timestamp=None):
+        with self._lock:
+            if self._loading:
+                self._pending.append(("add", (url, title, favicon, timestamp)))
+            index = self.index
+        index.add(url, title, favicon, timestamp)
+
+    def delete(self, url):
+        with self._lock:
+            if self._loading:
+                self._pending.append(("delete", (url,)))
+            index = self.index
+        index.delete(url)
+
+    def advance(self, generation):
+        """Record a generation bump caused by this process's own, already applied, write"""
+        with self._lock:
+            if generation is not None and self.generation is not None and generation == self.generation + 1:
+                self.generation = generation
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        self._check()
+        return self.index.suggest(query, limit)
+
+    def _check(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._loading or now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            generation = self.search_cache.generation() if self.search_cache else None
+            if self.loaded and generation == self.generation:
+                return
+            # Another process's write may not be listed yet; reload once it is, or it stays missing until the next one
+            if self.loaded and generation is not None and not self.search_cache.settled(generation):
+                return
+            self._loading = True
+        threading.Thread(target=self._reload, args=(generation,), name="suggest-reload", daemon=True).start()
+
+    def _reload(self, generation):
+        started = time.perf_counter()
+        try:
+            index, search_after = PrefixIndex(self.index.candidates), None
+            while True:
+                hits = self.backend.list_page(self.page_size, search_after)
+                for hit in hits:
+                    source = hit["_source"]
+                    index.add(source["url"], source.get("title"), source.get("favicon"), source.get("timestamp"))
+                if len(hits) < self.page_size:
+                    break
+                search_after = hits[-1]["sort"]
+            with self._lock:
+                for kind, args in self._pending:
+                    getattr(index, kind)(*args)
+                self.index = index
+                self.generation = generation
+                self.loaded = True
+            logger.info(f"Loaded {len(index)} pages into the suggest index in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            self.backend.report_error(e)
+            logger.error(f"Failed to load the suggest index: {str(e)}")
+        finally:
+            with self._lock:
+                self._loading = False
+                self._pending = []
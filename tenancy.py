@@ -0,0 +1,33 @@
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Request header naming the user whose library a request works on. It is set by
+# the authenticating proxy in front of the app; requests without it use the
+# shared library, which holds every page stored without an owner
+USER_HEADER = os.getenv('USER_HEADER', 'X-User-Id')
+
+# Field of the webpages mapping holding a page's owner; also its routing value
+OWNER_PROPERTIES = {
+    "user_id": {"type": "keyword"}
+}
+
+
+def user_from_headers(headers):
+    """Owner of the library a request works on, or None for the shared library"""
+    return (headers.get(USER_HEADER) or '').strip() or None
+
+
+def owner_filter(user_id):
+    """Filter clause matching the pages of one user's library, or of the shared library"""
+    if user_id is None:
+        return {"bool": {"must_not": [{"exists": {"field": "user_id"}}]}}
+    return {"term": {"user_id": user_id}}
+
+
+def with_owner(query, user_id):
+    """Restrict a query to one library. The filter does not score, so Elasticsearch caches it per segment"""
+    return {"bool": {"must": [query], "filter": [owner_filter(user_id)]}}
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from embedded_index import EmbeddedIndex, highlight_fragments, query_grams
+from indexing import build_document, document_id
+from search_queries import HIGHLIGHT
+
+PAGES = {
+    "https://example.com/python": ("Python Tutorial", "Learn python programming with small examples."),
+    "https://example.com/pandas": ("Pandas Guide", "Dataframes in pandas for python developers."),
+    "https://example.com/rust": ("Rust Book", "Ownership and borrowing explained for systems programmers.")
+}
+
+
+class TestEmbeddedIndex(unittest.TestCase):
+    """Ranking, tiers, deletes and highlights of the embedded index against a temporary SQLite file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = EmbeddedIndex(os.path.join(self.directory, 'index.sqlite3'))
+        for i, (url, (title, content)) in enumerate(PAGES.items()):
+            self.add(url, title, content, timestamp=f"2024-01-0{i + 1}T00:00:00")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, url, title, content, user_id=None, timestamp=None):
+        document = build_document(url, {"title": title, "content": content, "favicon": None}, user_id)
+        if timestamp:
+            document["timestamp"] = timestamp
+        self.index.upsert(document_id(url, user_id), document)
+
+    def search(self, query, **kwargs):
+        kwargs.setdefault('min_hits', 1)
+        tier, results = self.index.tiered_search(query, **kwargs)
+        return tier, [hit["_source"]["url"] for hit in results["hits"]["hits"]], results
+
+    def test_exact_tier(self):
+        tier, urls, _ = self.search("pandas")
+        self.assertEqual(tier, "exact")
+        self.assertEqual(urls, ["https://example.com/pandas"])
+
+    def test_title_match_ranks_first(self):
+        tier, urls, _ = self.search("python")
+        self.assertEqual(tier, "exact")
+        self.assertEqual(urls, ["https://example.com/python", "https://example.com/pandas"])
+
+    def test_prefix_matches_longer_words(self):
+        _, urls, _ = self.search("progr")
+        self.assertCountEqual(urls, ["https://example.com/python", "https://example.com/rust"])
+
+    def test_long_query_terms_are_clipped_to_max_gram(self):
+        self.assertEqual(query_grams("Programming a"), ["programmin"])
+        _, urls, _ = self.search("programming")
+        self.assertIn("https://example.com/python", urls)
+
+    def test_fuzzy_tier_when_exact_finds_too_few(self):
+        tier, urls, _ = self.search("pyhton")
+        self.assertEqual(tier, "fuzzy")
+        self.assertEqual(urls[0], "https://example.com/python")
+
+    def test_fuzzy_terms_keep_their_first_characters(self):
+        # "bython" is one edit from "python", but does not share its first two characters
+        tier, urls, _ = self.search("bython")
+        self.assertEqual(tier, "fuzzy")
+        self.assertEqual(urls, [])
+
+    def test_pinned_tier(self):
+        tier, urls, _ = self.search("pandas", tier="fuzzy")
+        self.assertEqual(tier, "fuzzy")
+        self.assertEqual(urls, ["https://example.com/pandas"])
+
+    def test_search_after_continues_the_ranking(self):
+        _, all_urls, _ = self.search("python", size=10)
+        _, first, results = self.search("python", size=1)
+        after = results["hits"]["hits"][-1]["sort"]
+        _, second, _ = self.search("python", size=1, tier="exact", search_after=after)
+        self.assertEqual(first + second, all_urls)
+
+    def test_delete(self):
+        doc_id = document_id("https://example.com/rust")
+        self.assertTrue(self.index.delete(doc_id))
+        self.assertFalse(self.index.delete(doc_id))
+        self.assertEqual(self.index.count(), 2)
+        self.assertEqual(self.search("ownership")[1], [])
+        self.assertEqual(self.search("progr")[1], ["https://example.com/python"])
+        listed = [hit["_source"]["url"] for hit in self.index.list_page(10)]
+        self.assertNotIn("https://example.com/rust", listed)
+
+    def test_upsert_replaces_postings(self):
+        self.add("https://example.com/rust", "Rust Book", "Lifetimes and traits.")
+        self.assertEqual(self.index.count(), 3)
+        self.assertEqual(self.search("ownership")[1], [])
+        self.assertEqual(self.search("lifetimes")[1], ["https://example.com/rust"])
+
+    def test_list_page_is_newest_first(self):
+        hits = self.index.list_page(2)
+        self.assertEqual([hit["_source"]["url"] for hit in hits],
+                         ["https://example.com/rust", "https://example.com/pandas"])
+        rest = self.index.list_page(2, search_after=hits[-1]["sort"])
+        self.assertEqual([hit["_source"]["url"] for hit in rest], ["https://example.com/python"])
+
+    def test_hit_highlights(self):
+        _, _, results = self.search("progr")
+        hit = results["hits"]["hits"][0]
+        self.assertIn("<mark>programming</mark>", hit["highlight"]["content"][0])
+        self.assertNotIn("title", hit["highlight"])
+
+        _, _, results = self.search("python")
+        hit = results["hits"]["hits"][0]
+        self.assertEqual(hit["highlight"]["title"], ["<mark>Python</mark> Tutorial"])
+
+
+class TestHighlightFragments(unittest.TestCase):
+
+    options = {**HIGHLIGHT["fields"]["content"], "fragment_size": 40, "number_of_fragments": 2}
+
+    def test_marks_whole_words_starting_with_a_gram(self):
+        fragments = highlight_fragments("Searching is fast", ("sea",), self.options)
+        self.assertEqual(fragments, ["<mark>Searching</mark> is fast"])
+
+    def test_fragments_start_and_end_on_word_boundaries(self):
+        text = ' '.join(f"word{i}" for i in range(40)) + " needle " + ' '.join(f"word{i}" for i in range(40))
+        fragment, = highlight_fragments(text, ("needle",), self.options)
+        plain = fragment.replace("<mark>", "").replace("</mark>", "")
+        self.assertIn("<mark>needle</mark>", fragment)
+        self.assertLessEqual(len(plain), self.options["fragment_size"])
+        self.assertIn(f" {plain} ", f" {text} ")
+        # A quarter of the fragment, widened to the word boundary, is context before the match
+        self.assertGreaterEqual(plain.index("needle"), self.options["fragment_size"] // 4)
+        self.assertLess(plain.index("needle"), self.options["fragment_size"] // 2)
+
+    def test_number_of_fragments(self):
+        text = ("needle " + "filler " * 20) * 5
+        fragments = highlight_fragments(text, ("needle",), self.options)
+        self.assertEqual(len(fragments), 2)
+        self.assertTrue(all("<mark>needle</mark>" in fragment for fragment in fragments))
+
+    def test_no_match(self):
+        self.assertEqual(highlight_fragments("nothing here", ("needle",), self.options), [])
+        self.assertEqual(highlight_fragments("", ("needle",), self.options), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from backends import EmbeddedBackend
+from embedded_index import EmbeddedIndex
+from fingerprints import (NEAR_DUPLICATE_DISTANCE, SIMHASH_BANDS, SIMHASH_BITS, check_document, hamming_distance,
+                          simhash, simhash_bands)
+from indexing import build_document, document_id
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima",
+         "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango", "uniform", "victor", "whiskey"]
+
+
+def text(seed, words=1000):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+class TestSimhashBands(unittest.TestCase):
+
+    def test_bands_cover_every_bit_once(self):
+        bands = simhash_bands((1 << SIMHASH_BITS) - 1)
+        self.assertEqual(len(bands), SIMHASH_BANDS)
+        self.assertEqual(sum(int(band.split(':')[1], 16).bit_length() for band in bands), SIMHASH_BITS)
+
+    def test_hashes_within_the_distance_share_a_band(self):
+        rng = random.Random(7)
+        for _ in range(500):
+            value = rng.getrandbits(SIMHASH_BITS)
+            flipped = value
+            for bit in rng.sample(range(SIMHASH_BITS), NEAR_DUPLICATE_DISTANCE):
+                flipped ^= 1 << bit
+            self.assertTrue(set(simhash_bands(value)) & set(simhash_bands(flipped)))
+
+    def test_band_edges(self):
+        # A bit flipped at the first or last position of every band but the last leaves only that one shared
+        width = SIMHASH_BITS // SIMHASH_BANDS
+        value = 0
+        for band in range(min(NEAR_DUPLICATE_DISTANCE, SIMHASH_BANDS - 1)):
+            value |= 1 << (band * width + (width - 1 if band % 2 else 0))
+        shared = set(simhash_bands(0)) & set(simhash_bands(value))
+        self.assertEqual(shared, {simhash_bands(0)[-1]})
+
+    def test_simhash_is_close_for_small_edits(self):
+        original = text(1)
+        edited = original.replace("alpha", "zulu", 1)
+        self.assertLessEqual(hamming_distance(simhash(original), simhash(edited)), NEAR_DUPLICATE_DISTANCE)
+        self.assertGreater(hamming_distance(simhash(original), simhash(text(2))), NEAR_DUPLICATE_DISTANCE)
+
+
+class TestCheckDocument(unittest.TestCase):
+    """check_document against an embedded backend in a temporary SQLite file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = EmbeddedBackend(EmbeddedIndex(os.path.join(self.directory, 'index.sqlite3')))
+        self.original = text(1)
+        self.store("https://example.com/original", "Original", self.original)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def document(self, url, title, content):
+        return build_document(url, {"title": title, "content": content, "favicon": None})
+
+    def store(self, url, title, content):
+        document = self.document(url, title, content)
+        self.assertEqual(check_document(self.backend, document_id(url), document), "index")
+        self.backend.index_document(document_id(url), document)
+        return document
+
+    def test_identical_page_is_unchanged(self):
+        document = self.document("https://example.com/original", "Original", self.original)
+        self.assertEqual(check_document(self.backend, document_id("https://example.com/original"), document),
+                         "unchanged")
+
+    def test_changed_title_is_rewritten(self):
+        document = self.document("https://example.com/original", "Renamed", self.original)
+        self.assertEqual(check_document(self.backend, document_id("https://example.com/original"), document),
+                         "index")
+
+    def test_trivially_edited_copy_is_a_duplicate(self):
+        url = "https://mirror.example.com/copy"
+        document = self.document(url, "Copy", self.original.replace("alpha", "zulu", 1))
+        self.assertEqual(check_document(self.backend, document_id(url), document, policy='skip'), "duplicate")
+        self.assertEqual(document["duplicate_of"], "https://example.com/original")
+        self.assertEqual(document["cluster"], document_id("https://example.com/original"))
+
+    def test_marked_duplicate_joins_the_cluster(self):
+        url = "https://mirror.example.com/copy"
+        document = self.document(url, "Copy", self.original.replace("alpha", "zulu", 1))
+        self.assertEqual(check_document(self.backend, document_id(url), document, policy='mark'), "index")
+        self.assertEqual(document["cluster"], document_id("https://example.com/original"))
+
+    def test_unrelated_page_is_new(self):
+        url = "https://example.com/other"
+        document = self.document(url, "Other", text(2))
+        self.assertEqual(check_document(self.backend, document_id(url), document, policy='skip'), "index")
+        self.assertEqual(document["cluster"], document_id(url))
+        self.assertNotIn("duplicate_of", document)
+
+    def test_short_pages_are_never_duplicates(self):
+        self.store("https://example.com/login", "Sign in", "Please sign in to continue")
+        url = "https://example.org/login"
+        document = self.document(url, "Sign in", "Please sign in to continue")
+        self.assertEqual(document["simhash_bands"], [])
+        self.assertEqual(check_document(self.backend, document_id(url), document, policy='skip'), "index")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import unittest
+from urllib.parse import quote
+
+# The app reads its configuration at import
+_directory = tempfile.mkdtemp()
+os.environ.update({
+    'SEARCH_BACKEND': 'elasticsearch',
+    'SEARCH_CACHE_BACKEND': 'none',
+    'SEMANTIC_SEARCH': 'false',
+    'INGEST_MODE': 'sync',
+    'FAVICON_CACHE_PATH': os.path.join(_directory, 'favicon_cache.sqlite3'),
+    'RECRAWL_STATE_PATH': os.path.join(_directory, 'crawl_state.sqlite3'),
+    'HTML_ARCHIVE_PATH': os.path.join(_directory, 'html_archive.sqlite3'),
+    'EMBEDDED_INDEX_PATH': os.path.join(_directory, 'search_index.sqlite3')
+})
+
+import app as webapp  # noqa: E402
+from benchmarks.fake_es import FakeCluster, fake_client  # noqa: E402
+from clear_db import prune_deleted  # noqa: E402
+from benchmarks.fixture_server import FixtureServer  # noqa: E402
+from indexing import index_body  # noqa: E402
+from tenancy import USER_HEADER  # noqa: E402
+
+# Enough shards that a request missing a page's routing almost never lands on the shard holding it
+SHARDED_INDEX_BODY = {**index_body(), "settings": {**index_body()["settings"], "number_of_shards": 16}}
+
+
+def tearDownModule():
+    shutil.rmtree(_directory, ignore_errors=True)
+
+
+class TestLibraries(unittest.TestCase):
+    """Per-user libraries of the Flask app, against the in-process Elasticsearch stand-in"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fixtures = FixtureServer().start()
+        cls.shared_page, cls.alice_page, cls.bob_page = cls.fixtures.page_urls(3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fixtures.stop()
+
+    def setUp(self):
+        self.es = fake_client(FakeCluster())
+        self.es.indices.create(index="webpages", body=SHARDED_INDEX_BODY)
+        webapp.es_manager.set_client(self.es)
+        self.client = webapp.app.test_client()
+
+        self.add(self.shared_page)
+        self.add(self.alice_page, 'alice')
+        self.add(self.bob_page, 'bob')
+        # The same page, in every library
+        self.common_page = self.fixtures.page_url(3)
+        for user_id in (None, 'alice', 'bob'):
+            self.add(self.common_page, user_id)
+
+    def headers(self, user_id):
+        return {USER_HEADER: user_id} if user_id else {}
+
+    def add(self, url, user_id=None):
+        response = self.client.post('/add_url', data={'url': url}, headers=self.headers(user_id))
+        self.assertEqual(response.status_code, 200, response.json)
+        self.es.indices.refresh(index="webpages")
+
+    def listed(self, user_id=None):
+        response = self.client.get('/urls', headers=self.headers(user_id))
+        self.assertEqual(response.status_code, 200)
+        return {item["url"] for item in response.json}
+
+    def title_word(self, url, owner=None):
+        """First word of the title a library stores for a page, to search for it"""
+        items = self.client.get('/urls', headers=self.headers(owner)).json
+        return next(item["title"] for item in items if item["url"] == url).split()[0]
+
+    def found(self, query, user_id=None):
+        response = self.client.get('/search', query_string={'q': query}, headers=self.headers(user_id))
+        self.assertEqual(response.status_code, 200)
+        return {item["url"] for item in response.json}
+
+    def delete(self, url, user_id=None):
+        response = self.client.delete(f'/url/{quote(url, safe=":/")}', headers=self.headers(user_id))
+        self.es.indices.refresh(index="webpages")
+        return response.status_code
+
+    def test_listings_hold_only_the_library(self):
+        self.assertEqual(self.listed(), {self.shared_page, self.common_page})
+        self.assertEqual(self.listed('alice'), {self.alice_page, self.common_page})
+        self.assertEqual(self.listed('bob'), {self.bob_page, self.common_page})
+
+    def test_search_stays_in_the_library(self):
+        bob_word = self.title_word(self.bob_page, 'bob')
+        self.assertIn(self.bob_page, self.found(bob_word, 'bob'))
+        self.assertNotIn(self.bob_page, self.found(bob_word, 'alice'))
+        self.assertNotIn(self.bob_page, self.found(bob_word))
+
+        shared_word = self.title_word(self.shared_page)
+        self.assertIn(self.shared_page, self.found(shared_word))
+        self.assertNotIn(self.shared_page, self.found(shared_word, 'alice'))
+
+    def test_cannot_delete_another_users_page(self):
+        self.assertEqual(self.delete(self.bob_page, 'alice'), 404)
+        self.assertEqual(self.delete(self.shared_page, 'alice'), 404)
+        self.assertIn(self.bob_page, self.listed('bob'))
+        self.assertIn(self.shared_page, self.listed())
+
+    def test_deleting_a_copy_keeps_the_others(self):
+        self.assertEqual(self.delete(self.common_page, 'alice'), 200)
+        self.assertNotIn(self.common_page, self.listed('alice'))
+        self.assertIn(self.common_page, self.listed('bob'))
+        self.assertIn(self.common_page, self.listed())
+        common_word = self.title_word(self.common_page)
+        self.assertNotIn(self.common_page, self.found(common_word, 'alice'))
+        self.assertIn(self.common_page, self.found(common_word, 'bob'))
+        self.assertIn(self.common_page, self.found(common_word))
+
+    def test_shared_delete_keeps_user_copies(self):
+        self.assertEqual(self.delete(self.common_page), 200)
+        self.assertNotIn(self.common_page, self.listed())
+        self.assertIn(self.common_page, self.listed('alice'))
+        self.assertIn(self.common_page, self.listed('bob'))
+
+    def test_reindex_prunes_deleted_user_pages(self):
+        self.es.indices.create(index="webpages-000002", body=SHARDED_INDEX_BODY)
+        self.es.reindex(body={"source": {"index": "webpages"}, "dest": {"index": "webpages-000002"}}, refresh=True)
+        # Deleted while the copy ran
+        for url, user_id in ((self.alice_page, 'alice'), (self.bob_page, 'bob'), (self.common_page, 'alice'),
+                             (self.common_page, 'bob')):
+            self.assertEqual(self.delete(url, user_id), 200)
+
+        self.assertEqual(prune_deleted(self.es, "webpages", "webpages-000002"), 4)
+        self.es.indices.refresh(index="webpages-000002")
+        self.assertEqual(self.es.count(index="webpages-000002")["count"], self.es.count(index="webpages")["count"])
+
+
+if __name__ == '__main__':
+    unittest.main()